@@ -0,0 +1,168 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from config import settings
+from parser_types import Entity, EntityType
+
+
+@dataclass
+class ArchiveRecord:
+    entity_type: str
+    entity_id: int
+    timestamp: float
+    status: int
+    offset: int
+    length: int
+
+
+class Archive:
+    """Архив HTTP-ответов сервера расписания.
+
+    Ответы дописываются в responses.gz отдельными gzip-членами (весь файл
+    остается валидным gzip-потоком), а index.jsonl хранит по строке на ответ
+    с его смещением, что позволяет читать любой ответ без распаковки соседних.
+    Сжатие и запись идут в потоке asyncio.to_thread, чтобы не блокировать цикл
+    событий; файлы открываются при первой записи и закрываются в close.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_path = os.path.join(path, "responses.gz")
+        self.index_path = os.path.join(path, "index.jsonl")
+        self._data_file = None
+        self._index_file = None
+        self._index: Optional[Dict[Tuple[str, int], List[ArchiveRecord]]] = None
+        # Записи из разных потоков не должны перемешать смещения
+        self._lock = threading.Lock()
+
+    async def record(self, entity: Entity, status: int, body: str):
+        await asyncio.to_thread(self._write, entity, status, body)
+
+    def _write(self, entity: Entity, status: int, body: str):
+        blob = gzip.compress(body.encode("utf-8"))
+        with self._lock:
+            self._append(entity, status, blob)
+
+    def _append(self, entity: Entity, status: int, blob: bytes):
+        if self._data_file is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._data_file = open(self.data_path, "ab")
+            self._index_file = open(self.index_path, "a", encoding="utf-8")
+
+        offset = self._data_file.tell()
+        self._data_file.write(blob)
+        self._data_file.flush()
+
+        # Индекс пишется после данных: оборванная запись остается "сиротой"
+        # в responses.gz, но никогда не указывает на недописанные данные
+        record = ArchiveRecord(
+            entity_type=entity.type.value,
+            entity_id=entity.id,
+            timestamp=time.time(),
+            status=status,
+            offset=offset,
+            length=len(blob),
+        )
+        self._index_file.write(json.dumps(asdict(record)) + "\n")
+        self._index_file.flush()
+
+        if self._index is not None:
+            self._index.setdefault((record.entity_type, record.entity_id), []).append(
+                record
+            )
+
+    def find(
+        self, entity_type: EntityType, entity_id: int, at: Optional[float] = None
+    ) -> Optional[ArchiveRecord]:
+        records = self._load_index().get((entity_type.value, entity_id), [])
+        for record in reversed(records):
+            if at is None or record.timestamp <= at:
+                return record
+        return None
+
+    def read(self, record: ArchiveRecord) -> str:
+        with open(self.data_path, "rb") as data_file:
+            data_file.seek(record.offset)
+            return gzip.decompress(data_file.read(record.length)).decode("utf-8")
+
+    def entities(self, at: Optional[float] = None) -> List[Entity]:
+        entities = []
+        for (entity_type, entity_id), records in self._load_index().items():
+            if at is None or records[0].timestamp <= at:
+                entities.append(Entity(EntityType(entity_type), entity_id))
+        return entities
+
+    def close(self):
+        with self._lock:
+            if self._data_file:
+                self._data_file.close()
+                self._index_file.close()
+                self._data_file = None
+                self._index_file = None
+
+    def _load_index(self) -> Dict[Tuple[str, int], List[ArchiveRecord]]:
+        if self._index is not None:
+            return self._index
+
+        self._index = {}
+        if not os.path.exists(self.index_path):
+            return self._index
+
+        with open(self.index_path, encoding="utf-8") as index_file:
+            for line in index_file:
+                try:
+                    record = ArchiveRecord(**json.loads(line))
+                except (ValueError, TypeError):
+                    # Последняя строка могла не дописаться при падении
+                    continue
+                self._index.setdefault(
+                    (record.entity_type, record.entity_id), []
+                ).append(record)
+
+        for records in self._index.values():
+            records.sort(key=lambda record: record.timestamp)
+
+        logger.debug(f"Loaded archive index with {len(self._index)} entities")
+        return self._index
+
+
+archive = (
+    Archive(settings.ARCHIVE_PATH)
+    if settings.FETCH_MODE in ("record", "replay")
+    else None
+)
+
+
+def _check_parser(path: str):
+    """Прогоняет парсер по последним ответам архива и печатает сбои."""
+    from parser import Parser
+
+    replay_archive = Archive(path)
+    parsed = failed = 0
+    start_time = time.perf_counter()
+    for entity in replay_archive.entities():
+        record = replay_archive.find(entity.type, entity.id)
+        if record.status != 200:
+            continue
+        try:
+            Parser._parse_timetable(replay_archive.read(record), entity)
+            parsed += 1
+        except Exception as e:
+            failed += 1
+            print(f"{entity.type.value} {entity.id}: {e}")
+
+    print(
+        f"Parsed {parsed} pages, {failed} failed, "
+        f"{time.perf_counter() - start_time:.2f} seconds"
+    )
+
+
+if __name__ == "__main__":
+    _check_parser(sys.argv[1] if len(sys.argv) > 1 else settings.ARCHIVE_PATH)
@@ -5,6 +5,22 @@ from profiler import profile
 
 
 class Auditorium:
+    @staticmethod
+    def lesson_key(lesson: Lesson) -> Tuple:
+        """Ключ одного занятия в аудитории: одинаковые занятия разных групп и
+        преподавателей сливаются в одно."""
+        return (
+            lesson.schedule_type,
+            lesson.time_begin,
+            lesson.lesson_name,
+            lesson.week_number,
+            lesson.day_name,
+            lesson.day_date,
+            lesson.auditorium,
+            lesson.lesson_type,
+            lesson.subgroups,
+        )
+
     @staticmethod
     @profile(func_name="audithorium.from_timetables")
     async def from_timetables(timetables: List[TimetableData]) -> List[TimetableData]:
@@ -21,17 +37,7 @@ class Auditorium:
                 if not lesson.auditorium:
                     continue
 
-                lesson_key = (
-                    lesson.schedule_type,
-                    lesson.time_begin,
-                    lesson.lesson_name,
-                    lesson.week_number,
-                    lesson.day_name,
-                    lesson.day_date,
-                    lesson.auditorium,
-                    lesson.lesson_type,
-                    lesson.subgroups,
-                )
+                lesson_key = Auditorium.lesson_key(lesson)
 
                 if lesson.auditorium not in auditoriums:
                     auditoriums[lesson.auditorium] = []
@@ -0,0 +1,205 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+from typing import List, Optional
+
+BASELINES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "benchmarks",
+    "baselines",
+)
+
+# Рост пика памяти меньше этого порога считается шумом аллокатора
+MEMORY_NOISE_BYTES = 64 * 1024
+
+
+def mann_whitney_p(samples1: List[float], samples2: List[float]) -> float:
+    """Двусторонний p-value U-критерия Манна-Уитни (нормальное приближение).
+
+    Меньше двух повторов в выборке значимость не оценить, поэтому 1.0: одно
+    падение скорости без повторов не считается регрессией."""
+    n1, n2 = len(samples1), len(samples2)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+
+    ranked = sorted(
+        [(value, 0) for value in samples1] + [(value, 1) for value in samples2]
+    )
+    ranks = [0.0] * len(ranked)
+    ties_correction = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tied = j - i + 1
+        ties_correction += tied**3 - tied
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties_correction / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    threshold: float,
+    memory_threshold: float,
+    alpha: float,
+) -> List[dict]:
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append({"stage": name, "status": "new"})
+            continue
+
+        speed_ratio = result["ops_per_sec"] / base["ops_per_sec"] - 1
+        p_value = mann_whitney_p(base["samples"], result["samples"])
+        memory_growth = result["peak_bytes"] - base["peak_bytes"]
+        memory_ratio = memory_growth / base["peak_bytes"] if base["peak_bytes"] else 0
+
+        problems = []
+        # Замедление засчитывается, только если оно больше порога и
+        # статистически отличимо от разброса между прогонами
+        if speed_ratio < -threshold and p_value < alpha:
+            problems.append("slower")
+        if memory_ratio > memory_threshold and memory_growth > MEMORY_NOISE_BYTES:
+            problems.append("memory")
+
+        rows.append(
+            {
+                "stage": name,
+                "status": ", ".join(problems) if problems else "ok",
+                "ops_change": speed_ratio,
+                "p_value": p_value,
+                "memory_change": memory_ratio,
+            }
+        )
+    return rows
+
+
+def default_name() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+
+def latest_baseline() -> Optional[str]:
+    if not os.path.isdir(BASELINES_DIR):
+        return None
+    baselines = [
+        os.path.join(BASELINES_DIR, name)
+        for name in os.listdir(BASELINES_DIR)
+        if name.endswith(".json")
+    ]
+    if not baselines:
+        return None
+
+    def timestamp(path):
+        with open(path, encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)["meta"]["timestamp"]
+
+    return max(baselines, key=timestamp)
+
+
+def load_report(args) -> dict:
+    if args.input:
+        with open(args.input, encoding="utf-8") as report_file:
+            return json.load(report_file)
+
+    from benchmark import STAGES, run_benchmarks
+
+    return run_benchmarks(args.entities, args.repeat, args.min_time, STAGES)
+
+
+def print_rows(rows: List[dict]):
+    for row in rows:
+        if row["status"] == "new":
+            print(f"{row['stage']}: new stage, no baseline")
+            continue
+        print(
+            f"{row['stage']}: {row['status']} "
+            f"(ops/s {row['ops_change']:+.1%}, p={row['p_value']:.3f}, "
+            f"peak memory {row['memory_change']:+.1%})"
+        )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Store benchmark baselines and check runs against them"
+    )
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+
+    for command in ("save", "compare"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument(
+            "--input", help="benchmark.py report, runs it if omitted"
+        )
+        subparser.add_argument("--entities", type=int, default=2000)
+        subparser.add_argument("--repeat", type=int, default=7)
+        subparser.add_argument("--min-time", type=float, default=0.2)
+
+    subparsers.choices["save"].add_argument("--name", default=None)
+    compare_parser = subparsers.choices["compare"]
+    compare_parser.add_argument("--baseline", help="baseline name, latest if omitted")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument("--memory-threshold", type=float, default=0.2)
+    compare_parser.add_argument("--alpha", type=float, default=0.05)
+
+    args = argument_parser.parse_args()
+    report = load_report(args)
+
+    if args.command == "save":
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        name = args.name or default_name()
+        report["meta"]["name"] = name
+        path = os.path.join(BASELINES_DIR, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as baseline_file:
+            json.dump(report, baseline_file, indent=2, ensure_ascii=False)
+        print(f"Saved baseline {path}")
+        return
+
+    if args.baseline:
+        baseline_path = os.path.join(BASELINES_DIR, f"{args.baseline}.json")
+    else:
+        baseline_path = latest_baseline()
+    if not baseline_path or not os.path.exists(baseline_path):
+        print("No baseline found, run 'baseline.py save' first", file=sys.stderr)
+        sys.exit(2)
+
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline["meta"].get("entities") != report["meta"].get("entities"):
+        print(
+            "Warning: baseline and run use different --entities, "
+            "pipeline stages are not comparable",
+            file=sys.stderr,
+        )
+
+    rows = compare(baseline, report, args.threshold, args.memory_threshold, args.alpha)
+    print(f"Compared against {baseline['meta'].get('name', baseline_path)}")
+    print_rows(rows)
+    if any(row["status"] not in ("ok", "new") for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+# Бенчмаркам не нужны MongoDB и RabbitMQ, но Settings требует их адреса
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+
+from audithorium import Auditorium  # noqa: E402
+from broker import Broker, DataEncoder  # noqa: E402
+from comparer import Comparer  # noqa: E402
+from config import settings  # noqa: E402
+from conflicts import ConflictDetector  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from database import Database, TimetableModel  # noqa: E402
+from lessontable import LessonTable  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from parser import Parser  # noqa: E402
+from parser_types import Entity  # noqa: E402
+from runner import Runner  # noqa: E402
+from standin import MOCK_DIR, MOCK_PAGES  # noqa: E402
+from synthetic import Synthetic  # noqa: E402
+
+
+class Benchmark:
+    def __init__(self, repeat: int = 5, min_time: float = 0.2):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.results: Dict[str, dict] = {}
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, name: str, fn: Callable[[], object], items: int = 1):
+        """Замеряет fn: items — сколько объектов обрабатывает один вызов."""
+        number = self._calibrate(fn)
+        samples = []
+        for _ in range(self.repeat):
+            gc.collect()
+            start_time = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - start_time
+            samples.append(number * items / elapsed)
+
+        # Память меряется отдельным прогоном: tracemalloc сильно замедляет код
+        gc.collect()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        blocks_before = sys.getallocatedblocks()
+        result = fn()
+        blocks_after = sys.getallocatedblocks()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+
+        self.results[name] = {
+            "ops_per_sec": statistics.median(samples),
+            "samples": samples,
+            "items": items,
+            "alloc_bytes": after - before,
+            "alloc_blocks": blocks_after - blocks_before,
+            "peak_bytes": peak - before,
+        }
+        print(
+            f"{name}: {self.results[name]['ops_per_sec']:.1f} ops/s, "
+            f"peak {self.results[name]['peak_bytes'] / 1024 / 1024:.2f} MB",
+            file=sys.stderr,
+        )
+
+    def run_async(self, name: str, coroutine_fn: Callable, items: int = 1):
+        self.run(name, lambda: self.loop.run_until_complete(coroutine_fn()), items)
+
+    def _calibrate(self, fn: Callable[[], object]) -> int:
+        number = 1
+        while True:
+            start_time = time.perf_counter()
+            for _ in range(number):
+                fn()
+            if time.perf_counter() - start_time >= self.min_time or number >= 1 << 20:
+                return number
+            number *= 2
+
+
+def bench_parser(benchmark: Benchmark):
+    # Тип сущности страницы берется из заглушки, чтобы страницы преподавателей
+    # разбирались как страницы преподавателей
+    for (entity_type, entity_id), file_name in sorted(
+        MOCK_PAGES.items(), key=lambda item: item[1]
+    ):
+        with open(os.path.join(MOCK_DIR, file_name), encoding="utf-8") as page:
+            html = page.read()
+        name = os.path.splitext(file_name)[0]
+        entity = Entity(entity_type, entity_id)
+        benchmark.run(
+            f"parser._parse_timetable[{name}]",
+            lambda html=html, entity=entity: Parser._parse_timetable(html, entity),
+        )
+
+
+def bench_pipeline(benchmark: Benchmark, entities: int):
+    groups_count = entities // 2
+    professors_count = entities - groups_count
+    old_timetables = Synthetic.timetables(groups_count, professors_count, revision=0)
+    new_timetables = Synthetic.timetables(groups_count, professors_count, revision=1)
+
+    benchmark.run_async(
+        "audithorium.from_timetables",
+        lambda: Auditorium.from_timetables(new_timetables),
+        items=len(new_timetables),
+    )
+    benchmark.run(
+        "lessontable.from_timetables",
+        lambda: LessonTable.from_timetables(new_timetables),
+        items=len(new_timetables),
+    )
+    table = LessonTable.from_timetables(new_timetables)
+    benchmark.run(
+        "conflicts.detect",
+        lambda: ConflictDetector.detect(table),
+        items=len(table),
+    )
+    pairs = list(zip(old_timetables, new_timetables))
+
+    async def compare_all():
+        for old_timetable, new_timetable in pairs:
+            await Comparer.compare_timetables(old_timetable, new_timetable)
+
+    benchmark.run_async("comparer.compare_timetables", compare_all, items=len(pairs))
+    benchmark.run_async(
+        "runner._detect_changes",
+        lambda: Runner._detect_changes(old_timetables, new_timetables),
+        items=len(new_timetables),
+    )
+    return old_timetables, new_timetables
+
+
+def bench_serialization(benchmark: Benchmark, old_timetables, new_timetables):
+    changes = benchmark.loop.run_until_complete(
+        Runner._detect_changes(old_timetables, new_timetables)
+    )
+    benchmark.run(
+        "broker.DataEncoder",
+        lambda: [json.dumps(change, cls=DataEncoder) for change in changes],
+        items=len(changes),
+    )
+    encoded = [json.dumps(change, cls=DataEncoder) for change in changes]
+    benchmark.run(
+        "broker.loads",
+        lambda: [Broker.loads(message) for message in encoded],
+        items=len(encoded),
+    )
+
+
+def bench_database(benchmark: Benchmark, timetables):
+    # Модели beanie нельзя создать без init_beanie, а ему нужен живой сервер
+    # (buildInfo, список коллекций); индексы при этом не трогаются
+    database = Database(settings.MONGODB_URI)
+    try:
+        benchmark.loop.run_until_complete(
+            init_beanie(
+                database=AsyncIOMotorClient(
+                    database.connection_string, serverSelectionTimeoutMS=3000
+                )["sibsau-timetable-benchmark"],
+                document_models=[TimetableModel],
+                skip_indexes=True,
+            )
+        )
+    except Exception as e:
+        print(
+            f"Skipping database benchmarks, MongoDB is unavailable: {e}",
+            file=sys.stderr,
+        )
+        return
+
+    benchmark.run(
+        "database._to_model",
+        lambda: [database._to_model(timetable) for timetable in timetables],
+        items=len(timetables),
+    )
+    models = [database._to_model(timetable) for timetable in timetables]
+    benchmark.run(
+        "database._from_model",
+        lambda: [database._from_model(model) for model in models],
+        items=len(models),
+    )
+
+
+STAGES = ["parser", "pipeline", "serialization", "database"]
+
+
+def run_benchmarks(
+    entities: int, repeat: int, min_time: float, stages: List[str]
+) -> dict:
+    benchmark = Benchmark(repeat=repeat, min_time=min_time)
+    if "parser" in stages:
+        bench_parser(benchmark)
+    if {"pipeline", "serialization", "database"} & set(stages):
+        old_timetables, new_timetables = bench_pipeline(benchmark, entities)
+        if "serialization" in stages:
+            bench_serialization(benchmark, old_timetables, new_timetables)
+        if "database" in stages:
+            bench_database(benchmark, new_timetables)
+    benchmark.loop.close()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "entities": entities,
+            "repeat": repeat,
+        },
+        "results": benchmark.results,
+    }
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Pipeline stage benchmarks")
+    argument_parser.add_argument("--entities", type=int, default=2000)
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--min-time", type=float, default=0.2)
+    argument_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    argument_parser.add_argument("--output", help="JSON file, stdout by default")
+    args = argument_parser.parse_args()
+
+    report = run_benchmarks(args.entities, args.repeat, args.min_time, args.stages)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,61 @@
 import aio_pika
 import json
-from typing import List
-from parser_types import TimetableChangeData
+import re
+import uuid
+from typing import List, Optional
+from parser_types import (
+    ChangeType,
+    DayName,
+    Entity,
+    EntityType,
+    FieldChange,
+    Lesson,
+    LessonChange,
+    LessonType,
+    ScheduleForm,
+    ScheduleType,
+    Subgroup,
+    TimetableChangeData,
+    WeekNumber,
+)
 from profiler import profile
 from loguru import logger
-from datetime import date, time, datetime, timedelta
+from datetime import date, time, datetime, timedelta, timezone
 from enum import Enum
 from logger import trace
+from config import settings
+
+# Точки разделяют слова ключа маршрутизации, * и # — шаблоны в привязках
+ROUTING_KEY_UNSAFE = re.compile(r"[\s.*#]+")
+ROUTING_WORD_MAX_BYTES = 64
+
+# Порядок важен: при совпадении значений побеждает первый тип, как в object_hook
+ENUM_TYPES = [
+    ScheduleType,
+    ScheduleForm,
+    WeekNumber,
+    DayName,
+    LessonType,
+    Subgroup,
+    EntityType,
+    ChangeType,
+]
+ENUM_VALUES = {}
+for enum_type in ENUM_TYPES:
+    for member in enum_type:
+        ENUM_VALUES.setdefault(member.value, member)
+
+DECODERS = {
+    "__enum__": lambda value: ENUM_VALUES.get(value, value),
+    "__datetime__": datetime.fromisoformat,
+    "__time__": time.fromisoformat,
+    "__timedelta__": lambda seconds: timedelta(seconds=seconds),
+    "__lesson__": lambda fields: Lesson(**fields),
+    "__entity__": lambda fields: Entity(**fields),
+    "__fieldchange__": lambda fields: FieldChange(**fields),
+    "__lessonchange__": lambda fields: LessonChange(**fields),
+    "__timetablechangedata__": lambda fields: TimetableChangeData(**fields),
+}
 
 
 class DataEncoder(json.JSONEncoder):
@@ -26,13 +75,31 @@ class DataEncoder(json.JSONEncoder):
 
 
 class Broker:
-    def __init__(self, connection_string: str, queue_name: str = "timetable_changes"):
+    def __init__(
+        self,
+        connection_string: str,
+        queue_name: str = "timetable_changes",
+        exchange_name: str = "",
+    ):
+        """exchange_name: пустое — изменения идут в очередь queue_name через
+        exchange по умолчанию; иначе — в topic exchange с ключами из routing_keys,
+        а очередь queue_name (если задана) привязывается к нему ключом "#"."""
         self.connection_string = connection_string
         self.queue_name = queue_name
+        self.exchange_name = exchange_name
         self.connection = None
         self.channel = None
+        self.exchange = None
         self.initialized = False
 
+    @staticmethod
+    def from_settings() -> "Broker":
+        return Broker(
+            settings.RABBITMQ_URI,
+            queue_name=settings.RABBITMQ_QUEUE,
+            exchange_name=settings.RABBITMQ_EXCHANGE,
+        )
+
     async def __aenter__(self):
         await self.initialize()
         return self
@@ -45,8 +112,21 @@ class Broker:
         if not self.initialized:
             try:
                 self.connection = await aio_pika.connect_robust(self.connection_string)
-                self.channel = await self.connection.channel()
-                await self.channel.declare_queue(self.queue_name, durable=True)
+                # С подтверждениями publish возвращается только после того, как
+                # брокер принял сообщение
+                self.channel = await self.connection.channel(publisher_confirms=True)
+                if self.exchange_name:
+                    self.exchange = await self.channel.declare_exchange(
+                        self.exchange_name, aio_pika.ExchangeType.TOPIC, durable=True
+                    )
+                    if self.queue_name:
+                        queue = await self.channel.declare_queue(
+                            self.queue_name, durable=True
+                        )
+                        await queue.bind(self.exchange, routing_key="#")
+                else:
+                    self.exchange = self.channel.default_exchange
+                    await self.channel.declare_queue(self.queue_name, durable=True)
                 self.initialized = True
                 logger.debug("Подключение к RabbitMQ инициализировано успешно")
             except Exception as e:
@@ -58,7 +138,7 @@ class Broker:
                 self.initialized = False
                 raise e
 
-    @profile(func_name="broker.send_changes")
+    @profile(func_name="broker.send_changes", stage="publish")
     @trace
     async def send_changes(self, changes: List[TimetableChangeData]) -> bool:
         if not changes:
@@ -75,9 +155,10 @@ class Broker:
                         body=json_data.encode(),
                         delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
                     )
-                    await self.channel.default_exchange.publish(
-                        message, routing_key=self.queue_name
+                    routing_keys = (
+                        Broker.routing_keys(change) if self.exchange_name else []
                     )
+                    await self._publish(message, routing_keys)
                 except Exception as e:
                     import traceback
 
@@ -93,12 +174,95 @@ class Broker:
             logger.error(traceback.format_exc())
             return False
 
+    @staticmethod
+    def outbox_entry(change: TimetableChangeData) -> dict:
+        """Запись outbox для изменения. id становится message_id сообщения, по нему
+        потребители отбрасывают повторы, если публикация прошла, а отметка о ней
+        в MongoDB — нет."""
+        return {
+            "id": uuid.uuid4().hex,
+            "body": json.dumps(change, cls=DataEncoder),
+            "routing_keys": Broker.routing_keys(change),
+            "created_at": datetime.now(timezone.utc),
+        }
+
+    @profile(func_name="broker.publish_outbox", stage="publish")
+    async def publish_outbox(self, entries: List[dict]) -> List[str]:
+        """Публикует записи outbox по порядку и возвращает id подтвержденных
+        брокером. На первой ошибке останавливается, чтобы не нарушить порядок
+        изменений сущности; остальные записи уйдут при следующей попытке."""
+        await self.initialize()
+
+        published = []
+        for entry in entries:
+            message = aio_pika.Message(
+                body=entry["body"].encode(),
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                message_id=entry["id"],
+                timestamp=entry["created_at"],
+                content_type="application/json",
+            )
+            routing_keys = entry.get("routing_keys")
+            if self.exchange_name and not routing_keys:
+                routing_keys = Broker.routing_keys(Broker.loads(entry["body"]))
+            try:
+                await self._publish(message, routing_keys)
+            except Exception as e:
+                logger.error(f"Failed to publish outbox entry {entry['id']}: {e}")
+                break
+            published.append(entry["id"])
+        return published
+
+    async def _publish(self, message: aio_pika.Message, routing_keys: List[str]):
+        if not self.exchange_name:
+            await self.exchange.publish(message, routing_key=self.queue_name)
+            return
+        # Остальные ключи — sender-selected distribution: очередь, подходящая
+        # под несколько ключей, все равно получает одну копию сообщения
+        if len(routing_keys) > 1:
+            message.headers["BCC"] = routing_keys[1:]
+        await self.exchange.publish(message, routing_key=routing_keys[0])
+
+    @staticmethod
+    def routing_keys(change: TimetableChangeData) -> List[str]:
+        """Ключи маршрутизации изменения для topic exchange. Первый —
+        entity.<тип>.<id>.<имя> самой сущности, остальные — lesson.professor.<имя>,
+        lesson.group.<имя> и lesson.auditorium.<имя> затронутых занятий, например
+        entity.group.1234.БПИ23-01 и lesson.professor.Алиева_Д_П."""
+        entity = change.entity
+        keys = [
+            "entity."
+            f"{entity.type.value}.{entity.id}.{Broker._routing_word(entity.name)}"
+        ]
+        for lesson_change in change.lesson_changes or []:
+            for lesson in (lesson_change.old_lesson, lesson_change.new_lesson):
+                if lesson is None:
+                    continue
+                for professor in lesson.professors or []:
+                    keys.append(f"lesson.professor.{Broker._routing_word(professor)}")
+                for group in lesson.groups or []:
+                    keys.append(f"lesson.group.{Broker._routing_word(group)}")
+                if lesson.auditorium:
+                    keys.append(
+                        f"lesson.auditorium.{Broker._routing_word(lesson.auditorium)}"
+                    )
+        return list(dict.fromkeys(keys))
+
+    @staticmethod
+    def _routing_word(value: Optional[str]) -> str:
+        word = ROUTING_KEY_UNSAFE.sub("_", value or "").strip("_") or "_"
+        encoded = word.encode()
+        if len(encoded) > ROUTING_WORD_MAX_BYTES:
+            word = encoded[:ROUTING_WORD_MAX_BYTES].decode(errors="ignore")
+        return word
+
     @profile(func_name="broker.close")
     async def close(self):
         if self.connection:
             await self.connection.close()
             self.connection = None
             self.channel = None
+            self.exchange = None
             self.initialized = False
         logger.debug("RabbitMQ соединение закрыто")
 
@@ -169,9 +333,22 @@ class Broker:
 
         return obj
 
+    @staticmethod
+    def decode_hook(obj: dict):
+        """То же, что object_hook, но за один поиск в словаре: json вызывает хук
+        снизу вверх, поэтому вложенные объекты уже декодированы, а значения
+        перечислений ищутся в общей таблице, а не перебором типов."""
+        if len(obj) != 1:
+            return obj
+        key, value = next(iter(obj.items()))
+        decoder = DECODERS.get(key)
+        if decoder is None:
+            return obj
+        return decoder(value)
+
     @staticmethod
     def loads(data_str):
-        return json.loads(data_str, object_hook=Broker.object_hook)
+        return json.loads(data_str, object_hook=Broker.decode_hook)
 
     @staticmethod
     @profile(func_name="broker.process_message")
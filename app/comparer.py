@@ -4,15 +4,17 @@ from parser_types import (
     ChangeType,
     FieldChange,
     LessonChange,
+    Lesson,
+    LessonsDiff,
 )
-from typing import Optional
+from typing import Dict, List, Optional
 from logger import trace
 from profiler import profile
 
 
 class Comparer:
     @staticmethod
-    @profile(func_name="comparer.compare_timetables")
+    @profile(func_name="comparer.compare_timetables", stage="diff")
     async def compare_timetables(
         timetable1: TimetableData, timetable2: TimetableData
     ) -> Optional[TimetableChangeData]:
@@ -129,6 +131,167 @@ class Comparer:
             lesson_changes=lesson_changes,
         )
 
+    @staticmethod
+    @profile(func_name="comparer.merge_changes")
+    def merge_changes(
+        changes: List[TimetableChangeData],
+    ) -> Optional[TimetableChangeData]:
+        """Сводит последовательные изменения одной сущности в одну итоговую разницу.
+
+        Для каждого занятия берется состояние до первого изменения и после
+        последнего, поэтому добавленное и затем удаленное занятие или поле,
+        вернувшееся к старому значению, пропадают. None, если изменения
+        компенсировали друг друга.
+        """
+        if not changes:
+            return None
+
+        metadata_states: Dict[str, list] = {}
+        lesson_states: Dict[tuple, list] = {}
+        for change in changes:
+            for field_change in change.metadata_changes or []:
+                state = metadata_states.setdefault(
+                    field_change.field_name, [field_change.old_value, None]
+                )
+                state[1] = field_change.new_value
+            for lesson_change in change.lesson_changes or []:
+                lesson = lesson_change.old_lesson or lesson_change.new_lesson
+                state = lesson_states.setdefault(
+                    Comparer._lesson_key(lesson), [lesson_change.old_lesson, None]
+                )
+                state[1] = lesson_change.new_lesson
+
+        lesson_changes = []
+        for old_lesson, new_lesson in lesson_states.values():
+            if old_lesson is None and new_lesson is None:
+                continue
+            if old_lesson is None:
+                lesson_changes.append(
+                    LessonChange(
+                        change_type=ChangeType.LESSON_ADDED,
+                        field_changes=[
+                            FieldChange(
+                                field_name="lesson",
+                                old_value=None,
+                                new_value=new_lesson,
+                            )
+                        ],
+                        old_lesson=None,
+                        new_lesson=new_lesson,
+                    )
+                )
+            elif new_lesson is None:
+                lesson_changes.append(
+                    LessonChange(
+                        change_type=ChangeType.LESSON_REMOVED,
+                        field_changes=[
+                            FieldChange(
+                                field_name="lesson",
+                                old_value=old_lesson,
+                                new_value=None,
+                            )
+                        ],
+                        old_lesson=old_lesson,
+                        new_lesson=None,
+                    )
+                )
+            else:
+                field_changes = Comparer._compare_lessons(old_lesson, new_lesson)
+                if field_changes:
+                    lesson_changes.append(
+                        LessonChange(
+                            change_type=ChangeType.LESSON_MODIFIED,
+                            field_changes=field_changes,
+                            old_lesson=old_lesson,
+                            new_lesson=new_lesson,
+                        )
+                    )
+
+        # Как и compare_timetables, изменения только метаданных не публикуются
+        if not lesson_changes:
+            return None
+
+        return TimetableChangeData(
+            entity=changes[-1].entity,
+            metadata_changes=[
+                FieldChange(field_name=name, old_value=old_value, new_value=new_value)
+                for name, (old_value, new_value) in metadata_states.items()
+                if old_value != new_value
+            ],
+            lesson_changes=lesson_changes,
+        )
+
+    @staticmethod
+    @profile(func_name="comparer.diff_lessons")
+    def diff_lessons(lessons1: List[Lesson], lessons2: List[Lesson]) -> LessonsDiff:
+        """Разница на уровне отдельных занятий для хранения по занятиям.
+
+        В отличие от compare_timetables ключ включает неделю, дату и подгруппу,
+        а одинаковые по ключу занятия различаются номером повтора, поэтому
+        разные занятия одной сущности не сливаются в один ключ.
+        """
+        lessons1_map = Comparer._identity_map(lessons1)
+        lessons2_map = Comparer._identity_map(lessons2)
+        diff = LessonsDiff(added={}, removed={}, modified={})
+
+        for key, lesson2 in lessons2_map.items():
+            lesson1 = lessons1_map.get(key)
+            if lesson1 is None:
+                diff.added[key] = lesson2
+                continue
+            field_changes = Comparer._compare_lessons(lesson1, lesson2)
+            if field_changes:
+                diff.modified[key] = (lesson2, field_changes)
+
+        for key, lesson1 in lessons1_map.items():
+            if key not in lessons2_map:
+                diff.removed[key] = lesson1
+
+        return diff
+
+    @staticmethod
+    def lesson_identity(lesson: Lesson) -> tuple:
+        """Ключ занятия без номера повтора: тип расписания, неделя, день, дата,
+        время, дисциплина и подгруппа. Аудитория в ключ не входит, поэтому
+        смена аудитории — изменение поля, а не удаление и вставка."""
+        return (
+            lesson.schedule_type,
+            lesson.week_number,
+            lesson.day_name,
+            lesson.day_date,
+            lesson.time_begin,
+            lesson.lesson_name,
+            lesson.subgroups,
+        )
+
+    @staticmethod
+    def _duplicate_order(lesson: Lesson) -> tuple:
+        # Порядок занятий с одинаковым ключом не зависит от порядка на странице
+        # и в базе; аудитория последней, чтобы ее смена реже меняла номера
+        return (
+            str(lesson.lesson_type),
+            sorted(lesson.groups or []),
+            sorted(lesson.professors or []),
+            str(lesson.location),
+            str(lesson.schedule_form),
+            str(lesson.duration),
+            str(lesson.auditorium),
+        )
+
+    @staticmethod
+    def _identity_map(lessons: List[Lesson]) -> Dict[tuple, Lesson]:
+        # Занятия с одинаковым ключом не сливаются: каждое получает номер повтора
+        duplicates: Dict[tuple, List[Lesson]] = {}
+        for lesson in lessons:
+            duplicates.setdefault(Comparer.lesson_identity(lesson), []).append(lesson)
+
+        identity_map: Dict[tuple, Lesson] = {}
+        for identity, same in duplicates.items():
+            same.sort(key=Comparer._duplicate_order)
+            for occurrence, lesson in enumerate(same):
+                identity_map[identity + (occurrence,)] = lesson
+        return identity_map
+
     @staticmethod
     def _lesson_key(lesson):
         return (
@@ -1,20 +1,75 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 
 
 class Settings(BaseSettings):
     DEBUG: bool = False
+    PROFILE: bool = False
+
+    LOG_ENQUEUE: bool = False
+    # Доля сущностей, чья загрузка логируется построчно; остальные попадают
+    # в сводки раз в LOG_SUMMARY_INTERVAL секунд
+    LOG_ENTITY_SAMPLE_RATE: float = 1.0
+    LOG_SUMMARY_INTERVAL: float = 10.0
 
     ENTITIES_FETCH_INTERVAL: int = 21600
+    TIMETABLE_BASE_URL: str = "https://timetable.pallada.sibsau.ru"
     ANTI_DDOS_FETCH_INTERVAL: int = 0
+    FETCH_CONCURRENCY_INITIAL: int = 2
+    FETCH_CONCURRENCY_MIN: int = 1
+    FETCH_CONCURRENCY_MAX: int = 16
+    FETCH_LATENCY_TARGET: float = 2.0
+    FETCH_ERROR_RATE_TARGET: float = 0.05
+    FETCH_TIMEOUT: float = 30.0
+    FETCH_RETRIES: int = 3
+    FETCH_RETRY_BASE_DELAY: float = 1.0
+    FETCH_RETRY_BUDGET: float = 0.1
+    FETCH_HEDGING: bool = False
+
+    FETCH_MODE: str = "live"  # live | record | replay
+    ARCHIVE_PATH: str = "archive"
+    ARCHIVE_REPLAY_AT: Optional[float] = None
 
     MONGODB_URI: str
+    STORAGE_LAYOUT: str = "document"  # document | lessons
+    HISTORY_ENABLED: bool = False
+    HISTORY_SNAPSHOT_INTERVAL: int = 20  # разниц между полными снимками
+    HISTORY_RETENTION_DAYS: int = 0  # 0 — хранить историю бессрочно
+    CONFLICTS_REPORT: bool = True  # отчет о накладках аудиторий, преподавателей, групп
+    SNAPSHOT_PATH: str = ""  # файл колоночного снимка занятий; пусто — не писать
+    SNAPSHOT_COMPRESSION: str = "zstd"  # zstd | lz4 | none
+    SNAPSHOT_BATCH_ROWS: int = 65536
     RABBITMQ_URI: str
+    RABBITMQ_QUEUE: str = "timetable_changes"
+    RABBITMQ_EXCHANGE: str = ""  # пусто — exchange по умолчанию, иначе topic exchange
+    PUBLISH_MODE: str = "outbox"  # outbox | direct
+    OUTBOX_BATCH_SIZE: int = 100  # документов сущностей за одну пачку
+    OUTBOX_POLL_INTERVAL: float = 5.0
+    OUTBOX_COALESCE_WINDOW: float = 0  # секунд; 0 — публиковать без слияния
+    OUTBOX_CLAIM_TTL: float = 60  # секунд, на которые публикатор забирает документ
 
     START_GROUP_ID: int = 1
     END_GROUP_ID: int = 20000
     START_PROFESSOR_ID: int = 1
     END_PROFESSOR_ID: int = 20000
 
+    SHARDS_COUNT: int = 1
+    WORKER_ID: str = ""
+    SHARD_LEASE_TTL: int = 900
+
+    METRICS_HOST: str = "0.0.0.0"
+    METRICS_PORT: int = 9100  # 0 отключает HTTP-эндпоинт /metrics
+    QUERY_HOST: str = "0.0.0.0"
+    QUERY_PORT: int = 8090
+    QUERY_QUEUE: str = "timetable_query"  # своя очередь сервиса запросов
+    TRACE_SPANS_PATH: Optional[str] = None  # файл спанов в формате Chrome Trace
+    LOOP_BLOCK_THRESHOLD: float = 0.1  # секунды, 0 отключает поиск блокировок
+    SAMPLING_PROFILE: bool = False  # профилировать каждый цикл, иначе по SIGUSR2
+    SAMPLING_RATE: int = 100  # Гц
+    SAMPLING_PROFILE_DIR: str = "profiles"
+    MEMORY_TRACKING: bool = False
+    MEMORY_TRACKING_FRAMES: int = 1
+
     class Config:
         env_file = ".env"
 
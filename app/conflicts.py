@@ -0,0 +1,237 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from tabulate import tabulate
+from lessontable import LESSON_KEY, NONE, LessonTable, enum_code
+from parser_types import EntityType, Lesson, Subgroup
+from profiler import profile
+
+REPORT_LIMIT = 20
+
+
+@dataclass
+class Conflict:
+    resource_type: str  # auditorium | professor | group
+    resource: str
+    first: Lesson
+    second: Lesson
+
+
+@dataclass
+class Events:
+    """Колонки событий — занятий после слияния по ключу Auditorium.lesson_key."""
+
+    start: np.ndarray
+    end: np.ndarray
+    slot: List[np.ndarray]  # коды недели, дня и даты
+    subgroups: np.ndarray
+
+
+class ConflictDetector:
+    """Ищет аудитории, преподавателей и группы, занятые в пересекающееся время.
+
+    Занятия из расписаний групп и преподавателей сначала сливаются по ключу
+    Auditorium.lesson_key, поэтому одна лекция для потока групп остается одним
+    событием, а не конфликтом. Затем пары (ресурс, событие) сортируются по
+    ресурсу, (неделя, день, дата) и началу, и каждое событие сравнивается с
+    предыдущими в своей группе, пока максимум их окончаний позже его начала:
+    O(n log n + число конфликтов) операций над массивами LessonTable.
+    """
+
+    @staticmethod
+    @profile(func_name="conflicts.detect")
+    def detect(table: LessonTable) -> List[Conflict]:
+        # Расписания аудиторий собраны из тех же занятий
+        rows = np.flatnonzero(
+            (table["entity_type"] != table.encode("entity_type", EntityType.AUDITORIUM))
+            & (table["start"] != NONE)
+        )
+        event_of_row, event_rows = table.group_by(LESSON_KEY, rows)
+        if not len(event_rows):
+            return []
+        event_by_row = np.full(len(table), NONE, dtype=np.int64)
+        event_by_row[rows] = event_of_row
+        events = Events(
+            start=table["start"][event_rows],
+            end=table.end[event_rows],
+            slot=[
+                table[name][event_rows]
+                for name in ("week_number", "day_name", "day_date")
+            ],
+            subgroups=table["subgroups"][event_rows],
+        )
+
+        auditoriums = table["auditorium"][event_rows]
+        with_auditorium = np.flatnonzero(auditoriums != NONE)
+        resources = {
+            "auditorium": (with_auditorium, auditoriums[with_auditorium]),
+            "professor": ConflictDetector._event_links(
+                *ConflictDetector._resource_links(
+                    table, "professors", EntityType.PROFESSOR, rows
+                ),
+                event_by_row,
+            ),
+            "group": ConflictDetector._event_links(
+                *ConflictDetector._resource_links(
+                    table, "groups", EntityType.GROUP, rows
+                ),
+                event_by_row,
+            ),
+        }
+        names = {
+            "auditorium": table.strings.values,
+            "professor": table.professors.values,
+            "group": table.groups.values,
+        }
+
+        conflicts = []
+        for resource_type, (event_ids, codes) in resources.items():
+            first, second, resource = ConflictDetector._overlaps(
+                events, event_ids, codes, skip_subgroups=resource_type == "group"
+            )
+            resource_names = names[resource_type]
+            for first_event, second_event, code in zip(
+                first.tolist(), second.tolist(), resource.tolist()
+            ):
+                conflicts.append(
+                    Conflict(
+                        resource_type,
+                        resource_names[code],
+                        table.lessons[event_rows[first_event]],
+                        table.lessons[event_rows[second_event]],
+                    )
+                )
+        return conflicts
+
+    @staticmethod
+    def _resource_links(
+        table: LessonTable, kind: str, entity_type: EntityType, rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Связи строк с группами или преподавателями вместе с владельцем
+        расписания: парсер заполняет на странице группы только professors, а на
+        странице преподавателя только groups."""
+        link_rows, codes = table.links(kind, rows)
+        owner = table["entity_name"][rows]
+        owned = (
+            table["entity_type"][rows] == table.encode("entity_type", entity_type)
+        ) & (owner != NONE)
+        return (
+            np.concatenate([link_rows, rows[owned]]),
+            np.concatenate([codes, owner[owned]]),
+        )
+
+    @staticmethod
+    def _event_links(
+        link_rows: np.ndarray, codes: np.ndarray, event_by_row: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Уникальные пары (событие, код) из связей строк с группами или
+        преподавателями."""
+        width = int(codes.max(initial=0)) + 1
+        pairs = np.unique(event_by_row[link_rows] * width + codes)
+        return pairs // width, pairs % width
+
+    @staticmethod
+    def _overlaps(
+        events: "Events",
+        event_ids: np.ndarray,
+        codes: np.ndarray,
+        skip_subgroups: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Пары пересекающихся событий одного ресурса: (раньше, позже, код ресурса)."""
+        empty = np.empty(0, np.int64)
+        if len(event_ids) < 2:
+            return empty, empty, empty
+        start = events.start[event_ids]
+        end = events.end[event_ids]
+        bucket = [codes, *(column[event_ids] for column in events.slot)]
+        order = np.lexsort((end, start, *bucket[::-1]))
+        start, end = start[order], end[order]
+        event_ids, codes = event_ids[order], codes[order]
+
+        boundary = np.zeros(len(order), dtype=bool)
+        boundary[0] = True
+        for column in bucket:
+            sorted_column = column[order]
+            boundary[1:] |= sorted_column[1:] != sorted_column[:-1]
+        segment = np.cumsum(boundary) - 1
+        segment_start = np.flatnonzero(boundary)[segment]
+        # Максимум окончаний от начала группы до позиции включительно: сдвиг на
+        # номер группы не дает максимуму перейти через границу групп
+        offset = int(end.max()) + 1
+        running_end = np.maximum.accumulate(end + segment * offset) - segment * offset
+
+        firsts, seconds = [], []
+        positions = np.arange(1, len(order))
+        distance = 1
+        while len(positions):
+            positions = positions[positions - distance >= segment_start[positions]]
+            # Начала отсортированы, поэтому более раннее событие пересекается с
+            # текущим, только если заканчивается позже его начала
+            positions = positions[running_end[positions - distance] > start[positions]]
+            previous = positions - distance
+            overlapping = end[previous] > start[positions]
+            firsts.append(previous[overlapping])
+            seconds.append(positions[overlapping])
+            distance += 1
+
+        first = np.concatenate(firsts) if firsts else empty
+        second = np.concatenate(seconds) if seconds else empty
+        pair_order = np.lexsort((first, second))
+        first, second = first[pair_order], second[pair_order]
+        if skip_subgroups:
+            keep = ~ConflictDetector._split_subgroups(
+                events.subgroups[event_ids[first]], events.subgroups[event_ids[second]]
+            )
+            first, second = first[keep], second[keep]
+        return event_ids[first], event_ids[second], codes[second]
+
+    @staticmethod
+    def _split_subgroups(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        # Разные подгруппы одной группы могут заниматься одновременно
+        common = enum_code(Subgroup, Subgroup.COMMON)
+        return (first != common) & (second != common) & (first != second)
+
+    @staticmethod
+    def log_report(conflicts: List[Conflict], limit: int = REPORT_LIMIT):
+        if not conflicts:
+            logger.info("No booking conflicts found")
+            return
+        counts: Dict[str, int] = {}
+        for conflict in conflicts:
+            counts[conflict.resource_type] = counts.get(conflict.resource_type, 0) + 1
+        logger.warning(
+            f"Found {len(conflicts)} booking conflicts: "
+            + ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items()))
+            + "\n"
+            + tabulate(
+                [
+                    [
+                        conflict.resource_type,
+                        conflict.resource,
+                        ConflictDetector._slot(conflict.first),
+                        ConflictDetector._describe(conflict.first),
+                        ConflictDetector._describe(conflict.second),
+                    ]
+                    for conflict in conflicts[:limit]
+                ],
+                headers=["Type", "Resource", "Slot", "Lesson", "Overlaps with"],
+                tablefmt="grid",
+            )
+        )
+
+    @staticmethod
+    def _slot(lesson: Lesson) -> str:
+        parts: List[Optional[str]] = [
+            lesson.week_number.value if lesson.week_number else None,
+            lesson.day_name.value if lesson.day_name else None,
+            lesson.day_date.isoformat() if lesson.day_date else None,
+        ]
+        return ", ".join(part for part in parts if part)
+
+    @staticmethod
+    def _describe(lesson: Lesson) -> str:
+        return (
+            f"{lesson.time_begin.strftime('%H:%M')} {lesson.lesson_name} "
+            f"({lesson.auditorium or '-'}, {lesson.subgroups.value or 'все'})"
+        )
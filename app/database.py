@@ -1,4 +1,5 @@
 from beanie import Document, init_beanie
+from beanie.odm.utils.encoder import Encoder
 from motor.motor_asyncio import AsyncIOMotorClient
 from parser_types import (
     TimetableData,
@@ -14,15 +15,33 @@ from parser_types import (
     LessonType,
     Subgroup,
 )
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from pydantic import BaseModel
 import pymongo
 import pymongo.errors
+import hashlib
 import traceback
 from loguru import logger
-from datetime import time, timedelta, datetime
+from datetime import time, timedelta, datetime, timezone
 from logger import trace
 from profiler import profile
+from comparer import Comparer
+
+# Операций в одном bulk_write при записи по занятиям
+BULK_WRITE_BATCH = 10000
+
+DAY_ORDER = {day_name: index for index, day_name in enumerate(DayName)}
+
+# Код ошибки MongoDB при вставке документа с существующим уникальным ключом
+DUPLICATE_KEY = 11000
+
+# Изменения, ждущие публикации, лежат в массиве outbox документа сущности;
+# частичный индекс покрывает только документы с непустым outbox
+OUTBOX_INDEX = pymongo.IndexModel(
+    [("outbox.created_at", pymongo.ASCENDING)],
+    name="outbox_pending",
+    partialFilterExpression={"outbox.id": {"$exists": True}},
+)
 
 
 class LessonModel(BaseModel):
@@ -67,13 +86,155 @@ class TimetableModel(Document):
             "entity.type",
             "entity.id",
             "entity.name",
+            OUTBOX_INDEX,
+        ]
+
+
+class TimetableHeaderModel(Document):
+    """Сущность и метаданные расписания при STORAGE_LAYOUT=lessons."""
+
+    entity: EntityModel
+    metadata: MetadataModel
+
+    class Settings:
+        name = "timetable_headers"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [("entity.type", pymongo.ASCENDING), ("entity.id", pymongo.ASCENDING)],
+                unique=True,
+            ),
+            OUTBOX_INDEX,
+        ]
+
+
+class LessonDocumentModel(Document):
+    """Одно занятие одной сущности при STORAGE_LAYOUT=lessons."""
+
+    entity_type: str
+    entity_id: int
+    lesson_id: str
+    lesson: LessonModel
+
+    class Settings:
+        name = "lessons"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [
+                    ("entity_type", pymongo.ASCENDING),
+                    ("entity_id", pymongo.ASCENDING),
+                    ("lesson_id", pymongo.ASCENDING),
+                ],
+                unique=True,
+            ),
+            "lesson.auditorium",
+            "lesson.professors",
+            "lesson.groups",
+            pymongo.IndexModel(
+                [
+                    ("lesson.day_name", pymongo.ASCENDING),
+                    ("lesson.time_begin", pymongo.ASCENDING),
+                ]
+            ),
+        ]
+
+
+class ShardLeaseModel(Document):
+    cycle: int
+    shard: int
+    owner: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    completed: bool = False
+    # Завершенные лизы должны пережить свой цикл: воркер, который войдет в тот
+    # же цикл позже, по ним поймет, что шарды уже обработаны
+    delete_at: Optional[datetime] = None
+
+    class Settings:
+        name = "shard_leases"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [("cycle", pymongo.ASCENDING), ("shard", pymongo.ASCENDING)],
+                unique=True,
+            ),
+            pymongo.IndexModel(
+                [("delete_at", pymongo.ASCENDING)], expireAfterSeconds=0
+            ),
+        ]
+
+
+class HistoryLessonModel(BaseModel):
+    lesson_id: str
+    lesson: LessonModel
+
+
+class HistoryLessonUpdateModel(BaseModel):
+    lesson_id: str
+    fields: Dict[str, Any]
+
+
+class TimetableHistoryModel(Document):
+    """Запись истории расписания: полный снимок или разница с предыдущей записью."""
+
+    entity_type: str
+    entity_id: int
+    timestamp: datetime
+    snapshot: bool
+    entity_name: Optional[str] = None
+    metadata: Optional[MetadataModel] = None
+    added: List[HistoryLessonModel] = []
+    removed: List[str] = []
+    modified: List[HistoryLessonUpdateModel] = []
+
+    class Settings:
+        name = "timetable_history"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [
+                    ("entity_type", pymongo.ASCENDING),
+                    ("entity_id", pymongo.ASCENDING),
+                    ("timestamp", pymongo.ASCENDING),
+                ]
+            ),
+            "timestamp",
+        ]
+
+
+class HistoryHeadModel(Document):
+    """Число разниц после последнего снимка сущности, по нему решается, когда
+    писать следующий снимок."""
+
+    entity_type: str
+    entity_id: int
+    deltas: int = 0
+
+    class Settings:
+        name = "timetable_history_heads"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [("entity_type", pymongo.ASCENDING), ("entity_id", pymongo.ASCENDING)],
+                unique=True,
+            ),
         ]
 
 
 class Database:
-    def __init__(self, connection_string, db_name="sibsau-timetable"):
+    def __init__(
+        self,
+        connection_string,
+        db_name="sibsau-timetable",
+        layout="document",
+        history=False,
+    ):
+        """layout: document — расписание сущности одним документом в timetables,
+        lessons — заголовок в timetable_headers и по документу на занятие в lessons."""
         self.connection_string = connection_string
         self.db_name = db_name
+        self.layout = layout
+        self.history = history
         self.client = None
         self.initialized = False
 
@@ -92,9 +253,15 @@ class Database:
 
                 db = self.client[self.db_name]
 
+                document_models = [TimetableModel, ShardLeaseModel]
+                if self.layout == "lessons":
+                    document_models += [TimetableHeaderModel, LessonDocumentModel]
+                if self.history:
+                    document_models += [TimetableHistoryModel, HistoryHeadModel]
+
                 await init_beanie(
                     database=db,
-                    document_models=[TimetableModel],
+                    document_models=document_models,
                     allow_index_dropping=True,
                 )
 
@@ -110,7 +277,7 @@ class Database:
                 self.initialized = False
                 raise e
 
-    @profile(func_name="database.create_timetable")
+    @profile(func_name="database.create_timetable", stage="persist")
     @trace
     async def create_timetable(self, timetable: TimetableData) -> bool:
         await self.initialize()
@@ -174,12 +341,14 @@ class Database:
     @profile(func_name="database.is_exist")
     async def is_exist(self, entity_type: EntityType, entity_id: int) -> bool:
         await self.initialize()
-        count = await TimetableModel.find(
-            {"entity.type": entity_type.value, "entity.id": entity_id}
-        ).count()
+        count = (
+            await self._entity_model()
+            .find({"entity.type": entity_type.value, "entity.id": entity_id})
+            .count()
+        )
         return count > 0
 
-    @profile(func_name="database.update_timetable")
+    @profile(func_name="database.update_timetable", stage="persist")
     @trace
     async def update_timetable(self, timetable: TimetableData) -> bool:
         await self.initialize()
@@ -196,16 +365,6 @@ class Database:
             return False
 
         try:
-            existing = await TimetableModel.find_one(
-                {
-                    "entity.type": timetable.entity.type.value,
-                    "entity.id": timetable.entity.id,
-                }
-            )
-
-            if existing:
-                await existing.delete()
-
             model = self._to_model(timetable)
 
             if (
@@ -219,7 +378,23 @@ class Database:
                 )
                 return False
 
-            await model.insert()
+            # Поля обновляются на месте, а не удалением и вставкой документа:
+            # так сохраняются неопубликованные записи outbox
+            encoder = Encoder(to_db=True)
+            await TimetableModel.get_motor_collection().update_one(
+                {
+                    "entity.type": timetable.entity.type.value,
+                    "entity.id": timetable.entity.id,
+                },
+                {
+                    "$set": {
+                        "entity": encoder.encode(model.entity),
+                        "metadata": encoder.encode(model.metadata),
+                        "lessons": encoder.encode(model.lessons),
+                    }
+                },
+                upsert=True,
+            )
             return True
         except pymongo.errors.DuplicateKeyError as e:
             logger.error(f"Дубликат ключа при обновлении: {e}")
@@ -228,6 +403,56 @@ class Database:
             logger.error(f"Ошибка обновления расписания: {e}")
             return False
 
+    @profile(func_name="database.save_timetables", stage="persist")
+    async def save_timetables(
+        self,
+        timetables: List[TimetableData],
+        outbox: Optional[Dict[Tuple[EntityType, int], List[dict]]] = None,
+    ) -> int:
+        """Записывает расписания в timetables upsert'ами в одном bulk_write.
+
+        Записи outbox изменений сущности добавляются в тот же документ той же
+        операцией, что и новое расписание, поэтому они сохраняются атомарно:
+        изменение не потеряется и не уйдет без сохраненного расписания."""
+        await self.initialize()
+        encoder = Encoder(to_db=True)
+        outbox = outbox or {}
+
+        operations = []
+        written = 0
+        for timetable in timetables:
+            entity = timetable.entity
+            try:
+                model = self._to_model(timetable)
+            except ValueError as e:
+                logger.error(f"Невозможно сохранить расписание {entity}: {e}")
+                continue
+
+            update = {
+                "$set": {
+                    "entity": encoder.encode(model.entity),
+                    "metadata": encoder.encode(model.metadata),
+                    "lessons": encoder.encode(model.lessons),
+                }
+            }
+            entries = outbox.get((entity.type, entity.id))
+            if entries:
+                update["$push"] = {"outbox": {"$each": entries}}
+            operations.append(
+                pymongo.UpdateOne(
+                    {"entity.type": entity.type.value, "entity.id": entity.id},
+                    update,
+                    upsert=True,
+                )
+            )
+
+            if len(operations) >= BULK_WRITE_BATCH:
+                written += await self._bulk_write(TimetableModel, operations)
+                operations = []
+
+        written += await self._bulk_write(TimetableModel, operations)
+        return written
+
     @profile(func_name="database.get_timetable")
     async def get_timetable(
         self, entity_type: EntityType, entity_id: int
@@ -235,13 +460,8 @@ class Database:
         """DEPRECATED"""
         logger.warning("get_timetable is deprecated")
 
-        await self.initialize()
-        model = await TimetableModel.find_one(
-            {"entity.type": entity_type.value, "entity.id": entity_id}
-        )
-        if not model:
-            return None
-        return self._from_model(model)
+        timetables = await self.get_timetables([Entity(entity_type, entity_id)])
+        return timetables[0] if timetables else None
 
     @profile(func_name="database.get_all")
     async def get_all(
@@ -255,18 +475,357 @@ class Database:
         if entity_type:
             query = {"entity.type": entity_type.value}
 
+        if self.layout == "lessons":
+            lessons_query = {"entity_type": entity_type.value} if entity_type else {}
+            return await self._get_lesson_timetables(query, lessons_query)
+
         models = await TimetableModel.find(query).to_list()
         return [self._from_model(model) for model in models]
 
     @profile(func_name="database.get_timetables")
-    async def get_timetables(self) -> List[TimetableData]:
+    async def get_timetables(
+        self, entities: Optional[List[Entity]] = None
+    ) -> List[TimetableData]:
         await self.initialize()
-        models = await TimetableModel.find({}).to_list()
+        query = {}
+        if entities is not None:
+            query = self._entities_query(entities, "entity.type", "entity.id")
+            if query is None:
+                return []
+
+        if self.layout == "lessons":
+            lessons_query = {}
+            if entities is not None:
+                lessons_query = self._entities_query(
+                    entities, "entity_type", "entity_id"
+                )
+            return await self._get_lesson_timetables(query, lessons_query)
+
+        models = await TimetableModel.find(query).to_list()
         return [self._from_model(model) for model in models]
 
+    async def _get_lesson_timetables(
+        self, query: dict, lessons_query: dict
+    ) -> List[TimetableData]:
+        """Расписания из заголовков по query и занятий по lessons_query."""
+        lessons_by_entity: Dict[Tuple[str, int], List[Lesson]] = {}
+        async for lesson_document in LessonDocumentModel.find(lessons_query):
+            lessons_by_entity.setdefault(
+                (lesson_document.entity_type, lesson_document.entity_id), []
+            ).append(self._lesson_from_model(lesson_document.lesson))
+
+        timetables = []
+        for header in await TimetableHeaderModel.find(query).to_list():
+            lessons = lessons_by_entity.get((header.entity.type, header.entity.id), [])
+            lessons.sort(key=self._lesson_order)
+            timetables.append(
+                TimetableData(
+                    entity=self._entity_from_model(header.entity),
+                    metadata=self._metadata_from_model(header.metadata),
+                    lessons=lessons,
+                )
+            )
+        return timetables
+
+    @profile(func_name="database.save_lessons", stage="persist")
+    async def save_lessons(
+        self,
+        timetables: List[TimetableData],
+        db_timetables: List[TimetableData],
+        outbox: Optional[Dict[Tuple[EntityType, int], List[dict]]] = None,
+    ) -> int:
+        """Записывает расписания по занятиям, применяя только разницу с db_timetables:
+        вставки новых занятий, удаления пропавших и $set измененных полей.
+
+        Записи outbox добавляются в заголовок сущности, и заголовки каждой пачки
+        пишутся раньше ее занятий. Обратный порядок терял бы изменение: после
+        падения между записями занятия уже новые, и следующий цикл его не найдет.
+        Если ни одно занятие пачки не записалось, ее записи outbox снимаются, и
+        изменение уходит один раз, когда следующий цикл найдет его повторно.
+        После частичной записи или падения процесса между записями изменение
+        может уйти дважды с разными message_id."""
+        await self.initialize()
+        encoder = Encoder(to_db=True)
+        outbox = outbox or {}
+        db_timetables_map = {
+            (db_timetable.entity.type, db_timetable.entity.id): db_timetable
+            for db_timetable in db_timetables
+        }
+
+        header_operations = []
+        lesson_operations = []
+        entry_ids = {}
+        written = 0
+        for timetable in timetables:
+            entity = timetable.entity
+            if not entity or not entity.type or not entity.id or entity.id <= 0:
+                logger.error(
+                    f"Невозможно сохранить запись с невалидным Entity: {entity}"
+                )
+                continue
+
+            entity_filter = {"entity_type": entity.type.value, "entity_id": entity.id}
+            db_timetable = db_timetables_map.get((entity.type, entity.id))
+            header_update = {}
+            if (
+                db_timetable is None
+                or db_timetable.metadata != timetable.metadata
+                or db_timetable.entity.name != entity.name
+            ):
+                try:
+                    header_update["$set"] = {
+                        "entity": encoder.encode(self._entity_to_model(entity)),
+                        "metadata": encoder.encode(
+                            self._metadata_to_model(timetable.metadata)
+                        ),
+                    }
+                except ValueError as e:
+                    logger.error(f"Невозможно сохранить расписание {entity}: {e}")
+                    continue
+            entries = outbox.get((entity.type, entity.id))
+            if entries:
+                header_update["$push"] = {"outbox": {"$each": entries}}
+                entry_ids[(entity.type.value, entity.id)] = [
+                    entry["id"] for entry in entries
+                ]
+            if header_update:
+                header_operations.append(
+                    pymongo.UpdateOne(
+                        {"entity.type": entity.type.value, "entity.id": entity.id},
+                        header_update,
+                        upsert="$set" in header_update,
+                    )
+                )
+
+            diff = Comparer.diff_lessons(
+                db_timetable.lessons if db_timetable else [], timetable.lessons
+            )
+            for key, lesson in diff.added.items():
+                lesson_operations.append(
+                    pymongo.InsertOne(
+                        {
+                            **entity_filter,
+                            "lesson_id": self._lesson_id(key),
+                            "lesson": encoder.encode(self._lesson_to_model(lesson)),
+                        }
+                    )
+                )
+            for key in diff.removed:
+                lesson_operations.append(
+                    pymongo.DeleteOne(
+                        {**entity_filter, "lesson_id": self._lesson_id(key)}
+                    )
+                )
+            for key, (lesson, field_changes) in diff.modified.items():
+                lesson_model = encoder.encode(self._lesson_to_model(lesson))
+                lesson_operations.append(
+                    pymongo.UpdateOne(
+                        {**entity_filter, "lesson_id": self._lesson_id(key)},
+                        {
+                            "$set": {
+                                f"lesson.{change.field_name}": lesson_model[
+                                    change.field_name
+                                ]
+                                for change in field_changes
+                            }
+                        },
+                    )
+                )
+
+            if (
+                len(lesson_operations) >= BULK_WRITE_BATCH
+                or len(header_operations) >= BULK_WRITE_BATCH
+            ):
+                written += await self._write_lesson_batch(
+                    header_operations, lesson_operations, entry_ids
+                )
+                header_operations = []
+                lesson_operations = []
+                entry_ids = {}
+
+        written += await self._write_lesson_batch(
+            header_operations, lesson_operations, entry_ids
+        )
+        return written
+
+    async def _write_lesson_batch(
+        self,
+        header_operations: list,
+        lesson_operations: list,
+        entry_ids: Dict[Tuple[str, int], List[str]],
+    ) -> int:
+        """Пишет заголовки, затем занятия одной пачки. Если ни одно занятие
+        записать не удалось, снимает из заголовков записи outbox этой пачки;
+        после частичной записи они остаются, иначе примененная часть изменения
+        не была бы опубликована никогда."""
+        written = await self._bulk_write(TimetableHeaderModel, header_operations)
+        try:
+            written += await self._bulk_write(
+                LessonDocumentModel, lesson_operations, strict=True
+            )
+        except pymongo.errors.BulkWriteError as e:
+            applied = sum(
+                e.details.get(field, 0)
+                for field in ("nInserted", "nUpserted", "nModified", "nRemoved")
+            )
+            if not applied:
+                await self._bulk_write(
+                    TimetableHeaderModel,
+                    [
+                        pymongo.UpdateOne(
+                            {"entity.type": entity_type, "entity.id": entity_id},
+                            {"$pull": {"outbox": {"id": {"$in": ids}}}},
+                        )
+                        for (entity_type, entity_id), ids in entry_ids.items()
+                    ],
+                )
+            raise
+        return written
+
+    @staticmethod
+    async def _bulk_write(model, operations: list, strict: bool = False) -> int:
+        """Unordered bulk_write; возвращает число примененных операций.
+
+        Ошибки отдельных операций логируются, а остальные операции все равно
+        применяются. С strict ошибки, кроме повторной вставки уже существующего
+        документа, пробрасываются как BulkWriteError."""
+        if not operations:
+            return 0
+        try:
+            await model.get_motor_collection().bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            logger.error(
+                f"Ошибки записи в {model.get_collection_name()}: {len(errors)}"
+            )
+            if strict and any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+            return len(operations) - len(errors)
+        return len(operations)
+
+    @staticmethod
+    def _entities_query(
+        entities: List[Entity], type_field: str, id_field: str
+    ) -> Optional[dict]:
+        ids_by_type = {}
+        for entity in entities:
+            ids_by_type.setdefault(entity.type.value, []).append(entity.id)
+        if not ids_by_type:
+            return None
+        return {
+            "$or": [
+                {type_field: entity_type, id_field: {"$in": ids}}
+                for entity_type, ids in ids_by_type.items()
+            ]
+        }
+
+    @staticmethod
+    def _lesson_id(key: tuple) -> str:
+        parts = [
+            "" if part is None else str(getattr(part, "value", part)) for part in key
+        ]
+        return hashlib.blake2b("|".join(parts).encode(), digest_size=8).hexdigest()
+
+    @staticmethod
+    def _lesson_order(lesson: Lesson) -> tuple:
+        return (
+            lesson.schedule_type.value if lesson.schedule_type else "",
+            lesson.week_number.value if lesson.week_number else "",
+            DAY_ORDER.get(lesson.day_name, len(DAY_ORDER)),
+            lesson.time_begin or time(0, 0),
+            lesson.subgroups.value if lesson.subgroups else "",
+        )
+
+    def _entity_model(self):
+        """Коллекция, где лежат сущность, метаданные и outbox в текущей раскладке."""
+        return TimetableHeaderModel if self.layout == "lessons" else TimetableModel
+
+    @profile(func_name="database.claim_outbox")
+    async def claim_outbox(
+        self,
+        limit: int,
+        owner: str,
+        claim_ttl: float,
+        before: Optional[datetime] = None,
+    ) -> List[dict]:
+        """Забирает документы сущностей с неопубликованными изменениями, начиная с
+        самых старых: {"_id", "entity", "outbox": [{"id", "body", "created_at"}, ...]}.
+
+        Документ помечается outbox_owner и outbox_claimed_until = сейчас +
+        claim_ttl, и пока метка не истекла, его не заберет публикатор другой
+        реплики. before оставляет только документы, чья самая старая запись
+        создана не позже."""
+        await self.initialize()
+        collection = self._entity_model().get_motor_collection()
+        now = datetime.now(timezone.utc)
+        query = {
+            "outbox.id": {"$exists": True},
+            "$or": [
+                {"outbox_claimed_until": {"$exists": False}},
+                {"outbox_claimed_until": {"$lt": now}},
+            ],
+        }
+        if before is not None:
+            query["outbox.created_at"] = {"$lte": before}
+        candidates = (
+            await collection.find(query, {"_id": 1})
+            .sort("outbox.created_at", pymongo.ASCENDING)
+            .limit(limit)
+            .to_list(length=limit)
+        )
+        if not candidates:
+            return []
+
+        # Каждый документ обновляется атомарно, поэтому из двух реплик, выбравших
+        # один документ, метку ставит только первая
+        ids = [candidate["_id"] for candidate in candidates]
+        await collection.update_many(
+            {**query, "_id": {"$in": ids}},
+            {
+                "$set": {
+                    "outbox_owner": owner,
+                    "outbox_claimed_until": now + timedelta(seconds=claim_ttl),
+                }
+            },
+        )
+        return (
+            await collection.find(
+                {"_id": {"$in": ids}, "outbox_owner": owner},
+                {"entity": 1, "outbox": 1},
+            )
+            .sort("outbox.created_at", pymongo.ASCENDING)
+            .to_list(length=limit)
+        )
+
+    @profile(func_name="database.ack_outbox")
+    async def ack_outbox(self, published: Dict[Any, List[str]], owner: str) -> int:
+        """Удаляет опубликованные записи из outbox и снимает метку owner с
+        забранных документов: {_id документа: [id записей]}; пустой список
+        только освобождает документ."""
+        await self.initialize()
+        operations = []
+        for document_id, entry_ids in published.items():
+            update = {"$unset": {"outbox_owner": "", "outbox_claimed_until": ""}}
+            if entry_ids:
+                update["$pull"] = {"outbox": {"id": {"$in": entry_ids}}}
+            operations.append(
+                pymongo.UpdateOne({"_id": document_id, "outbox_owner": owner}, update)
+            )
+        return await self._bulk_write(self._entity_model(), operations)
+
     @profile(func_name="database.get_timetable_by_query")
     async def get_timetable_by_query(self, query: dict) -> Optional[TimetableData]:
+        """При STORAGE_LAYOUT=lessons query применяется к заголовку расписания
+        (поля entity.* и metadata.*)."""
         await self.initialize()
+        if self.layout == "lessons":
+            header = await TimetableHeaderModel.find_one(query)
+            if not header:
+                return None
+            entity = Entity(EntityType(header.entity.type), header.entity.id)
+            timetables = await self.get_timetables([entity])
+            return timetables[0] if timetables else None
+
         model = await TimetableModel.find_one(query)
         if model:
             return self._from_model(model)
@@ -276,10 +835,14 @@ class Database:
     async def delete_timetable(self, entity_type: EntityType, entity_id: int) -> bool:
         await self.initialize()
         try:
-            result = await TimetableModel.find_one(
+            result = await self._entity_model().find_one(
                 {"entity.type": entity_type.value, "entity.id": entity_id}
             )
             if result:
+                if self.layout == "lessons":
+                    await LessonDocumentModel.get_motor_collection().delete_many(
+                        {"entity_type": entity_type.value, "entity_id": entity_id}
+                    )
                 await result.delete()
                 logger.debug(f"Расписание удалено: {entity_type.value} {entity_id}")
                 return True
@@ -288,74 +851,336 @@ class Database:
             logger.error(f"Ошибка удаления расписания: {e}")
             return False
 
-    @profile(func_name="database._to_model")
-    def _to_model(self, timetable: TimetableData) -> TimetableModel:
-        if not timetable.entity:
-            raise ValueError("Timetable Entity is None")
-        if not timetable.entity.type:
-            raise ValueError("Timetable Entity type is None")
-        if not timetable.entity.id or timetable.entity.id <= 0:
-            raise ValueError(f"Invalid Timetable Entity id: {timetable.entity.id}")
+    @profile(func_name="database.acquire_shard_lease")
+    async def acquire_shard_lease(
+        self, cycle: int, shard: int, owner: str, ttl: int, delete_at: datetime
+    ) -> bool:
+        """delete_at — когда MongoDB удалит лиз по TTL-индексу; должен быть
+        позже конца цикла."""
+        await self.initialize()
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await ShardLeaseModel.get_motor_collection().find_one_and_update(
+                {
+                    "cycle": cycle,
+                    "shard": shard,
+                    "completed": False,
+                    "$or": [
+                        {"owner": None},
+                        {"owner": owner},
+                        {"expires_at": {"$lt": now}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "owner": owner,
+                        "expires_at": now + timedelta(seconds=ttl),
+                    },
+                    "$setOnInsert": {"delete_at": delete_at},
+                },
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            # Лиз уже существует и принадлежит живому воркеру либо завершен
+            return False
+        return lease is not None and lease.get("owner") == owner
 
-        entity_model = EntityModel(
-            type=timetable.entity.type.value,
-            id=timetable.entity.id,
-            name=timetable.entity.name or "",
+    @profile(func_name="database.renew_shard_leases")
+    async def renew_shard_leases(
+        self, cycle: int, shards: List[int], owner: str, ttl: int
+    ) -> int:
+        await self.initialize()
+        if not shards:
+            return 0
+        now = datetime.now(timezone.utc)
+        result = await ShardLeaseModel.get_motor_collection().update_many(
+            {"cycle": cycle, "shard": {"$in": shards}, "owner": owner},
+            {"$set": {"expires_at": now + timedelta(seconds=ttl)}},
         )
+        return result.modified_count
 
-        if entity_model.type is None or entity_model.id is None or entity_model.id <= 0:
-            raise ValueError("Entity model validation error")
+    @profile(func_name="database.complete_shard_lease")
+    async def complete_shard_lease(self, cycle: int, shard: int, owner: str) -> bool:
+        await self.initialize()
+        result = await ShardLeaseModel.get_motor_collection().update_one(
+            {"cycle": cycle, "shard": shard, "owner": owner},
+            {"$set": {"completed": True, "expires_at": None}},
+        )
+        return result.modified_count > 0
 
-        if not timetable.metadata:
-            raise ValueError("Timetable metadata is None")
-        if not timetable.metadata.week_number:
-            raise ValueError("Timetable metadata week_number is None")
+    @profile(func_name="database.get_completed_shards")
+    async def get_completed_shards(self, cycle: int) -> List[int]:
+        await self.initialize()
+        leases = await ShardLeaseModel.find(
+            {"cycle": cycle, "completed": True}
+        ).to_list()
+        return [lease.shard for lease in leases]
 
-        metadata_model = MetadataModel(
-            years=timetable.metadata.years or "",
-            date=timetable.metadata.date.date()
-            if isinstance(timetable.metadata.date, datetime)
-            else timetable.metadata.date,
-            week_number=timetable.metadata.week_number.value,
-            semester=timetable.metadata.semester.value
-            if timetable.metadata.semester
-            else None,
+    @profile(func_name="database.record_history")
+    async def record_history(
+        self,
+        timetables: List[TimetableData],
+        db_timetables: List[TimetableData],
+        timestamp: datetime,
+        snapshot_interval: int,
+    ) -> int:
+        """Дописывает в историю разницу каждого расписания с db_timetables.
+
+        Первая запись сущности и каждая snapshot_interval-я после снимка — полный
+        снимок, поэтому восстановление на момент времени читает не больше
+        snapshot_interval разниц.
+        """
+        await self.initialize()
+        db_timetables_map = {
+            (db_timetable.entity.type, db_timetable.entity.id): db_timetable
+            for db_timetable in db_timetables
+        }
+        heads = {}
+        query = self._entities_query(
+            [timetable.entity for timetable in timetables], "entity_type", "entity_id"
         )
+        if query is None:
+            return 0
+        async for head in HistoryHeadModel.find(query):
+            heads[(head.entity_type, head.entity_id)] = head.deltas
+
+        records = []
+        head_operations = []
+        for timetable in timetables:
+            entity = timetable.entity
+            head_key = (entity.type.value, entity.id)
+            db_timetable = db_timetables_map.get((entity.type, entity.id))
+            deltas = heads.get(head_key)
 
-        lesson_models = []
-        for lesson in timetable.lessons:
-            if not lesson.schedule_type:
+            try:
+                record, update = self._history_record(
+                    timetable, db_timetable, deltas, timestamp, snapshot_interval
+                )
+            except ValueError as e:
+                logger.error(f"Невозможно записать историю {entity}: {e}")
                 continue
+            if record is None:
+                continue
+
+            records.append(record)
+            head_operations.append(
+                pymongo.UpdateOne(
+                    {"entity_type": entity.type.value, "entity_id": entity.id},
+                    update,
+                    upsert=True,
+                )
+            )
+
+        for start in range(0, len(records), BULK_WRITE_BATCH):
+            await TimetableHistoryModel.insert_many(
+                records[start : start + BULK_WRITE_BATCH]
+            )
+        await self._bulk_write(HistoryHeadModel, head_operations)
+        return len(records)
 
-            time_str = (
-                lesson.time_begin.strftime("%H:%M") if lesson.time_begin else "00:00"
+    def _history_record(
+        self,
+        timetable: TimetableData,
+        db_timetable: Optional[TimetableData],
+        deltas: Optional[int],
+        timestamp: datetime,
+        snapshot_interval: int,
+    ) -> Tuple[Optional[TimetableHistoryModel], dict]:
+        entity = timetable.entity
+        if db_timetable is None or deltas is None or deltas + 1 >= snapshot_interval:
+            record = TimetableHistoryModel(
+                entity_type=entity.type.value,
+                entity_id=entity.id,
+                timestamp=timestamp,
+                snapshot=True,
+                entity_name=entity.name,
+                metadata=self._metadata_to_model(timetable.metadata),
+                added=[
+                    HistoryLessonModel(
+                        lesson_id=self._lesson_id(key),
+                        lesson=self._lesson_to_model(lesson),
+                    )
+                    for key, lesson in Comparer.diff_lessons(
+                        [], timetable.lessons
+                    ).added.items()
+                ],
             )
+            update = {"$set": {"deltas": 0}}
+        else:
+            record = self._history_delta(db_timetable, timetable, timestamp)
+            update = {"$inc": {"deltas": 1}}
+        return record, update
+
+    def _history_delta(
+        self, db_timetable: TimetableData, timetable: TimetableData, timestamp: datetime
+    ) -> Optional[TimetableHistoryModel]:
+        diff = Comparer.diff_lessons(db_timetable.lessons, timetable.lessons)
+        metadata_changed = db_timetable.metadata != timetable.metadata
+        name_changed = db_timetable.entity.name != timetable.entity.name
+        if not (
+            diff.added
+            or diff.removed
+            or diff.modified
+            or metadata_changed
+            or name_changed
+        ):
+            return None
+
+        modified = []
+        for key, (lesson, field_changes) in diff.modified.items():
+            lesson_model = self._lesson_to_model(lesson)
+            modified.append(
+                HistoryLessonUpdateModel(
+                    lesson_id=self._lesson_id(key),
+                    fields={
+                        change.field_name: getattr(lesson_model, change.field_name)
+                        for change in field_changes
+                    },
+                )
+            )
+
+        return TimetableHistoryModel(
+            entity_type=timetable.entity.type.value,
+            entity_id=timetable.entity.id,
+            timestamp=timestamp,
+            snapshot=False,
+            entity_name=timetable.entity.name if name_changed else None,
+            metadata=self._metadata_to_model(timetable.metadata)
+            if metadata_changed
+            else None,
+            added=[
+                HistoryLessonModel(
+                    lesson_id=self._lesson_id(key), lesson=self._lesson_to_model(lesson)
+                )
+                for key, lesson in diff.added.items()
+            ],
+            removed=[self._lesson_id(key) for key in diff.removed],
+            modified=modified,
+        )
 
-            duration_seconds = (
-                int(lesson.duration.total_seconds()) if lesson.duration else None
+    @profile(func_name="database.get_timetable_as_of")
+    async def get_timetable_as_of(
+        self, entity_type: EntityType, entity_id: int, at: datetime
+    ) -> Optional[TimetableData]:
+        """Расписание сущности в том виде, в каком оно было на момент at."""
+        await self.initialize()
+        entity_filter = {"entity_type": entity_type.value, "entity_id": entity_id}
+        snapshot = (
+            await TimetableHistoryModel.find(
+                {**entity_filter, "snapshot": True, "timestamp": {"$lte": at}}
             )
+            .sort(-TimetableHistoryModel.timestamp)
+            .first_or_none()
+        )
+        if snapshot is None:
+            return None
+
+        name = snapshot.entity_name
+        metadata = snapshot.metadata
+        lessons = {added.lesson_id: added.lesson for added in snapshot.added}
+        deltas = TimetableHistoryModel.find(
+            {
+                **entity_filter,
+                "snapshot": False,
+                "timestamp": {"$gt": snapshot.timestamp, "$lte": at},
+            }
+        ).sort(+TimetableHistoryModel.timestamp)
+        async for delta in deltas:
+            if delta.entity_name is not None:
+                name = delta.entity_name
+            if delta.metadata is not None:
+                metadata = delta.metadata
+            for lesson_id in delta.removed:
+                lessons.pop(lesson_id, None)
+            for added in delta.added:
+                lessons[added.lesson_id] = added.lesson
+            for update in delta.modified:
+                lesson = lessons.get(update.lesson_id)
+                if lesson is not None:
+                    lessons[update.lesson_id] = lesson.model_copy(update=update.fields)
 
-            lesson_model = LessonModel(
-                schedule_type=lesson.schedule_type.value,
-                time_begin=time_str,
-                lesson_name=lesson.lesson_name or "",
-                schedule_form=lesson.schedule_form.value
-                if lesson.schedule_form
-                else None,
-                week_number=lesson.week_number.value if lesson.week_number else None,
-                day_name=lesson.day_name.value if lesson.day_name else None,
-                day_date=lesson.day_date,
-                duration=duration_seconds,
-                lesson_type=lesson.lesson_type.value if lesson.lesson_type else None,
-                groups=lesson.groups or [],
-                professors=lesson.professors or [],
-                auditorium=lesson.auditorium or "",
-                location=lesson.location or "",
-                subgroups=lesson.subgroups.value
-                if lesson.subgroups
-                else Subgroup.COMMON.value,
+        return TimetableData(
+            entity=Entity(type=entity_type, id=entity_id, name=name),
+            metadata=self._metadata_from_model(metadata),
+            lessons=sorted(
+                (self._lesson_from_model(lesson) for lesson in lessons.values()),
+                key=self._lesson_order,
+            ),
+        )
+
+    @profile(func_name="database.get_changes_since")
+    async def get_changes_since(
+        self, since: datetime, entities: Optional[List[Entity]] = None
+    ) -> List[TimetableHistoryModel]:
+        """Разницы, записанные после since, в порядке записи; снимки не входят."""
+        await self.initialize()
+        query = {"snapshot": False, "timestamp": {"$gt": since}}
+        if entities is not None:
+            entities_query = self._entities_query(entities, "entity_type", "entity_id")
+            if entities_query is None:
+                return []
+            query.update(entities_query)
+        return (
+            await TimetableHistoryModel.find(query)
+            .sort(+TimetableHistoryModel.timestamp)
+            .to_list()
+        )
+
+    @profile(func_name="database.prune_history")
+    async def prune_history(self, before: datetime) -> int:
+        """Удаляет записи старше последнего снимка до before: история на любой
+        момент после before восстанавливается по-прежнему."""
+        await self.initialize()
+        latest_snapshots = {}
+        snapshots = TimetableHistoryModel.get_motor_collection().find(
+            {"snapshot": True, "timestamp": {"$lte": before}},
+            {"entity_type": 1, "entity_id": 1, "timestamp": 1},
+        )
+        async for snapshot in snapshots:
+            key = (snapshot["entity_type"], snapshot["entity_id"])
+            if (
+                key not in latest_snapshots
+                or snapshot["timestamp"] > latest_snapshots[key]
+            ):
+                latest_snapshots[key] = snapshot["timestamp"]
+
+        collection = TimetableHistoryModel.get_motor_collection()
+        deleted = 0
+        operations = [
+            pymongo.DeleteMany(
+                {
+                    "entity_type": entity_type,
+                    "entity_id": entity_id,
+                    "timestamp": {"$lt": timestamp},
+                }
             )
-            lesson_models.append(lesson_model)
+            for (entity_type, entity_id), timestamp in latest_snapshots.items()
+        ]
+        for start in range(0, len(operations), BULK_WRITE_BATCH):
+            result = await collection.bulk_write(
+                operations[start : start + BULK_WRITE_BATCH], ordered=False
+            )
+            deleted += result.deleted_count
+        return deleted
+
+    @profile(func_name="database._to_model")
+    def _to_model(self, timetable: TimetableData) -> TimetableModel:
+        if not timetable.entity:
+            raise ValueError("Timetable Entity is None")
+        if not timetable.entity.type:
+            raise ValueError("Timetable Entity type is None")
+        if not timetable.entity.id or timetable.entity.id <= 0:
+            raise ValueError(f"Invalid Timetable Entity id: {timetable.entity.id}")
+
+        entity_model = self._entity_to_model(timetable.entity)
+        metadata_model = self._metadata_to_model(timetable.metadata)
+
+        lesson_models = [
+            self._lesson_to_model(lesson)
+            for lesson in timetable.lessons
+            if lesson.schedule_type
+        ]
 
         timetable_model = TimetableModel(
             entity=entity_model, metadata=metadata_model, lessons=lesson_models
@@ -366,71 +1191,133 @@ class Database:
 
         return timetable_model
 
+    @staticmethod
+    def _entity_to_model(entity: Entity) -> EntityModel:
+        entity_model = EntityModel(
+            type=entity.type.value,
+            id=entity.id,
+            name=entity.name or "",
+        )
+
+        if entity_model.type is None or entity_model.id is None or entity_model.id <= 0:
+            raise ValueError("Entity model validation error")
+        return entity_model
+
+    @staticmethod
+    def _metadata_to_model(metadata: Metadata) -> MetadataModel:
+        if not metadata:
+            raise ValueError("Timetable metadata is None")
+        if not metadata.week_number:
+            raise ValueError("Timetable metadata week_number is None")
+
+        return MetadataModel(
+            years=metadata.years or "",
+            date=metadata.date.date()
+            if isinstance(metadata.date, datetime)
+            else metadata.date,
+            week_number=metadata.week_number.value,
+            semester=metadata.semester.value if metadata.semester else None,
+        )
+
+    @staticmethod
+    def _lesson_to_model(lesson: Lesson) -> LessonModel:
+        time_str = lesson.time_begin.strftime("%H:%M") if lesson.time_begin else "00:00"
+
+        duration_seconds = (
+            int(lesson.duration.total_seconds()) if lesson.duration else None
+        )
+
+        return LessonModel(
+            schedule_type=lesson.schedule_type.value,
+            time_begin=time_str,
+            lesson_name=lesson.lesson_name or "",
+            schedule_form=lesson.schedule_form.value if lesson.schedule_form else None,
+            week_number=lesson.week_number.value if lesson.week_number else None,
+            day_name=lesson.day_name.value if lesson.day_name else None,
+            day_date=lesson.day_date,
+            duration=duration_seconds,
+            lesson_type=lesson.lesson_type.value if lesson.lesson_type else None,
+            groups=lesson.groups or [],
+            professors=lesson.professors or [],
+            auditorium=lesson.auditorium or "",
+            location=lesson.location or "",
+            subgroups=lesson.subgroups.value
+            if lesson.subgroups
+            else Subgroup.COMMON.value,
+        )
+
     @profile(func_name="database._from_model")
     def _from_model(self, model: TimetableModel) -> TimetableData:
-        entity_obj = Entity(
-            type=EntityType(model.entity.type),
-            id=model.entity.id,
-            name=model.entity.name,
+        return TimetableData(
+            entity=self._entity_from_model(model.entity),
+            metadata=self._metadata_from_model(model.metadata),
+            lessons=[
+                self._lesson_from_model(lesson_model) for lesson_model in model.lessons
+            ],
         )
 
-        metadata_obj = Metadata(
-            years=model.metadata.years,
-            date=model.metadata.date.date()
-            if hasattr(model.metadata.date, "date")
-            else model.metadata.date,
-            week_number=WeekNumber(model.metadata.week_number),
-            semester=Semester(model.metadata.semester)
-            if model.metadata.semester
-            else None,
+    @staticmethod
+    def _entity_from_model(entity_model: EntityModel) -> Entity:
+        return Entity(
+            type=EntityType(entity_model.type),
+            id=entity_model.id,
+            name=entity_model.name,
         )
 
-        lessons = []
-        for lesson_model in model.lessons:
-            try:
-                time_obj = (
-                    datetime.strptime(lesson_model.time_begin, "%H:%M").time()
-                    if lesson_model.time_begin
-                    else time(0, 0)
-                )
-            except ValueError:
-                time_obj = time(0, 0)
+    @staticmethod
+    def _metadata_from_model(metadata_model: MetadataModel) -> Metadata:
+        return Metadata(
+            years=metadata_model.years,
+            date=metadata_model.date.date()
+            if hasattr(metadata_model.date, "date")
+            else metadata_model.date,
+            week_number=WeekNumber(metadata_model.week_number),
+            semester=Semester(metadata_model.semester)
+            if metadata_model.semester
+            else None,
+        )
 
-            duration_obj = (
-                timedelta(seconds=lesson_model.duration)
-                if lesson_model.duration is not None
-                else None
+    @staticmethod
+    def _lesson_from_model(lesson_model: LessonModel) -> Lesson:
+        try:
+            time_obj = (
+                datetime.strptime(lesson_model.time_begin, "%H:%M").time()
+                if lesson_model.time_begin
+                else time(0, 0)
             )
+        except ValueError:
+            time_obj = time(0, 0)
 
-            lesson = Lesson(
-                schedule_type=ScheduleType(lesson_model.schedule_type),
-                time_begin=time_obj,
-                lesson_name=lesson_model.lesson_name,
-                schedule_form=ScheduleForm(lesson_model.schedule_form)
-                if lesson_model.schedule_form
-                else None,
-                week_number=WeekNumber(lesson_model.week_number)
-                if lesson_model.week_number
-                else None,
-                day_name=DayName(lesson_model.day_name)
-                if lesson_model.day_name
-                else None,
-                day_date=lesson_model.day_date,
-                duration=duration_obj,
-                lesson_type=LessonType(lesson_model.lesson_type)
-                if lesson_model.lesson_type
-                else None,
-                groups=lesson_model.groups,
-                professors=lesson_model.professors,
-                auditorium=lesson_model.auditorium,
-                location=lesson_model.location,
-                subgroups=Subgroup(lesson_model.subgroups)
-                if lesson_model.subgroups
-                else Subgroup.COMMON,
-            )
-            lessons.append(lesson)
+        duration_obj = (
+            timedelta(seconds=lesson_model.duration)
+            if lesson_model.duration is not None
+            else None
+        )
 
-        return TimetableData(entity=entity_obj, metadata=metadata_obj, lessons=lessons)
+        return Lesson(
+            schedule_type=ScheduleType(lesson_model.schedule_type),
+            time_begin=time_obj,
+            lesson_name=lesson_model.lesson_name,
+            schedule_form=ScheduleForm(lesson_model.schedule_form)
+            if lesson_model.schedule_form
+            else None,
+            week_number=WeekNumber(lesson_model.week_number)
+            if lesson_model.week_number
+            else None,
+            day_name=DayName(lesson_model.day_name) if lesson_model.day_name else None,
+            day_date=lesson_model.day_date,
+            duration=duration_obj,
+            lesson_type=LessonType(lesson_model.lesson_type)
+            if lesson_model.lesson_type
+            else None,
+            groups=lesson_model.groups,
+            professors=lesson_model.professors,
+            auditorium=lesson_model.auditorium,
+            location=lesson_model.location,
+            subgroups=Subgroup(lesson_model.subgroups)
+            if lesson_model.subgroups
+            else Subgroup.COMMON,
+        )
 
     @profile(func_name="database.close")
     async def close(self):
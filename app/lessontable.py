@@ -0,0 +1,277 @@
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Type
+import numpy as np
+from occupancy import DEFAULT_DURATION
+from parser_types import (
+    DayName,
+    EntityType,
+    Lesson,
+    LessonType,
+    ScheduleForm,
+    ScheduleType,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+)
+from profiler import profile
+
+# Код отсутствующего значения во всех колонках
+NONE = -1
+
+ENUM_COLUMNS: Dict[str, Type[Enum]] = {
+    "schedule_type": ScheduleType,
+    "schedule_form": ScheduleForm,
+    "week_number": WeekNumber,
+    "day_name": DayName,
+    "lesson_type": LessonType,
+    "subgroups": Subgroup,
+}
+STRING_COLUMNS = ("lesson_name", "auditorium", "location")
+COLUMNS = (
+    "entity_type",
+    "entity_id",
+    "entity_name",
+    *ENUM_COLUMNS,
+    "day_date",
+    "start",
+    "duration",
+    *STRING_COLUMNS,
+)
+# Колонки ключа Auditorium.lesson_key
+LESSON_KEY = (
+    "schedule_type",
+    "start",
+    "lesson_name",
+    "week_number",
+    "day_name",
+    "day_date",
+    "auditorium",
+    "lesson_type",
+    "subgroups",
+)
+
+
+def enum_code(enum_type: Type[Enum], value: Optional[Enum]) -> int:
+    """Код члена перечисления — его позиция в объявлении."""
+    return NONE if value is None else ENUM_CODES[enum_type][value]
+
+
+ENUM_CODES: Dict[Type[Enum], Dict[Enum, int]] = {
+    enum_type: {member: code for code, member in enumerate(enum_type)}
+    for enum_type in (*ENUM_COLUMNS.values(), EntityType)
+}
+
+
+class Dictionary:
+    """Словарное кодирование строк: код — порядковый номер первого появления."""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return NONE
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value: str) -> int:
+        """Код без добавления: NONE для неизвестной строки."""
+        return self.codes.get(value, NONE)
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code == NONE else self.values[code]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class LessonTable:
+    """Занятия всех расписаний цикла в колоночном виде.
+
+    Строка — одно занятие одного расписания. Перечисления хранятся кодами
+    (ENUM_CODES), строки — кодами словарей, дата — порядковым номером дня,
+    время — минутами от полуночи. Группы и преподаватели занятия лежат в
+    отдельных таблицах связей (строка занятия, код), поэтому группировки,
+    фильтры и соединения считаются операциями над массивами numpy, а не
+    обходом вложенных списков TimetableData.lessons.
+    """
+
+    def __init__(self):
+        self.strings = Dictionary()
+        self.groups = Dictionary()
+        self.professors = Dictionary()
+        # Исходные объекты по строкам, чтобы вернуть занятия из результата
+        self.lessons: List[Lesson] = []
+        self.columns: Dict[str, np.ndarray] = {}
+        self.group_links: Tuple[np.ndarray, np.ndarray] = (
+            np.empty(0, np.int32),
+            np.empty(0, np.int32),
+        )
+        self.professor_links: Tuple[np.ndarray, np.ndarray] = self.group_links
+
+    @staticmethod
+    @profile(func_name="lessontable.from_timetables")
+    def from_timetables(timetables: Iterable[TimetableData]) -> "LessonTable":
+        table = LessonTable()
+        records = []
+        group_rows, group_codes, professor_rows, professor_codes = [], [], [], []
+        schedule_types, schedule_forms, weeks, days, lesson_types, subgroups = (
+            ENUM_CODES[enum_type] for enum_type in ENUM_COLUMNS.values()
+        )
+        encode = table.strings.encode
+        encode_group = table.groups.encode
+        encode_professor = table.professors.encode
+
+        for timetable in timetables:
+            entity_type = ENUM_CODES[EntityType][timetable.entity.type]
+            entity_id = timetable.entity.id
+            # Имя владельца расписания кодируется в словарь его же типа, чтобы
+            # связать занятия с группой или преподавателем, которых нет в
+            # lesson.groups / lesson.professors
+            entity_name = NONE
+            if timetable.entity.type == EntityType.GROUP:
+                entity_name = encode_group(timetable.entity.name)
+            elif timetable.entity.type == EntityType.PROFESSOR:
+                entity_name = encode_professor(timetable.entity.name)
+            for lesson in timetable.lessons:
+                row = len(records)
+                time_begin = lesson.time_begin
+                records.append(
+                    (
+                        entity_type,
+                        entity_id,
+                        entity_name,
+                        schedule_types[lesson.schedule_type],
+                        NONE
+                        if lesson.schedule_form is None
+                        else schedule_forms[lesson.schedule_form],
+                        NONE
+                        if lesson.week_number is None
+                        else weeks[lesson.week_number],
+                        NONE if lesson.day_name is None else days[lesson.day_name],
+                        NONE
+                        if lesson.lesson_type is None
+                        else lesson_types[lesson.lesson_type],
+                        subgroups[lesson.subgroups],
+                        lesson.day_date.toordinal() if lesson.day_date else NONE,
+                        time_begin.hour * 60 + time_begin.minute
+                        if time_begin
+                        else NONE,
+                        int(lesson.duration.total_seconds() // 60)
+                        if lesson.duration
+                        else NONE,
+                        encode(lesson.lesson_name),
+                        encode(lesson.auditorium),
+                        encode(lesson.location),
+                    )
+                )
+                for group in lesson.groups or ():
+                    group_rows.append(row)
+                    group_codes.append(encode_group(group))
+                for professor in lesson.professors or ():
+                    professor_rows.append(row)
+                    professor_codes.append(encode_professor(professor))
+                table.lessons.append(lesson)
+
+        matrix = np.array(records, dtype=np.int32).reshape(len(records), len(COLUMNS))
+        for position, name in enumerate(COLUMNS):
+            dtype = (
+                np.int8 if name in ENUM_COLUMNS or name == "entity_type" else np.int32
+            )
+            table.columns[name] = np.ascontiguousarray(matrix[:, position], dtype=dtype)
+        table.group_links = (
+            np.array(group_rows, dtype=np.int32),
+            np.array(group_codes, dtype=np.int32),
+        )
+        table.professor_links = (
+            np.array(professor_rows, dtype=np.int32),
+            np.array(professor_codes, dtype=np.int32),
+        )
+        return table
+
+    def __len__(self) -> int:
+        return len(self.lessons)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def end(self) -> np.ndarray:
+        """Минута окончания; занятия без длительности считаются одной парой."""
+        duration = self.columns["duration"]
+        return self.columns["start"] + np.where(
+            duration == NONE, DEFAULT_DURATION, duration
+        )
+
+    def encode(self, name: str, value) -> int:
+        """Код значения для сравнения с колонкой name."""
+        if value is None:
+            return NONE
+        if name in ENUM_COLUMNS:
+            return enum_code(ENUM_COLUMNS[name], value)
+        if name == "entity_type":
+            return enum_code(EntityType, value)
+        if name in STRING_COLUMNS:
+            return self.strings.code(value)
+        return value
+
+    def links(
+        self, kind: str, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Соединение строк с группами (kind="groups") или преподавателями
+        ("professors"): пары (строка, код), по умолчанию для всех строк."""
+        link_rows, codes = (
+            self.group_links if kind == "groups" else self.professor_links
+        )
+        if rows is None:
+            return link_rows, codes
+        selected = np.zeros(len(self), dtype=bool)
+        selected[rows] = True
+        keep = selected[link_rows]
+        return link_rows[keep], codes[keep]
+
+    def group_by(
+        self, keys: Sequence[str], rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Группировка строк по колонкам keys.
+
+        Возвращает номер группы каждой строки rows (по умолчанию всех) и
+        первую строку каждой группы. Группы пронумерованы в порядке первого
+        появления, как ключи словаря при обходе в цикле.
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        return group_ids([self.columns[key][rows] for key in keys], rows)
+
+
+def group_ids(
+    keys: Sequence[np.ndarray], rows: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Номера групп строк с одинаковыми значениями keys (в порядке первого
+    появления) и первая строка каждой группы (из rows, если заданы)."""
+    size = len(keys[0])
+    if size == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    # Устойчивая сортировка по ключам: внутри группы строки идут в исходном порядке
+    order = np.lexsort(keys[::-1])
+    boundary = np.zeros(size, dtype=bool)
+    boundary[0] = True
+    for key in keys:
+        sorted_key = key[order]
+        boundary[1:] |= sorted_key[1:] != sorted_key[:-1]
+    sorted_group = np.cumsum(boundary) - 1
+    firsts = order[boundary]
+
+    # Перенумеровываем группы по первой строке
+    renumber = np.empty(len(firsts), dtype=np.int64)
+    renumber[np.argsort(firsts, kind="stable")] = np.arange(len(firsts))
+    ids = np.empty(size, dtype=np.int64)
+    ids[order] = renumber[sorted_group]
+    firsts = np.sort(firsts)
+    return ids, (firsts if rows is None else rows[firsts])
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+from aiohttp import ClientConnectionError, ClientResponseError
+from loguru import logger
+from config import settings
+
+
+class AdaptiveLimiter:
+    """AIMD-ограничитель числа одновременных запросов к серверу расписания.
+
+    Лимит растет на единицу за каждое "окно" из limit успешных запросов, пока p95
+    задержки и доля ошибок в норме, и уменьшается в разы при таймаутах, ошибках
+    соединения и ответах 5xx.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        error_rate_target: float,
+        hold: float = 0.0,
+        window: int = 100,
+        backoff: float = 0.5,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.error_rate_target = error_rate_target
+        self.backoff = backoff
+        self.hold = hold
+        self.in_flight = 0
+        self.waiting = 0
+
+        self._latencies = deque(maxlen=window)
+        self._errors = deque(maxlen=window)
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @staticmethod
+    def from_settings() -> "AdaptiveLimiter":
+        return AdaptiveLimiter(
+            initial=settings.FETCH_CONCURRENCY_INITIAL,
+            min_limit=settings.FETCH_CONCURRENCY_MIN,
+            max_limit=settings.FETCH_CONCURRENCY_MAX,
+            latency_target=settings.FETCH_LATENCY_TARGET,
+            error_rate_target=settings.FETCH_ERROR_RATE_TARGET,
+            hold=settings.ANTI_DDOS_FETCH_INTERVAL,
+        )
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._latencies)
+
+    async def acquire(self):
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(
+                    lambda: self.in_flight < self.current_limit
+                )
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(time.perf_counter() - start_time, e)
+            raise
+        else:
+            self.record(time.perf_counter() - start_time)
+        finally:
+            if self.hold:
+                # Пауза анти-DDoS удерживает слот, ограничивая темп запросов
+                await asyncio.sleep(self.hold)
+            await self.release()
+
+    def record(self, latency: float, error: Optional[BaseException] = None):
+        congested = error is not None and self.is_congestion(error)
+        self._errors.append(congested)
+        self._latencies.append(latency)
+
+        if congested:
+            self._decrease(self.backoff)
+            return
+        if error is not None:
+            # Ошибки вроде 404 не говорят о перегрузке сервера
+            return
+
+        self._successes += 1
+        if self._successes < self.current_limit:
+            return
+        self._successes = 0
+
+        if self.p95() > self.latency_target:
+            self._decrease(0.9)
+        elif self.error_rate() <= self.error_rate_target:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+    def p95(self) -> float:
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self) -> float:
+        if not self._errors:
+            return 0.0
+        return sum(self._errors) / len(self._errors)
+
+    def _decrease(self, factor: float):
+        # Не чаще одного раза за p95: запросы, уже отправленные при старом лимите,
+        # не должны уменьшать его повторно
+        now = time.monotonic()
+        if now - self._last_decrease < self.p95():
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self.limit = max(self.min_limit, self.limit * factor)
+        logger.debug(f"Fetch concurrency limit decreased to {self.current_limit}")
+
+    @staticmethod
+    def is_congestion(error: BaseException) -> bool:
+        if isinstance(error, (asyncio.TimeoutError, ClientConnectionError)):
+            return True
+        if isinstance(error, ClientResponseError):
+            return error.status >= 500 or error.status == 429
+        return False
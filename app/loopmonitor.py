@@ -0,0 +1,174 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+from loguru import logger
+from tabulate import tabulate
+from config import settings
+from metrics import metrics
+from parser_types import Entity
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Обертки, которые никогда не бывают настоящей причиной блокировки
+SKIP_FILES = {
+    os.path.join(APP_DIR, name)
+    for name in ("profiler.py", "logger.py", "tracing.py", "loopmonitor.py")
+}
+
+COUNT, TOTAL_TIME, MAX_TIME = range(3)
+
+
+class BlockCapture:
+    def __init__(self, beat: float, offender: str, entity: Optional[str], stack: str):
+        self.beat = beat
+        self.offender = offender
+        self.entity = entity
+        self.stack = stack
+
+
+class LoopMonitor:
+    """Измеряет задержку event loop и ищет, кто его блокирует.
+
+    Сердцебиение на loop каждые interval секунд отмечает время, а сторожевой поток
+    проверяет, не застрял ли loop дольше threshold. Если застрял, поток снимает
+    стек потока loop, пока блокирующий код еще выполняется, а после разблокировки
+    сердцебиение записывает длительность на счет найденной функции.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        # [count, total_time, max_time] на функцию за текущий цикл
+        self.offenders: Dict[str, list] = {}
+        self.stacks: Dict[str, str] = {}
+
+        self._beat = time.perf_counter()
+        self._capture: Optional[BlockCapture] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._task = asyncio.create_task(self._heartbeat())
+        if self.threshold > 0:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def report(self, top: int = 10) -> str:
+        rows = sorted(
+            self.offenders.items(), key=lambda item: item[1][TOTAL_TIME], reverse=True
+        )[:top]
+        return tabulate(
+            [
+                [
+                    offender,
+                    stats[COUNT],
+                    round(stats[TOTAL_TIME], 3),
+                    round(stats[MAX_TIME] * 1000),
+                ]
+                for offender, stats in rows
+            ],
+            headers=["Blocking function", "Blocks", "Total (s)", "Max (ms)"],
+            tablefmt="grid",
+        )
+
+    def log_report(self, top: int = 10):
+        """Пишет топ блокирующих функций за цикл и обнуляет статистику."""
+        if not self.offenders:
+            return
+        logger.warning(f"Event loop blocked by:\n{self.report(top)}")
+        worst = max(self.offenders.items(), key=lambda item: item[1][TOTAL_TIME])[0]
+        logger.debug(f"Last stack of {worst}:\n{self.stacks[worst]}")
+        self.offenders = {}
+        self.stacks = {}
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._beat - self.interval)
+            metrics.event_loop_lag.set(lag)
+
+            capture = self._capture
+            self._capture = None
+            if capture is not None and capture.beat == self._beat:
+                self._record(capture, lag)
+
+    def _record(self, capture: BlockCapture, duration: float):
+        stats = self.offenders.get(capture.offender)
+        if stats is None:
+            stats = self.offenders.setdefault(capture.offender, [0, 0.0, 0.0])
+        stats[COUNT] += 1
+        stats[TOTAL_TIME] += duration
+        stats[MAX_TIME] = max(stats[MAX_TIME], duration)
+        self.stacks[capture.offender] = capture.stack
+        metrics.loop_blocks.inc(capture.offender)
+        metrics.loop_blocked_seconds.inc(capture.offender, amount=duration)
+
+        target = f" on {capture.entity}" if capture.entity else ""
+        logger.warning(
+            f"{capture.offender} blocked the event loop {duration * 1000:.0f} ms{target}"
+        )
+
+    def _watch(self):
+        check_interval = min(self.interval, self.threshold / 2)
+        while not self._stopped.wait(check_interval):
+            beat = self._beat
+            if self._capture is not None and self._capture.beat == beat:
+                continue
+            if time.perf_counter() - beat - self.interval > self.threshold:
+                self._capture = self._snapshot(beat)
+
+    def _snapshot(self, beat: float) -> Optional[BlockCapture]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+
+        offender = None
+        entity = None
+        innermost = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(APP_DIR) and filename not in SKIP_FILES:
+                if offender is None:
+                    offender = (
+                        f"{frame.f_code.co_qualname} "
+                        f"({os.path.basename(filename)}:{frame.f_code.co_firstlineno})"
+                    )
+                if entity is None:
+                    entity = self._frame_entity(frame)
+            frame = frame.f_back
+
+        if offender is None:
+            code = innermost.f_code
+            offender = f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+        stack = "".join(traceback.format_stack(innermost, limit=30))
+        return BlockCapture(beat, offender, entity, stack)
+
+    @staticmethod
+    def _frame_entity(frame) -> Optional[str]:
+        local_vars = frame.f_locals
+        candidate = local_vars.get("entity")
+        if not isinstance(candidate, Entity):
+            candidate = getattr(local_vars.get("timetable"), "entity", None)
+        if isinstance(candidate, Entity):
+            return f"{candidate.type.value} {candidate.id}"
+        return None
+
+
+loop_monitor = LoopMonitor(threshold=settings.LOOP_BLOCK_THRESHOLD)
@@ -1,21 +1,42 @@
 import asyncio
+import signal
 from loguru import logger
 
 from logger import configure_logging
 from config import settings
 
 from runner import Runner
+from sharding import Sharding
+from metrics import metrics
+from loopmonitor import loop_monitor
+from sampler import stack_sampler
+from outbox import OutboxPublisher
 
 
 async def main():
     logger.info("Starting")
+    loop_monitor.start()
+    # kill -USR2 <pid> включает сэмплирующий профилировщик на следующий цикл
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, stack_sampler.arm)
+    if settings.METRICS_PORT:
+        await metrics.serve(settings.METRICS_HOST, settings.METRICS_PORT)
+    publisher = None
 
     while True:
+        # Публикатор outbox живет отдельно от циклов; перезапускаем, если упал
+        if settings.PUBLISH_MODE == "outbox" and (
+            publisher is None or publisher.done()
+        ):
+            publisher = asyncio.create_task(OutboxPublisher.serve())
         try:
             await Runner.process_all_entities()
         except Exception as e:
             logger.exception(f"Error in main loop: {e}")
-        await asyncio.sleep(settings.ENTITIES_FETCH_INTERVAL)
+        if settings.SHARDS_COUNT > 1:
+            # Реплики выравниваются по границе цикла, чтобы попасть в один цикл
+            await asyncio.sleep(Sharding.until_next_cycle())
+        else:
+            await asyncio.sleep(settings.ENTITIES_FETCH_INTERVAL)
 
 
 if __name__ == "__main__":
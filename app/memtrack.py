@@ -0,0 +1,175 @@
+import gc
+import os
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import List, Optional
+import psutil
+from loguru import logger
+from tabulate import tabulate
+from config import settings
+
+TOP_SITES = 10
+TOP_TYPES = 5
+
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _megabytes(size: float) -> float:
+    return round(size / 1024 / 1024, 2)
+
+
+def _count_objects() -> Counter:
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class MemoryTracker:
+    """Снимки памяти вокруг этапов цикла: tracemalloc и число объектов по типам.
+
+    После каждого этапа считается прирост памяти, пик внутри этапа и главные места
+    аллокаций, а в конце цикла — что осталось в памяти по сравнению с концом
+    предыдущего цикла, чтобы ловить утечки в долгоживущем контейнере.
+    tracemalloc замедляет код в разы, поэтому трекер включается только
+    настройкой MEMORY_TRACKING.
+    """
+
+    def __init__(self, enabled: bool, frames: int = 1):
+        self.enabled = enabled
+        self.frames = frames
+        self.process = psutil.Process(os.getpid())
+        self.rows: List[list] = []
+        self.site_reports: List[str] = []
+
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._object_counts: Optional[Counter] = None
+        self._cycle_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._cycle_object_counts: Optional[Counter] = None
+
+    def cycle(self):
+        if not self.enabled:
+            return nullcontext()
+        return self._cycle()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _cycle(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.rows = []
+        self.site_reports = []
+        self._snapshot = self._take_snapshot()
+        self._object_counts = _count_objects()
+        try:
+            yield
+        finally:
+            gc.collect()
+            snapshot = self._take_snapshot()
+            object_counts = _count_objects()
+            self._log_report()
+            if self._cycle_snapshot is not None:
+                self._log_cycle_growth(snapshot, object_counts)
+            self._cycle_snapshot = snapshot
+            self._cycle_object_counts = object_counts
+            self._snapshot = None
+            self._object_counts = None
+
+    @contextmanager
+    def _stage(self, name: str):
+        tracemalloc.reset_peak()
+        start_size, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            current_size, peak_size = tracemalloc.get_traced_memory()
+            snapshot = self._take_snapshot()
+            object_counts = _count_objects()
+
+            type_deltas = self._type_deltas(self._object_counts, object_counts)
+            self.rows.append(
+                [
+                    name,
+                    _megabytes(current_size - start_size),
+                    _megabytes(peak_size - start_size),
+                    _megabytes(current_size),
+                    _megabytes(self.process.memory_info().rss),
+                    ", ".join(
+                        f"{type_name} {delta:+}" for type_name, delta in type_deltas
+                    ),
+                ]
+            )
+            self.site_reports.append(
+                f"Top allocation sites of stage {name}:\n"
+                + self._format_sites(snapshot.compare_to(self._snapshot, "lineno"))
+            )
+            self._snapshot = snapshot
+            self._object_counts = object_counts
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def _log_report(self):
+        if not self.rows:
+            return
+        logger.info(
+            "Memory by stage:\n"
+            + tabulate(
+                self.rows,
+                headers=[
+                    "Stage",
+                    "Delta (MB)",
+                    "Peak (MB)",
+                    "Traced (MB)",
+                    "RSS (MB)",
+                    "Object count deltas",
+                ],
+                tablefmt="grid",
+            )
+        )
+        for report in self.site_reports:
+            logger.debug(report)
+
+    def _log_cycle_growth(self, snapshot: tracemalloc.Snapshot, object_counts: Counter):
+        type_deltas = self._type_deltas(self._cycle_object_counts, object_counts)
+        logger.info(
+            "Memory retained since previous cycle: "
+            + ", ".join(f"{type_name} {delta:+}" for type_name, delta in type_deltas)
+            + "\n"
+            + self._format_sites(snapshot.compare_to(self._cycle_snapshot, "lineno"))
+        )
+
+    @staticmethod
+    def _type_deltas(before: Counter, after: Counter) -> List[tuple]:
+        deltas = Counter(after)
+        deltas.subtract(before)
+        changed = [(type_name, delta) for type_name, delta in deltas.items() if delta]
+        changed.sort(key=lambda item: abs(item[1]), reverse=True)
+        return changed[:TOP_TYPES]
+
+    @staticmethod
+    def _format_sites(differences: List[tracemalloc.StatisticDiff]) -> str:
+        return tabulate(
+            [
+                [
+                    str(difference.traceback),
+                    _megabytes(difference.size_diff),
+                    difference.count_diff,
+                ]
+                for difference in differences[:TOP_SITES]
+            ],
+            headers=["Allocation site", "Delta (MB)", "Blocks"],
+            tablefmt="grid",
+        )
+
+
+memory_tracker = MemoryTracker(
+    enabled=settings.MEMORY_TRACKING, frames=settings.MEMORY_TRACKING_FRAMES
+)
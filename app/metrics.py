@@ -0,0 +1,251 @@
+import os
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import psutil
+from aiohttp import web
+from loguru import logger
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in list(self._values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            )
+        return lines
+
+
+class Gauge:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        self.function = function
+
+    def expose(self) -> List[str]:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logger.debug(f"Failed to collect gauge {self.name}: {e}")
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {value}",
+        ]
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам (последняя — +Inf), сумма, количество]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(
+                labels, [[0] * (len(self.buckets) + 1), 0.0, 0]
+            )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bucket, bucket_count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(
+                    (*self.labelnames, "le"), (*labels, bucket)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {total}")
+            lines.append(f"{self.name}_count{series_labels} {count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        process = psutil.Process(os.getpid())
+
+        self.stage_duration = Histogram(
+            "timetable_stage_duration_seconds",
+            "Duration of a pipeline stage call (fetch, parse, diff, persist, publish)",
+            ["stage"],
+        )
+        self.stage_errors = Counter(
+            "timetable_stage_errors_total",
+            "Pipeline stage calls that raised an exception",
+            ["stage"],
+        )
+        self.entities = Counter(
+            "timetable_entities_total",
+            "Processed entities by entity type and result",
+            ["entity_type", "result"],
+        )
+        self.cycle_duration = Gauge(
+            "timetable_cycle_duration_seconds", "Duration of the last full cycle"
+        )
+        self.cycle_finished = Gauge(
+            "timetable_cycle_finished_timestamp_seconds",
+            "Unix time the last cycle finished",
+        )
+        self.fetch_in_flight = Gauge(
+            "timetable_fetch_in_flight", "HTTP requests to the timetable site in flight"
+        )
+        self.fetch_queue_depth = Gauge(
+            "timetable_fetch_queue_depth", "Fetches waiting for a concurrency slot"
+        )
+        self.fetch_concurrency_limit = Gauge(
+            "timetable_fetch_concurrency_limit", "Current adaptive concurrency limit"
+        )
+        self.resident_memory = Gauge(
+            "process_resident_memory_bytes",
+            "Resident set size of the loader process",
+            function=lambda: process.memory_info().rss,
+        )
+        self.event_loop_lag = Gauge(
+            "timetable_event_loop_lag_seconds",
+            "How late the event loop woke up a periodic callback",
+        )
+        self.loop_blocks = Counter(
+            "timetable_event_loop_blocks_total",
+            "Callbacks that blocked the event loop longer than the threshold",
+            ["function"],
+        )
+        self.loop_blocked_seconds = Counter(
+            "timetable_event_loop_blocked_seconds_total",
+            "Time the event loop spent blocked, by blocking function",
+            ["function"],
+        )
+        self.conflicts = Gauge(
+            "timetable_booking_conflicts",
+            "Overlapping bookings of auditoriums, professors and groups in the last cycle",
+        )
+        self.outbox_published = Counter(
+            "timetable_outbox_published_total",
+            "Change messages published from the outbox and confirmed by RabbitMQ",
+        )
+        self.outbox_coalesced = Counter(
+            "timetable_outbox_coalesced_total",
+            "Outbox entries merged into another message or dropped as cancelled out",
+        )
+        self.outbox_lag = Gauge(
+            "timetable_outbox_lag_seconds",
+            "Age of the oldest outbox entry in the last drained batch",
+        )
+        self.collectors = [
+            self.stage_duration,
+            self.stage_errors,
+            self.entities,
+            self.cycle_duration,
+            self.cycle_finished,
+            self.fetch_in_flight,
+            self.fetch_queue_depth,
+            self.fetch_concurrency_limit,
+            self.resident_memory,
+            self.event_loop_lag,
+            self.loop_blocks,
+            self.loop_blocked_seconds,
+            self.conflicts,
+            self.outbox_published,
+            self.outbox_coalesced,
+            self.outbox_lag,
+        ]
+        self._runner = None
+
+    def expose(self) -> str:
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.expose())
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.expose(), content_type="text/plain", charset="utf-8"
+        )
+
+
+metrics = Metrics()
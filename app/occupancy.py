@@ -0,0 +1,172 @@
+from bisect import bisect_right
+from datetime import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from parser_types import (
+    DayName,
+    EntityType,
+    Lesson,
+    ScheduleType,
+    TimetableData,
+    WeekNumber,
+)
+
+# Минуты от полуночи; занятия без длительности считаются одной парой
+DEFAULT_DURATION = 90
+DAY_START = 8 * 60
+DAY_END = 21 * 60
+
+Slot = Tuple[WeekNumber, DayName]
+# Отсортированные непересекающиеся интервалы занятости: начала и концы отдельно,
+# чтобы искать bisect'ом по спискам чисел
+Intervals = Tuple[List[int], List[int]]
+
+
+def to_minutes(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+
+def building_of(auditorium: str) -> str:
+    """Корпус — префикс до дефиса: "Л-307" -> "Л"."""
+    return auditorium.split("-", 1)[0] if "-" in auditorium else ""
+
+
+class OccupancyIndex:
+    """Занятость аудиторий по (неделя, день) в виде слитых интервалов.
+
+    Проверка "свободна ли аудитория в [start, end)" — один bisect по концам
+    интервалов, поэтому поиск свободных аудиторий в корпусе стоит
+    O(аудиторий * log занятий) без перебора занятий. Учитывается только
+    расписание занятий (ScheduleType.REGULAR): сессия привязана к датам, а не
+    к неделям.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Dict[Slot, Intervals]] = {}
+        # Те же интервалы, сгруппированные по (неделя, день) для поиска по всем
+        # аудиториям сразу
+        self.slots: Dict[Slot, Dict[str, Intervals]] = {}
+        self.buildings: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def from_timetables(timetables: Iterable[TimetableData]) -> "OccupancyIndex":
+        """Строит индекс по расписаниям аудиторий (Auditorium.from_timetables)."""
+        index = OccupancyIndex()
+        for timetable in timetables:
+            if timetable.entity.type == EntityType.AUDITORIUM and timetable.entity.name:
+                index.set_room(timetable.entity.name, timetable.lessons)
+        return index
+
+    def set_room(self, room: str, lessons: Iterable[Lesson]):
+        """Пересчитывает занятость одной аудитории по ее занятиям."""
+        busy: Dict[Slot, List[Tuple[int, int]]] = {}
+        for lesson in lessons:
+            if (
+                lesson.schedule_type != ScheduleType.REGULAR
+                or not lesson.week_number
+                or not lesson.day_name
+                or not lesson.time_begin
+            ):
+                continue
+            start = to_minutes(lesson.time_begin)
+            duration = (
+                int(lesson.duration.total_seconds() // 60)
+                if lesson.duration
+                else DEFAULT_DURATION
+            )
+            busy.setdefault((lesson.week_number, lesson.day_name), []).append(
+                (start, start + duration)
+            )
+
+        for slot_rooms in self.slots.values():
+            slot_rooms.pop(room, None)
+        self.rooms[room] = {slot: self._merge(spans) for slot, spans in busy.items()}
+        for slot, intervals in self.rooms[room].items():
+            self.slots.setdefault(slot, {})[room] = intervals
+        self.buildings.setdefault(building_of(room), set()).add(room)
+
+    def is_free(
+        self, room: str, week: WeekNumber, day: DayName, start: int, end: int
+    ) -> bool:
+        intervals = self.rooms.get(room, {}).get((week, day))
+        if intervals is None:
+            return True
+        starts, ends = intervals
+        # Первый интервал, который заканчивается позже start
+        position = bisect_right(ends, start)
+        return position == len(ends) or starts[position] >= end
+
+    def free_rooms(
+        self,
+        week: WeekNumber,
+        day: DayName,
+        start: int,
+        end: int,
+        building: Optional[str] = None,
+    ) -> List[str]:
+        rooms = self.buildings.get(building, ()) if building is not None else self.rooms
+        busy = self.slots.get((week, day), {})
+        free = []
+        for room in rooms:
+            intervals = busy.get(room)
+            if intervals is not None:
+                starts, ends = intervals
+                position = bisect_right(ends, start)
+                if position < len(ends) and starts[position] < end:
+                    continue
+            free.append(room)
+        free.sort()
+        return free
+
+    def next_free(
+        self,
+        room: str,
+        week: WeekNumber,
+        day: DayName,
+        start: int,
+        duration: int = DEFAULT_DURATION,
+    ) -> Optional[Tuple[WeekNumber, DayName, int, int]]:
+        """Ближайший свободный промежуток не короче duration, начиная с (week, day,
+        start) и дальше по дням двухнедельного цикла: (неделя, день, начало, конец)."""
+        if room not in self.rooms:
+            return None
+        days = list(DayName)
+        weeks = list(WeekNumber)
+        slot_order = [
+            (week_number, day_name) for week_number in weeks for day_name in days
+        ]
+        first = slot_order.index((week, day))
+
+        for offset in range(len(slot_order) + 1):
+            slot = slot_order[(first + offset) % len(slot_order)]
+            from_minute = max(start, DAY_START) if offset == 0 else DAY_START
+            gap = self._first_gap(self.rooms[room].get(slot), from_minute, duration)
+            if gap is not None:
+                return (*slot, *gap)
+        return None
+
+    @staticmethod
+    def _first_gap(
+        intervals: Optional[Intervals], from_minute: int, duration: int
+    ) -> Optional[Tuple[int, int]]:
+        cursor = from_minute
+        if intervals is not None:
+            starts, ends = intervals
+            for position in range(bisect_right(ends, cursor), len(starts)):
+                if starts[position] - cursor >= duration:
+                    return cursor, starts[position]
+                cursor = max(cursor, ends[position])
+        if DAY_END - cursor >= duration:
+            return cursor, DAY_END
+        return None
+
+    @staticmethod
+    def _merge(spans: List[Tuple[int, int]]) -> Intervals:
+        spans.sort()
+        starts, ends = [], []
+        for start, end in spans:
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
@@ -0,0 +1,173 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+from loguru import logger
+from broker import Broker
+from comparer import Comparer
+from config import settings
+from database import Database
+from metrics import metrics
+from parser_types import Entity, EntityType, TimetableChangeData
+from tracing import entity_scope
+
+
+def build_outbox(
+    changes: List[TimetableChangeData],
+) -> Dict[Tuple[EntityType, int], List[dict]]:
+    """Записи outbox по сущностям для Database.save_timetables/save_lessons."""
+    outbox = {}
+    for change in changes:
+        outbox.setdefault((change.entity.type, change.entity.id), []).append(
+            Broker.outbox_entry(change)
+        )
+    return outbox
+
+
+class OutboxPublisher:
+    """Фоновая задача, которая публикует изменения из outbox в RabbitMQ.
+
+    Цикл сохраняет изменения в документы сущностей вместе с расписаниями, а
+    публикатор забирает их пачками, публикует с подтверждениями брокера и только
+    потом удаляет из outbox. Забранный документ помечается на claim_ttl секунд,
+    поэтому публикаторы нескольких реплик не публикуют одни и те же записи. Публикация не задерживает цикл, а падение между
+    публикацией и удалением дает повтор с тем же message_id, а не потерю.
+
+    С coalesce_window > 0 изменения сущности ждут, пока самому старому из них
+    не исполнится coalesce_window секунд, и уходят одним сообщением с итоговой
+    разницей; компенсировавшие друг друга изменения не публикуются вовсе.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        broker: Broker,
+        batch_size: int,
+        interval: float,
+        coalesce_window: float = 0,
+        claim_ttl: float = 60,
+    ):
+        self.db = db
+        self.broker = broker
+        self.batch_size = batch_size
+        self.interval = interval
+        self.coalesce_window = coalesce_window
+        self.claim_ttl = claim_ttl
+        # Метка документов, забранных этим публикатором
+        self.owner = uuid.uuid4().hex
+
+    @staticmethod
+    def from_settings(db: Database, broker: Broker) -> "OutboxPublisher":
+        return OutboxPublisher(
+            db,
+            broker,
+            batch_size=settings.OUTBOX_BATCH_SIZE,
+            interval=settings.OUTBOX_POLL_INTERVAL,
+            coalesce_window=settings.OUTBOX_COALESCE_WINDOW,
+            claim_ttl=settings.OUTBOX_CLAIM_TTL,
+        )
+
+    @staticmethod
+    async def serve():
+        try:
+            async with (
+                Database(settings.MONGODB_URI, layout=settings.STORAGE_LAYOUT) as db,
+                Broker.from_settings() as broker,
+            ):
+                await OutboxPublisher.from_settings(db, broker).run()
+        except Exception as e:
+            logger.exception(f"Outbox publisher stopped: {e}")
+
+    async def run(self):
+        logger.info("Starting outbox publisher")
+        while True:
+            try:
+                published = await self.drain()
+            except Exception as e:
+                logger.exception(f"Error in outbox publisher: {e}")
+                published = 0
+            # Пока outbox отдает полные пачки, разбираем его без пауз
+            if published < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def drain(self) -> int:
+        """Публикует одну пачку документов из outbox; возвращает число снятых записей."""
+        before = None
+        if self.coalesce_window > 0:
+            before = datetime.now(timezone.utc) - timedelta(
+                seconds=self.coalesce_window
+            )
+        documents = await self.db.claim_outbox(
+            self.batch_size, self.owner, self.claim_ttl, before
+        )
+        if not documents:
+            return 0
+
+        # Изменения одной сущности публикуются по порядку, разные сущности — параллельно
+        publish = self._publish_coalesced if before else self._publish
+        results = await asyncio.gather(
+            *(self._publish_document(publish, document) for document in documents)
+        )
+        # Документы без опубликованных записей тоже освобождаются, чтобы их
+        # не ждать до истечения метки
+        acked = {
+            document["_id"]: entry_ids
+            for document, entry_ids in zip(documents, results)
+        }
+        await self.db.ack_outbox(acked, self.owner)
+
+        count = sum(len(entry_ids) for entry_ids in acked.values())
+        self._observe_lag(documents)
+        logger.info(f"Drained {count} outbox entries of {len(documents)} entities")
+        return count
+
+    @staticmethod
+    async def _publish_document(
+        publish: Callable[[List[dict]], Awaitable[List[str]]], document: dict
+    ) -> List[str]:
+        # Спан публикации попадает на дорожку сущности документа
+        entity = document["entity"]
+        with entity_scope(
+            Entity(
+                type=EntityType(entity["type"]),
+                id=entity["id"],
+                name=entity.get("name"),
+            )
+        ):
+            return await publish(document["outbox"])
+
+    async def _publish(self, entries: List[dict]) -> List[str]:
+        published = await self.broker.publish_outbox(entries)
+        metrics.outbox_published.inc(amount=len(published))
+        return published
+
+    async def _publish_coalesced(self, entries: List[dict]) -> List[str]:
+        """Публикует записи сущности одним сообщением; возвращает id всех записей,
+        которые можно снять из outbox."""
+        entry_ids = [entry["id"] for entry in entries]
+        if len(entries) == 1:
+            return await self._publish(entries)
+
+        merged = Comparer.merge_changes(
+            [Broker.loads(entry["body"]) for entry in entries]
+        )
+        if merged is not None:
+            entry = Broker.outbox_entry(merged)
+            # Повторная публикация той же пачки получит тот же message_id
+            entry["id"] = uuid.uuid5(uuid.NAMESPACE_OID, ",".join(entry_ids)).hex
+            entry["created_at"] = entries[0]["created_at"]
+            if not await self._publish([entry]):
+                return []
+        metrics.outbox_coalesced.inc(amount=len(entries) - (merged is not None))
+        return entry_ids
+
+    @staticmethod
+    def _observe_lag(documents: List[dict]):
+        oldest = min(
+            entry["created_at"]
+            for document in documents
+            for entry in document["outbox"]
+        )
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=timezone.utc)
+        metrics.outbox_lag.set((datetime.now(timezone.utc) - oldest).total_seconds())
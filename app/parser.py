@@ -12,8 +12,14 @@ from parser_types import (
     Metadata,
     Semester,
 )
-from aiohttp import ClientSession
+from limiter import AdaptiveLimiter
+from retrier import Retrier
+from archive import archive
+from aiohttp import ClientSession, ClientTimeout
+from config import settings
 from bs4 import BeautifulSoup
+from typing import Optional
+from contextlib import nullcontext
 import re
 from datetime import date, time, timedelta
 
@@ -21,21 +27,75 @@ from datetime import date, time, timedelta
 class Parser:
     @staticmethod
     @profile
-    async def get_timetable(entity: Entity) -> TimetableData:
-        html = await Parser._fetch_timetable(entity)
+    async def get_timetable(
+        entity: Entity,
+        session: Optional[ClientSession] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        retrier: Optional[Retrier] = None,
+    ) -> TimetableData:
+        if retrier:
+            html = await retrier.call(
+                lambda: Parser._fetch_timetable(entity, session, limiter)
+            )
+        else:
+            html = await Parser._fetch_timetable(entity, session, limiter)
         return Parser._parse_timetable(html, entity)
 
     @staticmethod
-    @profile
-    async def _fetch_timetable(entity: Entity) -> str:
-        async with ClientSession() as session:
-            async with session.get(
-                f"https://timetable.pallada.sibsau.ru/timetable/{entity.type.value}/{entity.id}"
-            ) as response:
-                return await response.text()
+    @profile(stage="fetch")
+    async def _fetch_timetable(
+        entity: Entity,
+        session: Optional[ClientSession] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ) -> str:
+        if archive and settings.FETCH_MODE == "replay":
+            return Parser._replay_timetable(entity)
+
+        if session is None:
+            async with ClientSession(
+                timeout=ClientTimeout(total=settings.FETCH_TIMEOUT)
+            ) as session:
+                return await Parser._request_timetable(entity, session, limiter)
+        return await Parser._request_timetable(entity, session, limiter)
 
     @staticmethod
-    @profile
+    async def _request_timetable(
+        entity: Entity,
+        session: ClientSession,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ) -> str:
+        # Без @profile: этап fetch замеряет вызывающий _fetch_timetable
+        html = None
+        try:
+            async with limiter.slot() if limiter else nullcontext():
+                async with session.get(
+                    f"{settings.TIMETABLE_BASE_URL}/timetable/{entity.type.value}/{entity.id}"
+                ) as response:
+                    html = await response.text()
+                    status = response.status
+                    response.raise_for_status()
+                    return html
+        finally:
+            # Ответ архивируется после освобождения слота, чтобы сжатие не
+            # попадало в задержку запроса, по которой лимитер меняет лимит
+            if archive and html is not None:
+                await archive.record(entity, status, html)
+
+    @staticmethod
+    def _replay_timetable(entity: Entity) -> str:
+        record = archive.find(entity.type, entity.id, settings.ARCHIVE_REPLAY_AT)
+        if record is None:
+            raise LookupError(
+                f"No archived response for {entity.type.value} {entity.id}"
+            )
+        if record.status >= 400:
+            raise Exception(
+                f"Archived response for {entity.type.value} {entity.id} has status {record.status}"
+            )
+        return archive.read(record)
+
+    @staticmethod
+    @profile(stage="parse")
     def _parse_timetable(html: str, entity: Entity) -> TimetableData:
         soup = BeautifulSoup(html, "html.parser")
 
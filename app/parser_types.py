@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict, Tuple
 from enum import Enum
 from datetime import date, time, timedelta
 
@@ -122,3 +122,11 @@ class TimetableChangeData:
     entity: Entity
     metadata_changes: Optional[List[FieldChange]] = None
     lesson_changes: Optional[List[LessonChange]] = None
+
+
+@dataclass
+class LessonsDiff:
+    # Ключ — Comparer.lesson_identity занятия с номером повтора
+    added: Dict[tuple, Lesson]
+    removed: Dict[tuple, Lesson]
+    modified: Dict[tuple, Tuple[Lesson, List[FieldChange]]]
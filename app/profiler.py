@@ -1,9 +1,12 @@
 import time
 import asyncio
 import atexit
+import threading
 from functools import wraps
-from collections import defaultdict
+from collections import deque
 from config import settings
+from metrics import metrics
+from tracing import tracer
 import psutil
 import os
 from loguru import logger
@@ -12,65 +15,93 @@ from loguru import logger
 from tabulate import tabulate
 
 THRESHOLD_SECONDS = 1
+SAMPLE_INTERVAL = 1.0  # секунды
+SAMPLES_RING_SIZE = 3600
 
 RED = "\033[91m"
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
-if settings.DEBUG:
+PROFILING_ENABLED = settings.DEBUG or settings.PROFILE
+
+if PROFILING_ENABLED:
+    TOTAL_TIME, CALLS, MIN_TIME, MAX_TIME, SLOW_CALLS = range(5)
+
+    class ResourceSampler(threading.Thread):
+        def __init__(self, process, interval, ring_size):
+            super().__init__(name="profiler-sampler", daemon=True)
+            self.process = process
+            self.interval = interval
+            self.memory_samples = deque(maxlen=ring_size)
+            self.cpu_samples = deque(maxlen=ring_size)
+            self.stopped = threading.Event()
+
+        def run(self):
+            # Первый вызов cpu_percent(None) всегда возвращает 0, он только
+            # запоминает точку отсчета
+            self.process.cpu_percent(interval=None)
+            while not self.stopped.wait(self.interval):
+                self.sample()
+
+        def sample(self):
+            self.memory_samples.append(self.process.memory_info().rss / 1024 / 1024)
+            self.cpu_samples.append(self.process.cpu_percent(interval=None))
+
+        def stop(self):
+            self.stopped.set()
 
     class Profiler:
         def __init__(self):
-            self.function_stats = defaultdict(
-                lambda: {
-                    "total_time": 0,
-                    "calls": 0,
-                    "min_time": float("inf"),
-                    "max_time": 0,
-                    "slow_calls": 0,
-                }
-            )
+            # [total_time, calls, min_time, max_time, slow_calls] на функцию:
+            # запись изменяет список на месте без блокировок и новых объектов,
+            # кроме самих float
+            self.function_stats = {}
             self.process = psutil.Process(os.getpid())
-            self.memory_samples = []
-            self.cpu_samples = []
-            self.sample_interval = 1.0  # секунды
-            self.last_sample_time = time.time()
+            self.sampler = ResourceSampler(
+                self.process, interval=SAMPLE_INTERVAL, ring_size=SAMPLES_RING_SIZE
+            )
+            self.sampler.start()
 
             atexit.register(self.print_stats)
 
-        def add_execution_time(self, func_name, execution_time):
-            stats = self.function_stats[func_name]
-            stats["total_time"] += execution_time
-            stats["calls"] += 1
-            stats["min_time"] = min(stats["min_time"], execution_time)
-            stats["max_time"] = max(stats["max_time"], execution_time)
+        @property
+        def memory_samples(self):
+            return list(self.sampler.memory_samples)
 
-            if execution_time > THRESHOLD_SECONDS:
-                stats["slow_calls"] += 1
+        @property
+        def cpu_samples(self):
+            return list(self.sampler.cpu_samples)
 
-            current_time = time.time()
-            if current_time - self.last_sample_time >= self.sample_interval:
-                self._sample_resources()
-                self.last_sample_time = current_time
+        def add_execution_time(self, func_name, execution_time):
+            stats = self.function_stats.get(func_name)
+            if stats is None:
+                stats = self.function_stats.setdefault(
+                    func_name, [0.0, 0, float("inf"), 0.0, 0]
+                )
+            stats[TOTAL_TIME] += execution_time
+            stats[CALLS] += 1
+            if execution_time < stats[MIN_TIME]:
+                stats[MIN_TIME] = execution_time
+            if execution_time > stats[MAX_TIME]:
+                stats[MAX_TIME] = execution_time
+            if execution_time > THRESHOLD_SECONDS:
+                stats[SLOW_CALLS] += 1
 
         def _sample_resources(self):
-            memory_mb = self.process.memory_info().rss / 1024 / 1024
-            self.memory_samples.append(memory_mb)
-
-            cpu_percent = self.process.cpu_percent(interval=0.1)
-            self.cpu_samples.append(cpu_percent)
+            self.sampler.sample()
 
         def print_stats(self):
             if not self.function_stats:
                 return
 
+            self.sampler.stop()
             self._sample_resources()
 
             print("\n=== Function Execution Time Profile ===")
 
             sorted_stats = sorted(
                 [(name, data) for name, data in self.function_stats.items()],
-                key=lambda x: x[1]["total_time"],
+                key=lambda x: x[1][TOTAL_TIME],
                 reverse=True,
             )
 
@@ -86,24 +117,22 @@ if settings.DEBUG:
             ]
 
             for func_name, stats in sorted_stats:
-                avg_time = (
-                    stats["total_time"] / stats["calls"] if stats["calls"] > 0 else 0
-                )
-                min_time = stats["min_time"] if stats["min_time"] != float("inf") else 0
+                avg_time = stats[TOTAL_TIME] / stats[CALLS] if stats[CALLS] > 0 else 0
+                min_time = stats[MIN_TIME] if stats[MIN_TIME] != float("inf") else 0
 
                 row = [
                     func_name,
-                    round(stats["total_time"], 4),
-                    stats["calls"],
+                    round(stats[TOTAL_TIME], 4),
+                    stats[CALLS],
                     round(avg_time, 4),
                     round(min_time, 4),
-                    round(stats["max_time"], 4),
-                    stats["slow_calls"],
+                    round(stats[MAX_TIME], 4),
+                    stats[SLOW_CALLS],
                 ]
 
-                if stats["slow_calls"] > 0:
+                if stats[SLOW_CALLS] > 0:
                     if (
-                        stats["slow_calls"] >= stats["calls"] * 0.5
+                        stats[SLOW_CALLS] >= stats[CALLS] * 0.5
                     ):  # 50% or more calls are slow
                         row[0] = f"{RED}{row[0]}{RESET}"
                     else:
@@ -114,15 +143,15 @@ if settings.DEBUG:
             print(tabulate(table_data, headers=headers, tablefmt="grid"))
 
             slow_funcs = [
-                (name, data["slow_calls"])
+                (name, data[SLOW_CALLS])
                 for name, data in self.function_stats.items()
-                if data["slow_calls"] > 0
+                if data[SLOW_CALLS] > 0
             ]
             if slow_funcs:
                 print(f"\n{YELLOW}=== Slow Functions Summary ==={RESET}")
                 slow_funcs.sort(key=lambda x: x[1], reverse=True)
                 for name, count in slow_funcs:
-                    percentage = (count / self.function_stats[name]["calls"]) * 100
+                    percentage = (count / self.function_stats[name][CALLS]) * 100
                     color = RED if percentage >= 50 else YELLOW
                     print(
                         f"{color}{name}: {count} slow calls ({percentage:.1f}% of total calls){RESET}"
@@ -133,10 +162,11 @@ if settings.DEBUG:
             resource_table = []
             resource_headers = ["Resource", "Average", "Peak", "Current"]
 
-            if self.memory_samples:
-                avg_memory = sum(self.memory_samples) / len(self.memory_samples)
-                peak_memory = max(self.memory_samples)
-                current_memory = self.memory_samples[-1]
+            memory_samples = self.memory_samples
+            if memory_samples:
+                avg_memory = sum(memory_samples) / len(memory_samples)
+                peak_memory = max(memory_samples)
+                current_memory = memory_samples[-1]
                 resource_table.append(
                     [
                         "Memory (MB)",
@@ -146,10 +176,11 @@ if settings.DEBUG:
                     ]
                 )
 
-            if self.cpu_samples:
-                avg_cpu = sum(self.cpu_samples) / len(self.cpu_samples)
-                peak_cpu = max(self.cpu_samples)
-                current_cpu = self.cpu_samples[-1]
+            cpu_samples = self.cpu_samples
+            if cpu_samples:
+                avg_cpu = sum(cpu_samples) / len(cpu_samples)
+                peak_cpu = max(cpu_samples)
+                current_cpu = cpu_samples[-1]
                 resource_table.append(
                     [
                         "CPU (%)",
@@ -164,9 +195,30 @@ if settings.DEBUG:
     profiler = Profiler()
 
 
-def profile(func=None, *, func_name=None):
+def _record(profile_name, stage, start_time, error=None):
+    execution_time = time.perf_counter() - start_time
+    if stage is not None:
+        metrics.stage_duration.observe(execution_time, stage)
+        if error is not None:
+            metrics.stage_errors.inc(stage)
+        if tracer is not None:
+            tracer.add(stage, start_time, execution_time, error, function=profile_name)
+
+    if PROFILING_ENABLED:
+        profiler.add_execution_time(profile_name, execution_time)
+
+        if execution_time > THRESHOLD_SECONDS:
+            logger.warning(
+                f"Slow function detected: {profile_name} took {execution_time:.4f} seconds"
+            )
+
+
+def profile(func=None, *, func_name=None, stage=None):
+    """stage — этап конвейера (fetch, parse, diff, persist, publish), время которого
+    всегда попадает в гистограмму metrics, даже без DEBUG/PROFILE."""
+
     def decorator(fn):
-        if not settings.DEBUG:
+        if not PROFILING_ENABLED and stage is None:
             return fn
 
         profile_name = func_name or fn.__name__
@@ -176,17 +228,12 @@ def profile(func=None, *, func_name=None):
             @wraps(fn)
             async def async_wrapper(*args, **kwargs):
                 start_time = time.perf_counter()
-                result = await fn(*args, **kwargs)
-                end_time = time.perf_counter()
-                execution_time = end_time - start_time
-
-                profiler.add_execution_time(profile_name, execution_time)
-
-                if execution_time > THRESHOLD_SECONDS:
-                    logger.warning(
-                        f"Slow function detected: {profile_name} took {execution_time:.4f} seconds"
-                    )
-
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    _record(profile_name, stage, start_time, e)
+                    raise
+                _record(profile_name, stage, start_time)
                 return result
 
             return async_wrapper
@@ -195,17 +242,12 @@ def profile(func=None, *, func_name=None):
             @wraps(fn)
             def sync_wrapper(*args, **kwargs):
                 start_time = time.perf_counter()
-                result = fn(*args, **kwargs)
-                end_time = time.perf_counter()
-                execution_time = end_time - start_time
-
-                profiler.add_execution_time(profile_name, execution_time)
-
-                if execution_time > THRESHOLD_SECONDS:
-                    logger.warning(
-                        f"Slow function detected: {profile_name} took {execution_time:.4f} seconds"
-                    )
-
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    _record(profile_name, stage, start_time, e)
+                    raise
+                _record(profile_name, stage, start_time)
                 return result
 
             return sync_wrapper
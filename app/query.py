@@ -0,0 +1,497 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from aiohttp import web
+from loguru import logger
+from audithorium import Auditorium
+from config import settings
+from consumer import ChangeConsumer
+from database import Database
+from occupancy import DEFAULT_DURATION, OccupancyIndex, to_minutes
+from parser_types import (
+    ChangeType,
+    DayName,
+    Entity,
+    EntityType,
+    Lesson,
+    Metadata,
+    TimetableChangeData,
+    TimetableData,
+    WeekNumber,
+)
+
+EntityKey = Tuple[EntityType, int]
+
+# Параметр запроса /lessons -> значения занятия, по которым строится индекс
+INDEXED_FIELDS = {
+    "professor": lambda lesson: lesson.professors or (),
+    "group": lambda lesson: lesson.groups or (),
+    "auditorium": lambda lesson: (lesson.auditorium,) if lesson.auditorium else (),
+    "day": lambda lesson: (lesson.day_name.value,) if lesson.day_name else (),
+    "week": lambda lesson: (lesson.week_number.value,) if lesson.week_number else (),
+}
+
+EMPTY: Set[int] = set()
+
+
+def _lesson_json(lesson: Lesson) -> dict:
+    return {
+        "schedule_type": lesson.schedule_type.value if lesson.schedule_type else None,
+        "time_begin": lesson.time_begin.strftime("%H:%M")
+        if lesson.time_begin
+        else None,
+        "duration": int(lesson.duration.total_seconds() // 60)
+        if lesson.duration
+        else None,
+        "lesson_name": lesson.lesson_name,
+        "lesson_type": lesson.lesson_type.value if lesson.lesson_type else None,
+        "schedule_form": lesson.schedule_form.value if lesson.schedule_form else None,
+        "week_number": lesson.week_number.value if lesson.week_number else None,
+        "day_name": lesson.day_name.value if lesson.day_name else None,
+        "day_date": lesson.day_date.isoformat() if lesson.day_date else None,
+        "groups": lesson.groups or [],
+        "professors": lesson.professors or [],
+        "auditorium": lesson.auditorium,
+        "location": lesson.location,
+        "subgroups": lesson.subgroups.value if lesson.subgroups else "",
+    }
+
+
+def _entity_json(entity: Entity) -> dict:
+    return {"type": entity.type.value, "id": entity.id, "name": entity.name}
+
+
+def _metadata_json(metadata: Metadata) -> dict:
+    return {
+        "years": metadata.years,
+        "date": metadata.date.isoformat() if metadata.date else None,
+        "week_number": metadata.week_number.value if metadata.week_number else None,
+        "semester": metadata.semester.value if metadata.semester else None,
+    }
+
+
+class TimetableIndex:
+    """Расписания в памяти с индексами по имени сущности и полям занятий.
+
+    Каждое занятие получает целый id; индексы по преподавателю, группе,
+    аудитории, дню и неделе хранят множества id, а запрос пересекает их начиная
+    с самого маленького. Индекс обновляется по сообщениям об изменениях без
+    перезагрузки; повторное применение того же изменения ничего не меняет.
+    """
+
+    def __init__(self):
+        self.entities: Dict[EntityKey, Entity] = {}
+        self.metadata: Dict[EntityKey, Metadata] = {}
+        self.names: Dict[Tuple[EntityType, str], EntityKey] = {}
+        # id занятия -> (сущность, занятие); по сущностям — в порядке добавления
+        self.lessons: Dict[int, Tuple[EntityKey, Lesson]] = {}
+        self.entity_lessons: Dict[EntityKey, Dict[int, Lesson]] = {}
+        self.entity_types: Dict[EntityType, Set[int]] = {
+            entity_type: set() for entity_type in EntityType
+        }
+        self.indexes: Dict[str, Dict[str, Set[int]]] = {
+            field: {} for field in INDEXED_FIELDS
+        }
+        self.version = 0
+        # ETag индекса — версия с id загрузки: после перезапуска версии
+        # начинаются заново и не должны совпасть с ETag прежнего процесса
+        self.load_id = uuid.uuid4().hex[:8]
+        self.skipped = 0
+
+        self._next_lesson_id = 0
+        # Сериализованное расписание сущности и его ETag
+        self._responses: Dict[EntityKey, Tuple[bytes, str]] = {}
+
+    def load(self, timetables: Iterable[TimetableData]):
+        for timetable in timetables:
+            key = (timetable.entity.type, timetable.entity.id)
+            self._set_entity(key, timetable.entity)
+            self.metadata[key] = timetable.metadata
+            # Повторная загрузка сущности заменяет ее занятия
+            for lesson_id in list(self.entity_lessons.get(key, ())):
+                self._remove_lesson(lesson_id)
+            self.entity_lessons.setdefault(key, {})
+            for lesson in timetable.lessons:
+                self._add_lesson(key, lesson)
+            self._responses.pop(key, None)
+        self.version += 1
+
+    def apply(self, change: TimetableChangeData) -> bool:
+        """Применяет изменение к расписанию сущности. Изменения сущностей,
+        которых нет в индексе, пропускаются: сервис загружает их из MongoDB
+        (QueryService.handle_change)."""
+        key = (change.entity.type, change.entity.id)
+        if key not in self.entities:
+            self.skipped += 1
+            return False
+
+        self._set_entity(key, change.entity)
+        metadata = self.metadata[key]
+        for field_change in change.metadata_changes or []:
+            setattr(metadata, field_change.field_name, field_change.new_value)
+
+        for lesson_change in change.lesson_changes or []:
+            if lesson_change.change_type == ChangeType.LESSON_ADDED:
+                if self._find_lesson(key, lesson_change.new_lesson, exact=True) is None:
+                    self._add_lesson(key, lesson_change.new_lesson)
+            elif lesson_change.change_type == ChangeType.LESSON_REMOVED:
+                lesson_id = self._find_lesson(key, lesson_change.old_lesson)
+                if lesson_id is not None:
+                    self._remove_lesson(lesson_id)
+            elif lesson_change.change_type == ChangeType.LESSON_MODIFIED:
+                lesson_id = self._find_lesson(key, lesson_change.old_lesson)
+                if lesson_id is not None:
+                    self._remove_lesson(lesson_id)
+                if self._find_lesson(key, lesson_change.new_lesson, exact=True) is None:
+                    self._add_lesson(key, lesson_change.new_lesson)
+
+        self.version += 1
+        self._responses.pop(key, None)
+        return True
+
+    def resolve(self, entity_type: EntityType, id_or_name: str) -> Optional[EntityKey]:
+        if id_or_name.isdigit():
+            key = (entity_type, int(id_or_name))
+            return key if key in self.entities else None
+        return self.names.get((entity_type, id_or_name))
+
+    def timetable_json(self, key: EntityKey) -> bytes:
+        """Сериализованное расписание сущности; кешируется до ее изменения."""
+        return self._timetable_response(key)[0]
+
+    def timetable_etag(self, key: EntityKey) -> str:
+        """ETag расписания — хеш его содержимого, поэтому он не зависит от
+        перезапусков сервиса."""
+        return self._timetable_response(key)[1]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.load_id}-{self.version}"'
+
+    def _timetable_response(self, key: EntityKey) -> Tuple[bytes, str]:
+        response = self._responses.get(key)
+        if response is None:
+            lessons = sorted(
+                self.entity_lessons[key].values(), key=Database._lesson_order
+            )
+            body = json.dumps(
+                {
+                    "entity": _entity_json(self.entities[key]),
+                    "metadata": _metadata_json(self.metadata[key]),
+                    "lessons": [_lesson_json(lesson) for lesson in lessons],
+                },
+                ensure_ascii=False,
+            ).encode()
+            etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+            response = self._responses[key] = (body, etag)
+        return response
+
+    def query(
+        self, filters: Dict[str, str], entity_type: Optional[EntityType] = None
+    ) -> List[Tuple[EntityKey, Lesson]]:
+        sets = [
+            self.indexes[field].get(value, EMPTY) for field, value in filters.items()
+        ]
+        if entity_type is not None:
+            sets.append(self.entity_types[entity_type])
+        if not sets:
+            return []
+        sets.sort(key=len)
+        lesson_ids = sets[0].intersection(*sets[1:])
+        results = [self.lessons[lesson_id] for lesson_id in lesson_ids]
+        results.sort(key=lambda item: Database._lesson_order(item[1]))
+        return results
+
+    def _set_entity(self, key: EntityKey, entity: Entity):
+        previous = self.entities.get(key)
+        if previous is not None and not entity.name:
+            return
+        if previous is not None and previous.name != entity.name:
+            self.names.pop((previous.type, previous.name), None)
+        self.entities[key] = entity
+        if entity.name:
+            self.names[(entity.type, entity.name)] = key
+
+    def _add_lesson(self, key: EntityKey, lesson: Lesson):
+        lesson_id = self._next_lesson_id
+        self._next_lesson_id += 1
+        self.lessons[lesson_id] = (key, lesson)
+        self.entity_lessons[key][lesson_id] = lesson
+        self.entity_types[key[0]].add(lesson_id)
+        for field, values in INDEXED_FIELDS.items():
+            index = self.indexes[field]
+            for value in values(lesson):
+                index.setdefault(value, set()).add(lesson_id)
+
+    def _remove_lesson(self, lesson_id: int):
+        key, lesson = self.lessons.pop(lesson_id)
+        del self.entity_lessons[key][lesson_id]
+        self.entity_types[key[0]].discard(lesson_id)
+        for field, values in INDEXED_FIELDS.items():
+            index = self.indexes[field]
+            for value in values(lesson):
+                lesson_ids = index.get(value)
+                if lesson_ids is None:
+                    continue
+                lesson_ids.discard(lesson_id)
+                if not lesson_ids:
+                    del index[value]
+
+    def _find_lesson(
+        self, key: EntityKey, lesson: Lesson, exact: bool = False
+    ) -> Optional[int]:
+        """Ищет занятие сущности: сначала точное совпадение, затем (если не exact)
+        по ключу Auditorium.lesson_key, в который входят неделя, подгруппа и
+        аудитория, поэтому разные занятия одного времени не путаются."""
+        entity_lessons = self.entity_lessons[key]
+        for lesson_id, candidate in entity_lessons.items():
+            if candidate == lesson:
+                return lesson_id
+        if exact:
+            return None
+        lesson_key = Auditorium.lesson_key(lesson)
+        for lesson_id, candidate in entity_lessons.items():
+            if Auditorium.lesson_key(candidate) == lesson_key:
+                return lesson_id
+        return None
+
+
+class QueryService:
+    """HTTP-сервис запросов к расписаниям поверх TimetableIndex.
+
+    GET /timetables/{type}/{id или имя} — расписание сущности,
+    GET /lessons?group=...&day=...&week=...&entity_type=... — занятия по индексам,
+    GET /auditoriums/free?week=...&day=...&from=10:00&to=11:30&building=Л и
+    GET /auditoriums/{имя}/next-free?week=...&day=...&from=10:00&duration=90 —
+    поиск свободных аудиторий по OccupancyIndex.
+    Ответы несут ETag: хеш расписания сущности или версию всего индекса с id
+    загрузки, и на совпадающий If-None-Match отдается 304.
+    """
+
+    def __init__(self, index: TimetableIndex):
+        self.index = index
+        self.occupancy = OccupancyIndex()
+        self.loaded = asyncio.Event()
+        self.db: Optional[Database] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/timetables/{type}/{key}", self.handle_timetable)
+        app.router.add_get("/lessons", self.handle_lessons)
+        app.router.add_get("/auditoriums/free", self.handle_free_auditoriums)
+        app.router.add_get("/auditoriums/{name}/next-free", self.handle_next_free)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def load(self):
+        timetables = await self.db.get_timetables()
+        self.index.load(timetables)
+        self.occupancy = OccupancyIndex.from_timetables(timetables)
+        self.loaded.set()
+        logger.info(
+            f"Loaded {len(self.index.entities)} timetables "
+            f"with {len(self.index.lessons)} lessons"
+        )
+
+    async def handle_change(self, change: TimetableChangeData):
+        # Сообщения, пришедшие во время загрузки, ждут ее и применяются поверх
+        await self.loaded.wait()
+        key = (change.entity.type, change.entity.id)
+        if key in self.index.entities:
+            self.index.apply(change)
+        elif not await self._reload(change.entity):
+            return
+        if change.entity.type == EntityType.AUDITORIUM:
+            self.occupancy.set_room(
+                self.index.entities[key].name, self.index.entity_lessons[key].values()
+            )
+
+    async def _reload(self, entity: Entity) -> bool:
+        """Загружает из MongoDB сущность, которой не было при загрузке: сборщик
+        публикует только изменения, и первое изменение новой сущности приходит
+        уже после ее сохранения."""
+        timetables = await self.db.get_timetables([entity])
+        if not timetables:
+            self.index.skipped += 1
+            return False
+        self.index.load(timetables)
+        logger.info(f"Loaded new {entity.type.value} {entity.id} from MongoDB")
+        return True
+
+    async def handle_timetable(self, request: web.Request) -> web.Response:
+        try:
+            entity_type = EntityType(request.match_info["type"])
+        except ValueError:
+            raise web.HTTPNotFound()
+        key = self.index.resolve(entity_type, request.match_info["key"])
+        if key is None:
+            raise web.HTTPNotFound()
+
+        etag = self.index.timetable_etag(key)
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            body=self.index.timetable_json(key),
+            content_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    async def handle_lessons(self, request: web.Request) -> web.Response:
+        filters = {
+            field: request.query[field]
+            for field in INDEXED_FIELDS
+            if field in request.query
+        }
+        entity_type = None
+        if "entity_type" in request.query:
+            try:
+                entity_type = EntityType(request.query["entity_type"])
+            except ValueError:
+                raise web.HTTPBadRequest(text="Unknown entity_type")
+        if not filters and entity_type is None:
+            raise web.HTTPBadRequest(text="At least one filter is required")
+
+        etag = self.index.etag
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        results = self.index.query(filters, entity_type)
+        return web.json_response(
+            [
+                {
+                    "entity": _entity_json(self.index.entities[key]),
+                    **_lesson_json(lesson),
+                }
+                for key, lesson in results
+            ],
+            headers={"ETag": etag},
+            dumps=lambda data: json.dumps(data, ensure_ascii=False),
+        )
+
+    async def handle_free_auditoriums(self, request: web.Request) -> web.Response:
+        week, day = self._parse_slot(request)
+        start = self._parse_minutes(request, "from")
+        end = self._parse_minutes(request, "to")
+        if end <= start:
+            raise web.HTTPBadRequest(text="to must be later than from")
+
+        etag = self.index.etag
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        rooms = self.occupancy.free_rooms(
+            week, day, start, end, request.query.get("building")
+        )
+        return web.json_response(
+            rooms,
+            headers={"ETag": etag},
+            dumps=lambda data: json.dumps(data, ensure_ascii=False),
+        )
+
+    async def handle_next_free(self, request: web.Request) -> web.Response:
+        week, day = self._parse_slot(request)
+        start = self._parse_minutes(request, "from")
+        try:
+            duration = int(request.query.get("duration", DEFAULT_DURATION))
+        except ValueError:
+            raise web.HTTPBadRequest(text="duration must be minutes")
+
+        slot = self.occupancy.next_free(
+            request.match_info["name"], week, day, start, duration
+        )
+        if slot is None:
+            raise web.HTTPNotFound()
+        slot_week, slot_day, slot_start, slot_end = slot
+        return web.json_response(
+            {
+                "week": slot_week.value,
+                "day": slot_day.value,
+                "from": f"{slot_start // 60:02d}:{slot_start % 60:02d}",
+                "to": f"{slot_end // 60:02d}:{slot_end % 60:02d}",
+            },
+            dumps=lambda data: json.dumps(data, ensure_ascii=False),
+        )
+
+    @staticmethod
+    def _parse_slot(request: web.Request) -> Tuple[WeekNumber, DayName]:
+        try:
+            return WeekNumber(request.query["week"]), DayName(request.query["day"])
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text="week and day are required")
+
+    @staticmethod
+    def _parse_minutes(request: web.Request, name: str) -> int:
+        try:
+            return to_minutes(time.fromisoformat(request.query[name]))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text=f"{name} must be HH:MM")
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "loaded": self.loaded.is_set(),
+                "version": self.index.version,
+                "entities": len(self.index.entities),
+                "lessons": len(self.index.lessons),
+                "skipped_changes": self.index.skipped,
+            }
+        )
+
+    async def serve(self, host: str, port: int):
+        async with Database(
+            settings.MONGODB_URI, layout=settings.STORAGE_LAYOUT
+        ) as self.db:
+            await self._serve(host, port)
+
+    async def _serve(self, host: str, port: int):
+        consumer_task = None
+        if settings.RABBITMQ_EXCHANGE:
+            # Своя очередь, привязанная ко всем ключам: общую очередь изменений
+            # сервис читал бы наперегонки с остальными потребителями. Один
+            # обработчик за раз сохраняет порядок изменений сущности
+            consumer = ChangeConsumer(
+                settings.RABBITMQ_URI,
+                self.handle_change,
+                queue_name=settings.QUERY_QUEUE,
+                exchange_name=settings.RABBITMQ_EXCHANGE,
+                bindings=["#"],
+                concurrency=1,
+            )
+            consumer_task = asyncio.create_task(consumer.run())
+        else:
+            logger.warning(
+                "RABBITMQ_EXCHANGE is not set, serving the loaded timetables without updates"
+            )
+
+        await self.load()
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Serving timetable queries on http://{host}:{port}")
+        try:
+            if consumer_task is not None:
+                await consumer_task
+            else:
+                await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="In-memory timetable query service"
+    )
+    argument_parser.add_argument("--host", default=settings.QUERY_HOST)
+    argument_parser.add_argument("--port", type=int, default=settings.QUERY_PORT)
+    args = argument_parser.parse_args()
+
+    try:
+        asyncio.run(QueryService(TimetableIndex()).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logger.info("Keyboard interrupt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import random
+from typing import Awaitable, Callable, Optional, TypeVar
+from loguru import logger
+from config import settings
+from limiter import AdaptiveLimiter
+
+T = TypeVar("T")
+
+HEDGE_MIN_SAMPLES = 20
+
+
+class RetryBudget:
+    """Каждый запрос пополняет бюджет на ratio токенов, каждый повтор или
+    хеджированный запрос тратит один токен. Так повторы не превышают заданной
+    доли от общего числа запросов, даже когда сервер лежит целиком."""
+
+    def __init__(self, ratio: float, min_tokens: float = 10, max_tokens: float = 100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Retrier:
+    def __init__(
+        self,
+        retries: int,
+        base_delay: float,
+        budget: RetryBudget,
+        limiter: Optional[AdaptiveLimiter] = None,
+        hedging: bool = False,
+    ):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.budget = budget
+        self.limiter = limiter
+        self.hedging = hedging
+        self.retried = 0
+        self.hedged = 0
+
+    @staticmethod
+    def from_settings(limiter: Optional[AdaptiveLimiter] = None) -> "Retrier":
+        return Retrier(
+            retries=settings.FETCH_RETRIES,
+            base_delay=settings.FETCH_RETRY_BASE_DELAY,
+            budget=RetryBudget(settings.FETCH_RETRY_BUDGET),
+            limiter=limiter,
+            hedging=settings.FETCH_HEDGING,
+        )
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(fn)
+            except Exception as e:
+                if (
+                    attempt >= self.retries
+                    or not AdaptiveLimiter.is_congestion(e)
+                    or not self.budget.withdraw()
+                ):
+                    raise
+                attempt += 1
+                self.retried += 1
+                # Full jitter: повторы разных сущностей не должны приходить пачкой
+                delay = random.uniform(0, self.base_delay * 2**attempt)
+                logger.debug(f"Retrying fetch in {delay:.2f}s after error: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await fn()
+
+        primary = asyncio.create_task(fn())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            # fn занимает слот лимитера, поэтому дубликат считается в лимите
+            # параллельности; без свободного слота он только встал бы в очередь
+            if (
+                done
+                or self.limiter.in_flight >= self.limiter.current_limit
+                or not self.budget.withdraw()
+            ):
+                return await primary
+
+            # Первый запрос дольше наблюдаемого p95: отправляем дубликат
+            # и берем тот ответ, который придет раньше
+            self.hedged += 1
+            tasks.append(asyncio.create_task(fn()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Отмененный запрос дожидаемся, чтобы он освободил соединение и слот
+            # лимитера до следующей попытки, а его ошибка не осталась неполученной
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedging or not self.limiter:
+            return None
+        if self.limiter.sample_count < HEDGE_MIN_SAMPLES:
+            return None
+        return self.limiter.p95()
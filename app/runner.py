@@ -1,16 +1,32 @@
 import asyncio
 from profiler import profile
 from loguru import logger
+from logger import EntityLogSummary
 from database import Database
 from broker import Broker
+from outbox import build_outbox
 from config import settings
 
 from parser_types import Entity, EntityType, TimetableData
 from parser import Parser
 from audithorium import Auditorium
+from conflicts import ConflictDetector
+from lessontable import LessonTable
+from snapshot import Snapshot
 from comparer import Comparer
 from validator import Validator
-from typing import List
+from sharding import Sharding, ShardWorker
+from limiter import AdaptiveLimiter
+from retrier import Retrier
+from archive import archive
+from metrics import metrics
+from loopmonitor import loop_monitor
+from sampler import stack_sampler
+from memtrack import memory_tracker
+from tracing import batch_scope, entity_scope, tracer
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import time
 
 class Runner:
@@ -20,35 +36,206 @@ class Runner:
         logger.info("Starting process_all_entities")
         start_time = time.time()
 
-        async with (
-            Database(settings.MONGODB_URI) as db,
-            Broker(settings.RABBITMQ_URI) as broker,
-        ):
+        try:
+            async with (
+                Database(
+                    settings.MONGODB_URI,
+                    layout=settings.STORAGE_LAYOUT,
+                    history=settings.HISTORY_ENABLED,
+                ) as db,
+                Broker.from_settings() as broker,
+            ):
+                with stack_sampler.cycle(), memory_tracker.cycle():
+                    await Runner._process_cycle(db, broker)
+                await Runner._prune_history(db)
+        finally:
+            # Архив откроется заново при первой записи следующего цикла
+            if archive:
+                archive.close()
+
+        duration = time.time() - start_time
+        if tracer is not None:
+            tracer.flush()
+        metrics.cycle_duration.set(duration)
+        metrics.cycle_finished.set(time.time())
+        logger.info("Finished process_all_entities after %s seconds", duration)
+        loop_monitor.log_report()
+
+    @staticmethod
+    async def _prune_history(db: Database):
+        if not db.history or settings.HISTORY_RETENTION_DAYS <= 0:
+            return
+        before = datetime.now(timezone.utc) - timedelta(
+            days=settings.HISTORY_RETENTION_DAYS
+        )
+        deleted = await db.prune_history(before)
+        logger.info(f"Pruned {deleted} history entries older than {before}")
+
+    @staticmethod
+    async def _process_cycle(db: Database, broker: Broker):
+        if settings.SHARDS_COUNT > 1:
+            await Runner._process_shards(db, broker)
+            return
+
+        with memory_tracker.stage("fetch"):
             process_entities = Runner._get_process_entities()
             timetables = await Runner._fetch_timetables(process_entities)
 
+        if settings.CONFLICTS_REPORT:
+            with memory_tracker.stage("conflicts"):
+                Runner._report_conflicts(timetables)
+
+        with memory_tracker.stage("auditoriums"):
             timetables.extend(await Auditorium.from_timetables(timetables))
 
+        with memory_tracker.stage("load"):
+            db_timetables = await db.get_timetables()
+
+        # Шаги синхронизации замеряются отдельными этапами внутри
+        timetables = await Runner._sync_timetables(
+            db, broker, timetables, db_timetables
+        )
+
+        if settings.SNAPSHOT_PATH:
+            with memory_tracker.stage("snapshot"):
+                await Runner._write_snapshot(timetables, db_timetables)
+
+    @staticmethod
+    @profile(func_name="runner._process_shards")
+    async def _process_shards(db: Database, broker: Broker):
+        worker_id = Sharding.worker_id()
+        cycle = Sharding.current_cycle()
+        shards = Sharding.split(Runner._get_process_entities(), settings.SHARDS_COUNT)
+
+        async def process_shard(shard: int):
+            logger.info(
+                f"Worker {worker_id} processing shard {shard + 1}/{len(shards)} of cycle {cycle}"
+            )
+            entities = shards[shard]
+            with memory_tracker.stage(f"shard {shard + 1} fetch"):
+                timetables = await Runner._fetch_timetables(entities)
+                db_timetables = await db.get_timetables(entities)
+            await Runner._sync_timetables(
+                db, broker, timetables, db_timetables, stage=f"shard {shard + 1}"
+            )
+
+        async with ShardWorker(db, cycle, worker_id) as worker:
+            await worker.run(process_shard)
+
+            # Аудитории собираются из всех шардов, поэтому их строит один воркер
+            # после завершения всех шардов цикла
+            if not await worker.try_finalize():
+                return
+
+            logger.info(f"Worker {worker_id} building auditoriums of cycle {cycle}")
+            with memory_tracker.stage("finalize load"):
+                db_timetables = await db.get_timetables()
+                source_timetables = [
+                    timetable
+                    for timetable in db_timetables
+                    if timetable.entity.type != EntityType.AUDITORIUM
+                ]
+                db_auditoriums = [
+                    timetable
+                    for timetable in db_timetables
+                    if timetable.entity.type == EntityType.AUDITORIUM
+                ]
+            with memory_tracker.stage("finalize auditoriums"):
+                auditoriums = await Auditorium.from_timetables(source_timetables)
+            if settings.CONFLICTS_REPORT:
+                with memory_tracker.stage("finalize conflicts"):
+                    Runner._report_conflicts(source_timetables)
+            auditoriums = await Runner._sync_timetables(
+                db, broker, auditoriums, db_auditoriums, stage="finalize"
+            )
+            if settings.SNAPSHOT_PATH:
+                with memory_tracker.stage("finalize snapshot"):
+                    await Runner._write_snapshot(
+                        source_timetables + auditoriums, db_auditoriums
+                    )
+
+            await worker.complete_finalize()
+
+    @staticmethod
+    def _report_conflicts(timetables: List[TimetableData]):
+        conflicts = ConflictDetector.detect(LessonTable.from_timetables(timetables))
+        metrics.conflicts.set(len(conflicts))
+        ConflictDetector.log_report(conflicts)
+
+    @staticmethod
+    @profile(func_name="runner._sync_timetables")
+    async def _sync_timetables(
+        db: Database,
+        broker: Broker,
+        timetables: List[TimetableData],
+        db_timetables: List[TimetableData],
+        stage: str = "sync",
+    ) -> List[TimetableData]:
+        """Синхронизирует расписания с базой; возвращает сохраненные (прошедшие
+        проверку) расписания. stage — префикс имен этапов memory_tracker."""
+        with memory_tracker.stage(f"{stage} validate"):
             timetables = await Validator.validate_timetables(timetables)
+        logger.info(f"Found {len(timetables)} timetables")
 
-            logger.info(f"Found {len(timetables)} timetables")
-            db_timetables = await db.get_timetables()
+        with memory_tracker.stage(f"{stage} diff"):
             changes = await Runner._detect_changes(db_timetables, timetables)
-            logger.info(f"Detected {len(changes)} changes")
+        logger.info(f"Detected {len(changes)} changes")
 
-            if changes:
-                await broker.send_changes(changes)
+        outbox = None
+        if settings.PUBLISH_MODE == "outbox":
+            with memory_tracker.stage(f"{stage} outbox"):
+                outbox = build_outbox(changes)
+        elif changes:
+            with memory_tracker.stage(f"{stage} publish"):
+                with batch_scope([change.entity for change in changes]):
+                    await broker.send_changes(changes)
 
-            await Runner._add_new_timetables(db, timetables)
-            logger.info(f"Added {len(timetables)} timetables")
+        with memory_tracker.stage(f"{stage} persist"):
+            await Runner._add_new_timetables(db, timetables, db_timetables, outbox)
+        logger.info(f"Added {len(timetables)} timetables")
 
-        logger.info(
-            "Finished process_all_entities after %s seconds", time.time() - start_time
-        )
+        # История пишется только после успешного сохранения, чтобы не описывать
+        # изменения, которых нет в базе
+        if db.history:
+            with memory_tracker.stage(f"{stage} history"):
+                recorded = await db.record_history(
+                    timetables,
+                    db_timetables,
+                    datetime.now(timezone.utc),
+                    settings.HISTORY_SNAPSHOT_INTERVAL,
+                )
+            logger.info(f"Recorded {recorded} history entries")
+
+        return timetables
+
+    @staticmethod
+    @profile(func_name="runner._write_snapshot")
+    async def _write_snapshot(
+        timetables: List[TimetableData], db_timetables: List[TimetableData]
+    ):
+        """Снимок занятий в том виде, в каком они лежат в базе после цикла:
+        сохраненные расписания и прежние расписания сущностей, которые не
+        удалось загрузить."""
+        saved = {
+            (timetable.entity.type, timetable.entity.id) for timetable in timetables
+        }
+        stored = timetables + [
+            timetable
+            for timetable in db_timetables
+            if (timetable.entity.type, timetable.entity.id) not in saved
+        ]
+        try:
+            # Запись занимает секунды, поэтому не держит цикл событий
+            await asyncio.to_thread(Snapshot.from_settings().write, stored)
+        except Exception as e:
+            logger.exception(f"Failed to write snapshot: {e}")
 
     @staticmethod
     @profile(func_name="runner._get_process_entities")
     def _get_process_entities() -> List[Entity]:
+        if archive and settings.FETCH_MODE == "replay":
+            return archive.entities(settings.ARCHIVE_REPLAY_AT)
+
         entities = []
         for group_id in range(settings.START_GROUP_ID, settings.END_GROUP_ID):
             entities.append(Entity(EntityType.GROUP, group_id))
@@ -64,42 +251,115 @@ class Runner:
     @profile(func_name="runner._fetch_timetables")
     async def _fetch_timetables(entities: List[Entity]) -> List[TimetableData]:
         timetables = []
-        for entity in entities:
-            try:
-                timetable = await Parser.get_timetable(entity)
-                timetables.append(timetable)
-                logger.info(f"Got timetable for {entity.type.value} {entity.id}")
-            except Exception as e:
-                logger.warning(
-                    f"Failed to get timetable for {entity.type.value} {entity.id}: {e}. Skipping"
-                )
-            await asyncio.sleep(settings.ANTI_DDOS_FETCH_INTERVAL)
+        limiter = AdaptiveLimiter.from_settings()
+        retrier = Retrier.from_settings(limiter)
+        # Ограничивает число созданных задач; сами запросы ограничивает limiter
+        pending = asyncio.Semaphore(settings.FETCH_CONCURRENCY_MAX * 2)
+        metrics.fetch_in_flight.set_function(lambda: limiter.in_flight)
+        metrics.fetch_queue_depth.set_function(lambda: limiter.waiting)
+        metrics.fetch_concurrency_limit.set_function(lambda: limiter.current_limit)
+        entity_log = EntityLogSummary.from_settings()
+
+        async with ClientSession(
+            connector=TCPConnector(limit=settings.FETCH_CONCURRENCY_MAX),
+            timeout=ClientTimeout(total=settings.FETCH_TIMEOUT),
+        ) as session:
+            async with asyncio.TaskGroup() as task_group:
+                for entity in entities:
+                    await pending.acquire()
+                    task_group.create_task(
+                        Runner._fetch_timetable(
+                            entity,
+                            session,
+                            limiter,
+                            retrier,
+                            timetables,
+                            pending,
+                            entity_log,
+                        )
+                    )
+
+        entity_log.flush()
+
+        logger.info(
+            f"Fetched {len(timetables)} of {len(entities)} timetables, "
+            f"fetch concurrency limit {limiter.current_limit}, p95 {limiter.p95():.3f}s, "
+            f"{retrier.retried} retries, {retrier.hedged} hedged requests"
+        )
         return timetables
 
+    @staticmethod
+    async def _fetch_timetable(
+        entity: Entity,
+        session: ClientSession,
+        limiter: AdaptiveLimiter,
+        retrier: Retrier,
+        timetables: List[TimetableData],
+        pending: asyncio.Semaphore,
+        entity_log: EntityLogSummary,
+    ):
+        start_time = time.perf_counter()
+        try:
+            with entity_scope(entity):
+                timetable = await Parser.get_timetable(
+                    entity, session, limiter, retrier
+                )
+            timetables.append(timetable)
+            metrics.entities.inc(entity.type.value, "fetched")
+            entity_log.fetched(entity, timetable, time.perf_counter() - start_time)
+        except Exception as e:
+            metrics.entities.inc(entity.type.value, "failed")
+            entity_log.failed(entity, e)
+        finally:
+            pending.release()
+
     @staticmethod
     @profile(func_name="runner._detect_changes")
     async def _detect_changes(
         db_timetables: List[TimetableData], timetables: List[TimetableData]
     ) -> List:
+        db_timetables_map = {
+            (db_timetable.entity.type, db_timetable.entity.id): db_timetable
+            for db_timetable in db_timetables
+        }
+
         changes = []
-        for db_timetable in db_timetables:
-            for timetable in timetables:
-                if (
-                    db_timetable.entity.id == timetable.entity.id
-                    and db_timetable.entity.type == timetable.entity.type
-                ):
-                    changes_data = await Comparer.compare_timetables(
-                        db_timetable, timetable
-                    )
-                    if changes_data:
-                        changes.append(changes_data)
+        for timetable in timetables:
+            db_timetable = db_timetables_map.get(
+                (timetable.entity.type, timetable.entity.id)
+            )
+            if db_timetable is None:
+                continue
+            with entity_scope(timetable.entity):
+                changes_data = await Comparer.compare_timetables(
+                    db_timetable, timetable
+                )
+            if changes_data:
+                metrics.entities.inc(timetable.entity.type.value, "changed")
+                changes.append(changes_data)
         return changes
 
     @staticmethod
     @profile(func_name="runner._add_new_timetables")
-    async def _add_new_timetables(db: Database, timetables: List[TimetableData]):
+    async def _add_new_timetables(
+        db: Database,
+        timetables: List[TimetableData],
+        db_timetables: List[TimetableData],
+        outbox: Optional[Dict[Tuple[EntityType, int], List[dict]]] = None,
+    ):
+        if db.layout == "lessons":
+            with batch_scope([timetable.entity for timetable in timetables]):
+                await db.save_lessons(timetables, db_timetables, outbox)
+            return
+
+        if outbox is not None:
+            with batch_scope([timetable.entity for timetable in timetables]):
+                await db.save_timetables(timetables, outbox)
+            return
+
         for timetable in timetables:
-            if not await db.is_exist(timetable.entity.type, timetable.entity.id):
-                await db.create_timetable(timetable)
-            else:
-                await db.update_timetable(timetable)
+            with entity_scope(timetable.entity):
+                if not await db.is_exist(timetable.entity.type, timetable.entity.id):
+                    await db.create_timetable(timetable)
+                else:
+                    await db.update_timetable(timetable)
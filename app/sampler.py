@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+from loguru import logger
+from config import settings
+
+# Доля времени одного ядра, которую сэмплер может тратить на себя: если снятие
+# стеков дорожает, интервал между сэмплами растет
+OVERHEAD_BUDGET = 0.02
+MAX_DEPTH = 128
+
+
+class StackSampler:
+    """Статистический профилировщик: снимает стеки всех потоков с частотой rate Гц.
+
+    Работает в течение одного цикла, если его включили настройкой
+    SAMPLING_PROFILE или сигналом (SIGUSR2), и пишет результат в формате
+    collapsed stacks ("a;b;c count"), который открывают flamegraph.pl,
+    speedscope и https://www.speedscope.app.
+    """
+
+    def __init__(self, rate: int, output_dir: str, always: bool = False):
+        self.rate = rate
+        self.output_dir = output_dir
+        self.always = always
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+        self._armed = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}
+
+    def arm(self):
+        """Профилировать следующий цикл; безопасно вызывать из обработчика сигнала."""
+        self._armed = True
+        logger.info("Sampling profiler armed for the next cycle")
+
+    @contextmanager
+    def cycle(self):
+        if not (self.always or self._armed):
+            yield
+            return
+
+        self._armed = False
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop()
+            self.write()
+
+    def start(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def write(self) -> Optional[str]:
+        if not self.stacks:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        )
+        with open(path, "w", encoding="utf-8") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {self.samples} stack samples to {path}")
+        return path
+
+    def _run(self):
+        interval = 1 / self.rate
+        own_id = threading.get_ident()
+        thread_names = {}
+
+        while not self._stopped.wait(interval):
+            start_time = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = thread_names.get(thread_id)
+                if thread_name is None:
+                    thread_name = self._thread_name(thread_id)
+                    thread_names[thread_id] = thread_name
+                self.stacks[self._collapse(thread_name, frame)] += 1
+            self.samples += 1
+
+            cost = time.perf_counter() - start_time
+            interval = max(1 / self.rate, cost / OVERHEAD_BUDGET)
+
+    def _collapse(self, thread_name: str, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._label(code)
+                self._labels[code] = label
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(thread_name)
+        labels.reverse()
+        return ";".join(labels)
+
+    @staticmethod
+    def _label(code) -> str:
+        path = code.co_filename.replace(os.sep, "/").split("/")
+        filename = "/".join(path[-2:])
+        return f"{code.co_qualname} ({filename}:{code.co_firstlineno})".replace(
+            ";", ":"
+        )
+
+    @staticmethod
+    def _thread_name(thread_id: int) -> str:
+        for thread in threading.enumerate():
+            if thread.ident == thread_id:
+                return thread.name.replace(";", ":")
+        return f"thread-{thread_id}"
+
+
+stack_sampler = StackSampler(
+    rate=settings.SAMPLING_RATE,
+    output_dir=settings.SAMPLING_PROFILE_DIR,
+    always=settings.SAMPLING_PROFILE,
+)
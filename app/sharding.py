@@ -0,0 +1,138 @@
+import asyncio
+import os
+import socket
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Set
+from loguru import logger
+from config import settings
+from database import Database
+from parser_types import Entity
+from profiler import profile
+
+FINALIZE_SHARD = -1
+
+
+class Sharding:
+    @staticmethod
+    def shard_of(entity: Entity, shards_count: int) -> int:
+        # crc32 вместо hash(): номер шарда должен совпадать во всех процессах
+        return zlib.crc32(f"{entity.type.value}:{entity.id}".encode()) % shards_count
+
+    @staticmethod
+    @profile(func_name="sharding.split")
+    def split(entities: List[Entity], shards_count: int) -> List[List[Entity]]:
+        shards = [[] for _ in range(shards_count)]
+        for entity in entities:
+            shards[Sharding.shard_of(entity, shards_count)].append(entity)
+        return shards
+
+    @staticmethod
+    def current_cycle() -> int:
+        return int(time.time() // settings.ENTITIES_FETCH_INTERVAL)
+
+    @staticmethod
+    def cycle_end(cycle: int) -> datetime:
+        return datetime.fromtimestamp(
+            (cycle + 1) * settings.ENTITIES_FETCH_INTERVAL, timezone.utc
+        )
+
+    @staticmethod
+    def until_next_cycle() -> float:
+        """Секунды до начала следующего цикла. Реплики спят до общей границы, а
+        не полный интервал после своего цикла: иначе из-за разной длины циклов
+        они расходятся по разным номерам циклов и обходят все шарды каждая."""
+        interval = settings.ENTITIES_FETCH_INTERVAL
+        return interval - time.time() % interval
+
+    @staticmethod
+    def worker_id() -> str:
+        return settings.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardWorker:
+    def __init__(self, db: Database, cycle: int, worker_id: str):
+        self.db = db
+        self.cycle = cycle
+        self.worker_id = worker_id
+        self.shards_count = settings.SHARDS_COUNT
+        self.ttl = settings.SHARD_LEASE_TTL
+        self.held: Set[int] = set()
+        self._heartbeat_task = None
+
+    async def __aenter__(self):
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+    def shard_order(self) -> List[int]:
+        # Каждый воркер начинает со "своего" шарда, чтобы реже конфликтовать за лизы
+        offset = zlib.crc32(self.worker_id.encode()) % self.shards_count
+        return [(offset + i) % self.shards_count for i in range(self.shards_count)]
+
+    @profile(func_name="sharding.run")
+    async def run(self, process_shard: Callable[[int], Awaitable[None]]):
+        while True:
+            completed = set(await self.db.get_completed_shards(self.cycle))
+            pending = [shard for shard in self.shard_order() if shard not in completed]
+            if not pending:
+                return
+
+            acquired = False
+            for shard in pending:
+                if not await self._acquire(shard):
+                    continue
+                acquired = True
+                try:
+                    await process_shard(shard)
+                    await self.db.complete_shard_lease(
+                        self.cycle, shard, self.worker_id
+                    )
+                finally:
+                    self.held.discard(shard)
+
+            if not acquired:
+                # Оставшиеся шарды заняты другими воркерами: ждем их завершения
+                # либо истечения лиза, если воркер умер
+                logger.info(
+                    f"Waiting for {len(pending)} shards of cycle {self.cycle} held by other workers"
+                )
+                await asyncio.sleep(max(1, self.ttl // 3))
+
+    async def try_finalize(self) -> bool:
+        return await self._acquire(FINALIZE_SHARD)
+
+    async def complete_finalize(self):
+        await self.db.complete_shard_lease(self.cycle, FINALIZE_SHARD, self.worker_id)
+        self.held.discard(FINALIZE_SHARD)
+
+    async def _acquire(self, shard: int) -> bool:
+        if not await self.db.acquire_shard_lease(
+            self.cycle,
+            shard,
+            self.worker_id,
+            self.ttl,
+            Sharding.cycle_end(self.cycle + 1),
+        ):
+            return False
+        self.held.add(shard)
+        return True
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(max(1, self.ttl // 3))
+            try:
+                await self.db.renew_shard_leases(
+                    self.cycle, list(self.held), self.worker_id, self.ttl
+                )
+            except Exception as e:
+                logger.warning(f"Failed to renew shard leases: {e}")
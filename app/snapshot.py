@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Type
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from loguru import logger
+from config import settings
+from lessontable import ENUM_COLUMNS, Dictionary
+from parser_types import EntityType, TimetableData
+
+ENUM_TYPE = pa.dictionary(pa.int8(), pa.string())
+STRING_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMA = pa.schema(
+    [
+        ("entity_type", ENUM_TYPE),
+        ("entity_id", pa.int32()),
+        ("entity_name", STRING_TYPE),
+        *((name, ENUM_TYPE) for name in ENUM_COLUMNS),
+        ("day_date", pa.date32()),
+        ("time_begin", pa.time32("s")),
+        ("duration", pa.int16()),  # минуты
+        ("lesson_name", STRING_TYPE),
+        ("auditorium", STRING_TYPE),
+        ("location", STRING_TYPE),
+        ("groups", pa.list_(STRING_TYPE)),
+        ("professors", pa.list_(STRING_TYPE)),
+    ]
+)
+STRING_FIELDS = ("entity_name", "lesson_name", "auditorium", "location")
+LIST_FIELDS = ("groups", "professors")
+
+
+def _enum_dictionary(enum_type: Type[Enum]) -> pa.Array:
+    # Коды совпадают с ENUM_CODES колоночной таблицы занятий
+    return pa.array([member.value for member in enum_type], pa.string())
+
+
+def _encode(dictionary: Dictionary, value: Optional[str]) -> Optional[int]:
+    # В Arrow отсутствующее значение — null, а не код NONE
+    return None if value is None else dictionary.encode(value)
+
+
+class Snapshot:
+    """Колоночный снимок всех занятий для аналитики.
+
+    Файл — Arrow IPC (Feather v2): строка на занятие, перечисления и строки
+    словарно закодированы. Занятия пишутся пачками по batch_rows строк, а
+    словари растут дельтами, поэтому в памяти держится одна пачка и словари
+    имен. Снимок пишется во временный файл и атомарно подменяет прежний, так
+    что читатели никогда не видят недописанный файл. Читать его лучше через
+    Snapshot.read (или pyarrow.memory_map): без сжатия колонки отображаются
+    из файла без копирования, со сжатием распаковываются по мере чтения.
+    """
+
+    def __init__(self, path: str, compression: str = "zstd", batch_rows: int = 65536):
+        self.path = path
+        self.compression = None if compression in ("", "none") else compression
+        self.batch_rows = batch_rows
+
+    @staticmethod
+    def from_settings() -> "Snapshot":
+        return Snapshot(
+            settings.SNAPSHOT_PATH,
+            compression=settings.SNAPSHOT_COMPRESSION,
+            batch_rows=settings.SNAPSHOT_BATCH_ROWS,
+        )
+
+    def write(self, timetables: Iterable[TimetableData]) -> int:
+        """Пишет снимок занятий timetables; возвращает число строк."""
+        start_time = time.perf_counter()
+        enums = {
+            "entity_type": _enum_dictionary(EntityType),
+            **{
+                name: _enum_dictionary(enum_type)
+                for name, enum_type in ENUM_COLUMNS.items()
+            },
+        }
+        enum_codes = {
+            name: {member.value: code for code, member in enumerate(enum_type)}
+            for name, enum_type in (("entity_type", EntityType), *ENUM_COLUMNS.items())
+        }
+        # Пустой словарь в первой пачке Arrow считает не началом дельт, а
+        # словарем, который потом заменяется, поэтому в каждом есть ""
+        dictionaries = {
+            name: Dictionary([""]) for name in (*STRING_FIELDS, *LIST_FIELDS)
+        }
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        options = ipc.IpcWriteOptions(
+            compression=self.compression, emit_dictionary_deltas=True
+        )
+        schema = SCHEMA.with_metadata(
+            {"created_at": datetime.now(timezone.utc).isoformat()}
+        )
+
+        rows = 0
+        with ipc.new_file(temporary_path, schema, options=options) as writer:
+            batch = self._empty_batch()
+            for timetable in timetables:
+                entity = timetable.entity
+                entity_type = enum_codes["entity_type"][entity.type.value]
+                entity_name = _encode(dictionaries["entity_name"], entity.name)
+                for lesson in timetable.lessons:
+                    batch["entity_type"].append(entity_type)
+                    batch["entity_id"].append(entity.id)
+                    batch["entity_name"].append(entity_name)
+                    for name in ENUM_COLUMNS:
+                        value = getattr(lesson, name)
+                        batch[name].append(
+                            None if value is None else enum_codes[name][value.value]
+                        )
+                    batch["day_date"].append(lesson.day_date)
+                    batch["time_begin"].append(lesson.time_begin)
+                    batch["duration"].append(
+                        int(lesson.duration.total_seconds() // 60)
+                        if lesson.duration
+                        else None
+                    )
+                    for name in ("lesson_name", "auditorium", "location"):
+                        batch[name].append(
+                            _encode(dictionaries[name], getattr(lesson, name))
+                        )
+                    for name in LIST_FIELDS:
+                        values = getattr(lesson, name)
+                        batch[name].append(
+                            None
+                            if values is None
+                            else [dictionaries[name].encode(value) for value in values]
+                        )
+                    rows += 1
+                    if len(batch["entity_id"]) >= self.batch_rows:
+                        writer.write_batch(
+                            self._to_record_batch(batch, enums, dictionaries)
+                        )
+                        batch = self._empty_batch()
+            if batch["entity_id"]:
+                writer.write_batch(self._to_record_batch(batch, enums, dictionaries))
+        os.replace(temporary_path, self.path)
+
+        logger.info(
+            f"Wrote snapshot {self.path}: {rows} lessons, "
+            f"{os.path.getsize(self.path) / 1024 / 1024:.1f} MB "
+            f"in {time.perf_counter() - start_time:.2f}s"
+        )
+        return rows
+
+    @staticmethod
+    def read(path: str) -> pa.Table:
+        """Снимок, отображенный в память."""
+        return ipc.open_file(pa.memory_map(path)).read_all()
+
+    @staticmethod
+    def _empty_batch() -> Dict[str, list]:
+        return {field.name: [] for field in SCHEMA}
+
+    @staticmethod
+    def _to_record_batch(
+        batch: Dict[str, list],
+        enums: Dict[str, pa.Array],
+        dictionaries: Dict[str, Dictionary],
+    ) -> pa.RecordBatch:
+        # Словарь пачки — все значения на текущий момент: writer отправляет только
+        # дописанный хвост как дельту
+        columns: List[pa.Array] = []
+        for field in SCHEMA:
+            values = batch[field.name]
+            if field.name in enums:
+                columns.append(
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(values, pa.int8()), enums[field.name]
+                    )
+                )
+            elif field.name in STRING_FIELDS:
+                columns.append(
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(values, pa.int32()),
+                        pa.array(dictionaries[field.name].values, pa.string()),
+                    )
+                )
+            elif field.name in LIST_FIELDS:
+                codes = pa.array(values, pa.list_(pa.int32()))
+                columns.append(
+                    pa.ListArray.from_arrays(
+                        codes.offsets,
+                        pa.DictionaryArray.from_arrays(
+                            codes.values,
+                            pa.array(dictionaries[field.name].values, pa.string()),
+                        ),
+                        mask=codes.is_null(),
+                    )
+                )
+            else:
+                columns.append(pa.array(values, field.type))
+        return pa.RecordBatch.from_arrays(columns, schema=SCHEMA)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 app/snapshot.py <snapshot.arrow>")
+        sys.exit(1)
+    table = Snapshot.read(sys.argv[1])
+    print(table.schema)
+    print(
+        f"{table.num_rows} lessons, created at {table.schema.metadata[b'created_at'].decode()}"
+    )
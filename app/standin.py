@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Tuple
+from aiohttp import web
+from loguru import logger
+from parser_types import Entity, EntityType
+from synthetic import Synthetic
+
+PAGE_CACHE_SIZE = 4096
+
+MOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock")
+
+MOCK_PAGES = {
+    (EntityType.GROUP, 1): "Расписание БПИ23-01.html",
+    (EntityType.PROFESSOR, 1): "Расписание Алиева Д. П..html",
+    (EntityType.PROFESSOR, 2): "Расписание Ситников М. Н..html",
+}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """fixed:0.1, uniform:0.05:0.5, exponential:0.2 или lognormal:-1.6:0.5 (секунды)."""
+    kind, *params = spec.split(":")
+    values = [float(param) for param in params]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class Standin:
+    """Заменитель timetable.pallada.sibsau.ru для нагрузочных тестов без сети.
+
+    Отдает страницы из app/mock и синтетические страницы для любых id, с
+    настраиваемыми задержками, долей ошибок 5xx, зависших запросов и "мертвых" id.
+    """
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        empty_rate: float = 0.0,
+        change_interval: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.empty_rate = empty_rate
+        self.change_interval = change_interval
+        self.rng = random.Random(seed)
+        self.started_at = time.time()
+
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+        # Отрисованные страницы по (тип, id, ревизия), вытесняются давно не
+        # запрошенные
+        self._pages: OrderedDict[Tuple[EntityType, int, int], str] = OrderedDict()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/timetable/{type}/{id:\\d+}", self.handle_timetable)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    def revision(self) -> int:
+        if self.change_interval <= 0:
+            return 0
+        return int((time.time() - self.started_at) // self.change_interval)
+
+    async def handle_timetable(self, request: web.Request) -> web.Response:
+        try:
+            entity_type = EntityType(request.match_info["type"])
+        except ValueError:
+            raise web.HTTPNotFound()
+        entity = Entity(entity_type, int(request.match_info["id"]))
+
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency(self.rng))
+
+            roll = self.rng.random()
+            if roll < self.timeout_rate:
+                # Зависшее соединение: клиент должен уйти по собственному таймауту
+                await asyncio.sleep(3600)
+            if roll < self.timeout_rate + self.error_rate:
+                self.errors += 1
+                return web.Response(status=503, text="Service Unavailable")
+
+            html = self.page(entity.type, entity.id, self.revision())
+            return web.Response(text=html, content_type="text/html")
+        finally:
+            self.in_flight -= 1
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "revision": self.revision(),
+            }
+        )
+
+    def page(self, entity_type: EntityType, entity_id: int, revision: int) -> str:
+        key = (entity_type, entity_id, revision)
+        html = self._pages.get(key)
+        if html is None:
+            html = self._pages[key] = self._render(entity_type, entity_id, revision)
+            if len(self._pages) > PAGE_CACHE_SIZE:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(key)
+        return html
+
+    def _render(self, entity_type: EntityType, entity_id: int, revision: int) -> str:
+        mock_page = MOCK_PAGES.get((entity_type, entity_id))
+        if mock_page:
+            with open(os.path.join(MOCK_DIR, mock_page), encoding="utf-8") as page:
+                return page.read()
+
+        key = zlib.crc32(f"{entity_type.value}:{entity_id}".encode()) % 1000
+        if key < self.empty_rate * 1000:
+            return Synthetic.render_empty_html()
+
+        timetable = Synthetic.timetable(Entity(entity_type, entity_id), revision)
+        return Synthetic.render_html(timetable)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Local stand-in for timetable.pallada.sibsau.ru"
+    )
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8081)
+    argument_parser.add_argument("--latency", default="fixed:0")
+    argument_parser.add_argument("--error-rate", type=float, default=0.0)
+    argument_parser.add_argument("--timeout-rate", type=float, default=0.0)
+    argument_parser.add_argument("--empty-rate", type=float, default=0.0)
+    argument_parser.add_argument("--change-interval", type=float, default=0.0)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args()
+
+    standin = Standin(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        empty_rate=args.empty_rate,
+        change_interval=args.change_interval,
+        seed=args.seed,
+    )
+    logger.info(f"Serving timetable stand-in on http://{args.host}:{args.port}")
+    web.run_app(standin.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import random
+import zlib
+from datetime import date, time, timedelta
+from html import escape
+from typing import List
+from parser_types import (
+    DayName,
+    Entity,
+    EntityType,
+    Lesson,
+    LessonType,
+    Metadata,
+    ScheduleType,
+    Semester,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+)
+
+SLOTS = [
+    time(8, 0),
+    time(9, 40),
+    time(11, 30),
+    time(13, 30),
+    time(15, 10),
+    time(16, 50),
+    time(18, 30),
+]
+
+DISCIPLINES = [
+    "Математический анализ",
+    "Линейная алгебра",
+    "Дискретная математика",
+    "Физика",
+    "Теория информации",
+    "Вычислительная математика",
+    "Методы оптимизации",
+    "Базы данных",
+    "Операционные системы",
+    "Компьютерные сети",
+    "Объектно-ориентированное программирование",
+    "Математическая логика и теория алгоритмов",
+    "Моделирование информационных процессов",
+    "Иностранный язык",
+    "История россии",
+    "Философия",
+    "Экономика",
+    "Физическая культура",
+]
+
+SURNAMES = [
+    "Иванов",
+    "Петров",
+    "Сидоров",
+    "Кузнецов",
+    "Смирнов",
+    "Попов",
+    "Волков",
+    "Соколов",
+    "Лебедев",
+    "Козлов",
+    "Новиков",
+    "Морозов",
+    "Орлов",
+    "Зайцев",
+    "Павлов",
+    "Семенов",
+]
+
+INITIALS = "АБВГДЕИКЛМНОПРСТ"
+
+GROUP_PREFIXES = ["БПИ", "БИД", "БИЭ", "БМТ", "БАП", "БЭК", "БЮР", "БЛА"]
+
+BUILDINGS = {
+    "Л": "пр. имени газеты  Красноярский рабочий, 31, строение 7",
+    "Н": "пр. им. газеты Красноярский рабочий, 31, стр. 5",
+    "А": "пр. им. газеты Красноярский рабочий, 31",
+    "П": "ул. Мичурина, 2",
+    "Б": "ул. Ломоносова, 9",
+}
+
+LESSON_TYPES = [LessonType.LECTURE, LessonType.PRACTICE, LessonType.LABORATORY]
+
+
+class Synthetic:
+    """Детерминированный генератор расписаний для нагрузочных тестов и бенчмарков.
+
+    Одна и та же пара (сущность, ревизия) всегда дает одно и то же расписание,
+    а каждая следующая ревизия переносит часть занятий в другие аудитории.
+    """
+
+    @staticmethod
+    def group_name(group_id: int) -> str:
+        prefix = GROUP_PREFIXES[group_id % len(GROUP_PREFIXES)]
+        return f"{prefix}{20 + group_id % 6}-{group_id // 48 % 100:02d}"
+
+    @staticmethod
+    def professor_name(professor_id: int) -> str:
+        surname = SURNAMES[professor_id % len(SURNAMES)]
+        first = INITIALS[professor_id // len(SURNAMES) % len(INITIALS)]
+        second = INITIALS[professor_id // 256 % len(INITIALS)]
+        suffix = "а" if professor_id % 3 == 0 else ""
+        return f"{surname}{suffix} {first}. {second}."
+
+    @staticmethod
+    def auditorium(rng: random.Random) -> str:
+        building = rng.choice(list(BUILDINGS))
+        return f"{building}-{rng.randint(1, 8)}{rng.randint(0, 2)}{rng.randint(1, 9)}"
+
+    @staticmethod
+    def timetable(entity: Entity, revision: int = 0) -> TimetableData:
+        rng = random.Random(zlib.crc32(f"{entity.type.value}:{entity.id}".encode()))
+        if entity.type == EntityType.PROFESSOR:
+            name = Synthetic.professor_name(entity.id)
+        else:
+            name = Synthetic.group_name(entity.id)
+
+        lessons = []
+        for week_number in WeekNumber:
+            for day_name in DayName:
+                if day_name == DayName.SATURDAY and rng.random() < 0.7:
+                    continue
+                for slot in sorted(rng.sample(SLOTS, rng.randint(1, 4))):
+                    lessons.extend(
+                        Synthetic._lessons(rng, entity, week_number, day_name, slot)
+                    )
+
+        # Ревизии детерминированно переносят около 5% занятий в другие аудитории
+        for step in range(1, revision + 1):
+            revision_rng = random.Random(
+                zlib.crc32(f"{entity.type.value}:{entity.id}:{step}".encode())
+            )
+            for lesson in lessons:
+                if revision_rng.random() < 0.05:
+                    lesson.auditorium = Synthetic.auditorium(revision_rng)
+                    lesson.location = BUILDINGS[lesson.auditorium.split("-")[0]]
+
+        return TimetableData(
+            entity=Entity(type=entity.type, id=entity.id, name=name),
+            metadata=Metadata(
+                years="2024-2025",
+                date=date(2025, 3, 26),
+                week_number=WeekNumber.EVEN,
+                # Страницы преподавателей не содержат семестра, его подставляет Validator
+                semester=None
+                if entity.type == EntityType.PROFESSOR
+                else Semester.SECOND,
+            ),
+            lessons=lessons,
+        )
+
+    @staticmethod
+    def timetables(
+        groups_count: int, professors_count: int, revision: int = 0
+    ) -> List[TimetableData]:
+        timetables = []
+        for group_id in range(1, groups_count + 1):
+            timetables.append(
+                Synthetic.timetable(Entity(EntityType.GROUP, group_id), revision)
+            )
+        for professor_id in range(1, professors_count + 1):
+            timetables.append(
+                Synthetic.timetable(
+                    Entity(EntityType.PROFESSOR, professor_id), revision
+                )
+            )
+        return timetables
+
+    @staticmethod
+    def _lessons(
+        rng: random.Random,
+        entity: Entity,
+        week_number: WeekNumber,
+        day_name: DayName,
+        slot: time,
+    ) -> List[Lesson]:
+        lesson_type = rng.choice(LESSON_TYPES)
+        subgroups = [Subgroup.COMMON]
+        if lesson_type == LessonType.LABORATORY and rng.random() < 0.5:
+            subgroups = [Subgroup.FIRST, Subgroup.SECOND]
+
+        lessons = []
+        for subgroup in subgroups:
+            auditorium = Synthetic.auditorium(rng)
+            if entity.type == EntityType.PROFESSOR:
+                professors = []
+                groups = [Synthetic.group_name(rng.randint(1, 2000))]
+            else:
+                professors = [Synthetic.professor_name(rng.randint(1, 2000))]
+                groups = []
+            lessons.append(
+                Lesson(
+                    schedule_type=ScheduleType.REGULAR,
+                    time_begin=slot,
+                    lesson_name=rng.choice(DISCIPLINES),
+                    week_number=week_number,
+                    day_name=day_name,
+                    duration=timedelta(minutes=90),
+                    lesson_type=lesson_type,
+                    groups=groups,
+                    professors=professors,
+                    auditorium=auditorium,
+                    location=BUILDINGS[auditorium.split("-")[0]],
+                    subgroups=subgroup,
+                )
+            )
+        return lessons
+
+    @staticmethod
+    def render_html(timetable: TimetableData) -> str:
+        """Разметка в формате timetable.pallada.sibsau.ru, которую понимает Parser."""
+        entity = timetable.entity
+        metadata = timetable.metadata
+        if entity.type == EntityType.PROFESSOR:
+            title = f"{escape(entity.name)} - {metadata.years.replace('-', '/')}"
+        else:
+            title = (
+                f"&quot;{escape(entity.name)}&quot;<br/>"
+                f"{metadata.semester.value} {metadata.years}г."
+            )
+
+        parts = [
+            f"<html><head><title>Расписание {escape(entity.name)}</title></head><body>",
+            f'<h3 class="text-center bold">{title}</h3>',
+            f'<h4 class="text-center bold">{metadata.date.strftime("%d.%m.%Y")}'
+            f" - {metadata.week_number.value}</h4>",
+            '<div id="timetable_tab" class="tab-pane fade in active" role="tabpanel">',
+        ]
+        for week_index, week_number in enumerate(WeekNumber, start=1):
+            parts.append(
+                f'<div role="tabpanel" id="week_{week_index}_tab" class="tab-pane fade">'
+            )
+            for day_name in DayName:
+                day_lessons = [
+                    lesson
+                    for lesson in timetable.lessons
+                    if lesson.week_number == week_number and lesson.day_name == day_name
+                ]
+                if not day_lessons:
+                    continue
+                parts.append(
+                    f'<div class="day {day_name.name.lower()}"><div class="header">'
+                    f'<div class="name text-center"><div>{day_name.value}</div></div>'
+                    '</div><div class="body">'
+                )
+                slots = {}
+                for lesson in day_lessons:
+                    slots.setdefault((lesson.time_begin, lesson.duration), []).append(
+                        lesson
+                    )
+                for (time_begin, duration), slot_lessons in sorted(
+                    slots.items(), key=lambda item: item[0][0]
+                ):
+                    parts.append(
+                        Synthetic._render_line(time_begin, duration, slot_lessons)
+                    )
+                parts.append("</div></div>")
+            parts.append("</div>")
+        parts.append("</div>")
+        parts.append(
+            '<div class="tab-pane fade" role="tabpanel" id="session_tab">'
+            '<div class="empty_info_msg"><h3>Расписание сессии временно отсутствует'
+            "</h3></div></div>"
+        )
+        parts.append("</body></html>")
+        return "".join(parts)
+
+    @staticmethod
+    def render_empty_html() -> str:
+        return "<html><head><title>Расписание</title></head><body></body></html>"
+
+    @staticmethod
+    def _render_line(
+        time_begin: time, duration: timedelta, lessons: List[Lesson]
+    ) -> str:
+        time_end = (time_begin.hour * 60 + time_begin.minute) + int(
+            (duration or timedelta()).total_seconds() // 60
+        )
+        time_text = (
+            f"{time_begin.strftime('%H:%M')}-{time_end // 60:02d}:{time_end % 60:02d}"
+        )
+        column_class = "col-md-12" if len(lessons) == 1 else "col-md-6.0"
+
+        columns = []
+        for lesson in lessons:
+            items = []
+            if len(lessons) > 1 and lesson.subgroups != Subgroup.COMMON:
+                items.append(
+                    f'<li class="bold num_pdgrp">{lesson.subgroups.value}</li>'
+                )
+            lesson_type = f" ({lesson.lesson_type.value})" if lesson.lesson_type else ""
+            items.append(
+                '<li><i class="fa fa-bookmark"></i>'
+                f"<span class='name'>{escape(lesson.lesson_name.upper())}</span>"
+                f"{lesson_type}<br/></li>"
+            )
+            for professor in lesson.professors or []:
+                items.append(
+                    '<li><i class="fa fa-user"></i>'
+                    f'<a href="#">{escape(professor)}</a><br/></li>'
+                )
+            for group in lesson.groups or []:
+                items.append(
+                    '<li><i class="fa fa-group"></i>'
+                    f'<a href="#">{escape(group)}</a><br/></li>'
+                )
+            if lesson.auditorium:
+                building, room = lesson.auditorium.split("-", 1)
+                items.append(
+                    '<li><i class="fa fa-compass"></i>'
+                    f'<a href="#" title="{escape(lesson.location or "")}">'
+                    f"корп. &quot;{escape(building)}&quot; "
+                    f"каб. &quot;{escape(room)}&quot;</a></li>"
+                )
+            if len(lessons) == 1 and lesson.subgroups != Subgroup.COMMON:
+                items.append(
+                    f'<li><i class="fa fa-paperclip"></i>{lesson.subgroups.value}</li>'
+                )
+            columns.append(
+                f'<div class="{column_class}"><ul class="list-unstyled">'
+                f"{''.join(items)}</ul></div>"
+            )
+
+        return (
+            '<div class="line"><div class="time text-center">'
+            f'<div class="hidden-xs">{time_text}</div></div>'
+            f'<div class="discipline"><div class="row">{"".join(columns)}'
+            "</div></div></div>"
+        )
@@ -0,0 +1,136 @@
+import atexit
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from config import settings
+from parser_types import Entity, EntityType
+
+# Сущность, которую обрабатывает текущая задача; спаны этапов привязываются к ней
+current_entity: ContextVar[Optional[Entity]] = ContextVar(
+    "current_entity", default=None
+)
+
+# Сущности пачки, которую пишет или публикует текущая задача одним вызовом;
+# спаны вне entity_scope помечаются их id
+current_batch: ContextVar[Optional[List[Entity]]] = ContextVar(
+    "current_batch", default=None
+)
+
+# pid 0 — спаны уровня цикла, остальные — по одному "процессу" на тип сущности,
+# чтобы в просмотрщике каждая сущность была отдельной дорожкой (tid = id)
+PIPELINE_PID = 0
+ENTITY_PIDS = {entity_type: index for index, entity_type in enumerate(EntityType, 1)}
+
+# Сколько id сущностей пачки пишется в спан: пачка цикла — до десятков тысяч
+# сущностей, и полный список раздувал бы каждый спан
+BATCH_SAMPLE_SIZE = 20
+
+
+@contextmanager
+def entity_scope(entity: Entity):
+    token = current_entity.set(entity)
+    try:
+        yield
+    finally:
+        current_entity.reset(token)
+
+
+@contextmanager
+def batch_scope(entities: List[Entity]):
+    token = current_batch.set(entities)
+    try:
+        yield
+    finally:
+        current_batch.reset(token)
+
+
+class SpanTracer:
+    """Пишет спаны этапов в файл в формате Chrome Trace Event.
+
+    Файл открывается в chrome://tracing, Perfetto или speedscope. События
+    дописываются по одному: формат допускает незакрытый JSON-массив, поэтому
+    файл читается и после аварийного завершения процесса.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[\n")
+        self._write_metadata(PIPELINE_PID, "pipeline")
+        for entity_type, pid in ENTITY_PIDS.items():
+            self._write_metadata(pid, entity_type.value)
+        atexit.register(self.close)
+
+    def add(
+        self,
+        name: str,
+        start_time: float,
+        duration: float,
+        error: Optional[BaseException] = None,
+        **args,
+    ):
+        """start_time и duration в секундах по time.perf_counter()."""
+        entity = current_entity.get()
+        if entity is not None:
+            pid, tid = ENTITY_PIDS[entity.type], entity.id
+        else:
+            pid, tid = PIPELINE_PID, 0
+            batch = current_batch.get()
+            if batch is not None:
+                args["entities_count"] = len(batch)
+                args["entities"] = [
+                    f"{item.type.value}:{item.id}" for item in batch[:BATCH_SAMPLE_SIZE]
+                ]
+        if error is not None:
+            args["error"] = type(error).__name__
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start_time * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self._write(event)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        start_time = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.add(name, start_time, time.perf_counter() - start_time, error, **args)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def _write_metadata(self, pid: int, name: str):
+        self._write(
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+        )
+
+    def _write(self, event: dict):
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(event, ensure_ascii=False))
+        self._file.write(",\n")
+
+
+tracer = SpanTracer(settings.TRACE_SPANS_PATH) if settings.TRACE_SPANS_PATH else None
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import archive as archive_module  # noqa: E402
+import parser as parser_module  # noqa: E402
+from aiohttp import ClientResponseError  # noqa: E402
+from archive import Archive  # noqa: E402
+from config import settings  # noqa: E402
+from limiter import AdaptiveLimiter  # noqa: E402
+from parser import Parser  # noqa: E402
+from parser_types import Entity, EntityType  # noqa: E402
+
+GROUP = Entity(EntityType.GROUP, 1)
+PROFESSOR = Entity(EntityType.PROFESSOR, 2)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=100.0)
+    monkeypatch.setattr(archive_module, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def test_record_and_read_round_trip(tmp_path, clock):
+    archive = Archive(str(tmp_path))
+    asyncio.run(archive.record(GROUP, 200, "<html>группа</html>"))
+    asyncio.run(archive.record(PROFESSOR, 503, "Service Unavailable"))
+    archive.close()
+
+    # Новый экземпляр читает индекс с диска
+    replay = Archive(str(tmp_path))
+    record = replay.find(EntityType.GROUP, 1)
+    assert record.status == 200
+    assert replay.read(record) == "<html>группа</html>"
+    record = replay.find(EntityType.PROFESSOR, 2)
+    assert record.status == 503
+    assert replay.read(record) == "Service Unavailable"
+    assert replay.find(EntityType.GROUP, 2) is None
+    assert {(e.type, e.id) for e in replay.entities()} == {
+        (EntityType.GROUP, 1),
+        (EntityType.PROFESSOR, 2),
+    }
+
+
+def test_find_at_moment(tmp_path, clock):
+    archive = Archive(str(tmp_path))
+    asyncio.run(archive.record(GROUP, 200, "first"))
+    clock.value = 200.0
+    asyncio.run(archive.record(GROUP, 200, "second"))
+    archive.close()
+
+    replay = Archive(str(tmp_path))
+    assert replay.read(replay.find(EntityType.GROUP, 1)) == "second"
+    assert replay.read(replay.find(EntityType.GROUP, 1, at=150.0)) == "first"
+    assert replay.find(EntityType.GROUP, 1, at=50.0) is None
+    assert replay.entities(at=50.0) == []
+
+
+def test_append_after_close(tmp_path, clock):
+    archive = Archive(str(tmp_path))
+    assert archive.find(EntityType.GROUP, 1) is None
+    asyncio.run(archive.record(GROUP, 200, "first"))
+    archive.close()
+    clock.value = 200.0
+    asyncio.run(archive.record(PROFESSOR, 200, "second"))
+    archive.close()
+
+    # Загруженный индекс дополняется новыми записями
+    assert archive.read(archive.find(EntityType.PROFESSOR, 2)) == "second"
+    replay = Archive(str(tmp_path))
+    assert replay.read(replay.find(EntityType.GROUP, 1)) == "first"
+    assert replay.read(replay.find(EntityType.PROFESSOR, 2)) == "second"
+
+
+def test_truncated_index_line_is_skipped(tmp_path, clock):
+    archive = Archive(str(tmp_path))
+    asyncio.run(archive.record(GROUP, 200, "complete"))
+    archive.close()
+    with open(archive.index_path, "a", encoding="utf-8") as index_file:
+        index_file.write('{"entity_type": "group", "entity_id": 1, "times')
+
+    replay = Archive(str(tmp_path))
+    assert replay.read(replay.find(EntityType.GROUP, 1)) == "complete"
+
+
+class FakeResponse:
+    def __init__(self, status: int, html: str):
+        self.status = status
+        self.html = html
+
+    async def text(self) -> str:
+        return self.html
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ClientResponseError(None, (), status=self.status)
+
+
+class FakeSession:
+    def __init__(self, status: int, html: str):
+        self.response = FakeResponse(status, html)
+
+    @asynccontextmanager
+    async def get(self, url: str):
+        yield self.response
+
+
+def test_parser_records_after_slot_and_replays(tmp_path, clock, monkeypatch):
+    archive = Archive(str(tmp_path))
+    limiter = AdaptiveLimiter(
+        initial=1, min_limit=1, max_limit=1, latency_target=1, error_rate_target=1
+    )
+    in_flight = []
+    record = archive.record
+
+    async def tracked_record(*args):
+        # Сжатие и запись не должны занимать слот лимитера
+        in_flight.append(limiter.in_flight)
+        await record(*args)
+
+    monkeypatch.setattr(archive, "record", tracked_record)
+    monkeypatch.setattr(parser_module, "archive", archive)
+    monkeypatch.setattr(settings, "FETCH_MODE", "record")
+
+    async def fetch(entity, session):
+        return await Parser._fetch_timetable(entity, session, limiter)
+
+    assert asyncio.run(fetch(GROUP, FakeSession(200, "<html>1</html>"))) == (
+        "<html>1</html>"
+    )
+    with pytest.raises(ClientResponseError):
+        asyncio.run(fetch(PROFESSOR, FakeSession(503, "busy")))
+    assert in_flight == [0, 0]
+    archive.close()
+
+    # Воспроизведение отдает записанные ответы без обращения к сессии
+    monkeypatch.setattr(parser_module, "archive", Archive(str(tmp_path)))
+    monkeypatch.setattr(settings, "FETCH_MODE", "replay")
+    monkeypatch.setattr(settings, "ARCHIVE_REPLAY_AT", None)
+    assert asyncio.run(fetch(GROUP, None)) == "<html>1</html>"
+    with pytest.raises(Exception, match="status 503"):
+        asyncio.run(fetch(PROFESSOR, None))
+    with pytest.raises(LookupError):
+        asyncio.run(fetch(Entity(EntityType.GROUP, 3), None))
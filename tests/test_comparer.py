@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+from dataclasses import replace
+from datetime import time
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from comparer import Comparer  # noqa: E402
+from parser_types import (  # noqa: E402
+    ChangeType,
+    DayName,
+    Entity,
+    EntityType,
+    Lesson,
+    LessonType,
+    Metadata,
+    ScheduleType,
+    Semester,
+    TimetableData,
+    WeekNumber,
+)
+
+ENTITY = Entity(EntityType.GROUP, 1, "БПИ23-01")
+METADATA = Metadata(
+    years="2024/2025", date=None, week_number=WeekNumber.ODD, semester=Semester.FIRST
+)
+MATH = Lesson(
+    schedule_type=ScheduleType.REGULAR,
+    time_begin=time(8, 0),
+    lesson_name="Математика",
+    week_number=WeekNumber.ODD,
+    day_name=DayName.MONDAY,
+    lesson_type=LessonType.LECTURE,
+    professors=["Иванов И. И."],
+    auditorium="Л-1",
+)
+PHYSICS = replace(MATH, time_begin=time(9, 40), lesson_name="Физика")
+
+
+def _timetable(*lessons: Lesson, metadata: Metadata = METADATA) -> TimetableData:
+    return TimetableData(entity=ENTITY, metadata=metadata, lessons=list(lessons))
+
+
+def _changes(*timetables: TimetableData):
+    """Изменения между соседними состояниями расписания."""
+    changes = [
+        asyncio.run(Comparer.compare_timetables(old, new))
+        for old, new in zip(timetables, timetables[1:])
+    ]
+    assert all(changes)
+    return changes
+
+
+def test_added_then_removed_cancels():
+    changes = _changes(_timetable(MATH), _timetable(MATH, PHYSICS), _timetable(MATH))
+    assert Comparer.merge_changes(changes) is None
+
+
+def test_removed_then_added_back_cancels():
+    changes = _changes(
+        _timetable(MATH, PHYSICS), _timetable(MATH), _timetable(MATH, PHYSICS)
+    )
+    assert Comparer.merge_changes(changes) is None
+
+
+def test_reverted_field_dropped():
+    moved = replace(MATH, auditorium="Л-2")
+    # Аудитория вернулась, а вид занятия изменился окончательно
+    practice = replace(MATH, lesson_type=LessonType.PRACTICE)
+    changes = _changes(_timetable(MATH), _timetable(moved), _timetable(practice))
+
+    merged = Comparer.merge_changes(changes)
+
+    assert [change.change_type for change in merged.lesson_changes] == [
+        ChangeType.LESSON_MODIFIED
+    ]
+    [lesson_change] = merged.lesson_changes
+    assert lesson_change.old_lesson == MATH
+    assert lesson_change.new_lesson == practice
+    assert [field.field_name for field in lesson_change.field_changes] == [
+        "lesson_type"
+    ]
+
+
+def test_added_then_modified_is_added():
+    moved = replace(PHYSICS, auditorium="Л-2")
+    changes = _changes(
+        _timetable(MATH), _timetable(MATH, PHYSICS), _timetable(MATH, moved)
+    )
+
+    merged = Comparer.merge_changes(changes)
+
+    [lesson_change] = merged.lesson_changes
+    assert lesson_change.change_type == ChangeType.LESSON_ADDED
+    assert lesson_change.old_lesson is None
+    assert lesson_change.new_lesson == moved
+
+
+def test_full_cancellation_returns_none():
+    # Занятие, поле занятия и метаданные меняются и возвращаются обратно
+    even = replace(METADATA, week_number=WeekNumber.EVEN)
+    moved = replace(MATH, auditorium="Л-2")
+    changes = _changes(
+        _timetable(MATH),
+        _timetable(moved, PHYSICS, metadata=even),
+        _timetable(moved),
+        _timetable(MATH),
+    )
+    assert Comparer.merge_changes(changes) is None
+
+
+def test_empty_changes():
+    assert Comparer.merge_changes([]) is None
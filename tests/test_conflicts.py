@@ -0,0 +1,162 @@
+import os
+import sys
+from datetime import time, timedelta
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from conflicts import ConflictDetector  # noqa: E402
+from lessontable import LessonTable  # noqa: E402
+from parser_types import (  # noqa: E402
+    DayName,
+    Entity,
+    EntityType,
+    Lesson,
+    Metadata,
+    ScheduleType,
+    Semester,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+)
+
+
+def _timetable(entity: Entity, lessons) -> TimetableData:
+    return TimetableData(
+        entity=entity,
+        metadata=Metadata(
+            years="2024/2025",
+            date=None,
+            week_number=WeekNumber.ODD,
+            semester=Semester.FIRST,
+        ),
+        lessons=lessons,
+    )
+
+
+def _lesson(name: str, begin: time, auditorium: str, **links) -> Lesson:
+    return Lesson(
+        schedule_type=ScheduleType.REGULAR,
+        time_begin=begin,
+        lesson_name=name,
+        week_number=WeekNumber.ODD,
+        day_name=DayName.MONDAY,
+        auditorium=auditorium,
+        **links,
+    )
+
+
+def _conflicts(*timetables: TimetableData):
+    return ConflictDetector.detect(LessonTable.from_timetables(list(timetables)))
+
+
+def test_group_own_double_booking():
+    # На странице группы парсер заполняет только преподавателей
+    timetable = _timetable(
+        Entity(EntityType.GROUP, 1, "БПИ23-01"),
+        [
+            _lesson("Математика", time(8, 0), "Л-1", professors=["Иванов И. И."]),
+            _lesson("Физика", time(8, 30), "Л-2", professors=["Петров П. П."]),
+        ],
+    )
+    conflicts = _conflicts(timetable)
+    assert [(c.resource_type, c.resource) for c in conflicts] == [("group", "БПИ23-01")]
+
+
+def test_professor_own_double_booking():
+    # На странице преподавателя парсер заполняет только группы
+    timetable = _timetable(
+        Entity(EntityType.PROFESSOR, 1, "Иванов И. И."),
+        [
+            _lesson("Математика", time(8, 0), "Л-1", groups=["БПИ23-01"]),
+            _lesson("Математика", time(9, 0), "Л-2", groups=["БПИ23-02"]),
+        ],
+    )
+    conflicts = _conflicts(timetable)
+    assert [(c.resource_type, c.resource) for c in conflicts] == [
+        ("professor", "Иванов И. И.")
+    ]
+
+
+def test_auditorium_double_booking():
+    conflicts = _conflicts(
+        _timetable(
+            Entity(EntityType.GROUP, 1, "БПИ23-01"),
+            [_lesson("Математика", time(8, 0), "Л-1", professors=["Иванов И. И."])],
+        ),
+        _timetable(
+            Entity(EntityType.GROUP, 2, "БПИ23-02"),
+            [_lesson("Физика", time(9, 0), "Л-1", professors=["Петров П. П."])],
+        ),
+    )
+    assert [(c.resource_type, c.resource) for c in conflicts] == [("auditorium", "Л-1")]
+
+
+def test_lesson_merged_across_groups():
+    # Лекция потока на страницах двух групп и преподавателя — одно событие
+    lecture = dict(name="Математика", begin=time(8, 0), auditorium="Л-1")
+    conflicts = _conflicts(
+        _timetable(
+            Entity(EntityType.GROUP, 1, "БПИ23-01"),
+            [_lesson(**lecture, professors=["Иванов И. И."])],
+        ),
+        _timetable(
+            Entity(EntityType.GROUP, 2, "БПИ23-02"),
+            [_lesson(**lecture, professors=["Иванов И. И."])],
+        ),
+        _timetable(
+            Entity(EntityType.PROFESSOR, 1, "Иванов И. И."),
+            [_lesson(**lecture, groups=["БПИ23-01", "БПИ23-02"])],
+        ),
+    )
+    assert conflicts == []
+
+
+def test_different_subgroups():
+    timetable = _timetable(
+        Entity(EntityType.GROUP, 1, "БПИ23-01"),
+        [
+            _lesson(
+                "Информатика",
+                time(8, 0),
+                "Л-1",
+                professors=["Иванов И. И."],
+                subgroups=Subgroup.FIRST,
+            ),
+            _lesson(
+                "Информатика",
+                time(8, 0),
+                "Л-2",
+                professors=["Петров П. П."],
+                subgroups=Subgroup.SECOND,
+            ),
+        ],
+    )
+    assert _conflicts(timetable) == []
+
+
+def test_back_to_back_lessons():
+    # Конец первого занятия совпадает с началом второго
+    duration = timedelta(minutes=90)
+    timetable = _timetable(
+        Entity(EntityType.GROUP, 1, "БПИ23-01"),
+        [
+            _lesson(
+                "Математика",
+                time(8, 0),
+                "Л-1",
+                professors=["Иванов И. И."],
+                duration=duration,
+            ),
+            _lesson(
+                "Физика",
+                time(9, 30),
+                "Л-1",
+                professors=["Иванов И. И."],
+                duration=duration,
+            ),
+        ],
+    )
+    assert _conflicts(timetable) == []
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from aiohttp import ClientConnectionError  # noqa: E402
+from limiter import AdaptiveLimiter  # noqa: E402
+
+
+def _limiter(**kwargs) -> AdaptiveLimiter:
+    options = dict(
+        initial=4,
+        min_limit=1,
+        max_limit=8,
+        latency_target=1.0,
+        error_rate_target=0.1,
+    )
+    options.update(kwargs)
+    return AdaptiveLimiter(**options)
+
+
+def _successes(limiter: AdaptiveLimiter, count: int, latency: float = 0.0):
+    for _ in range(count):
+        limiter.record(latency)
+
+
+def test_additive_increase_per_window():
+    limiter = _limiter()
+    # Лимит растет на единицу за окно из limit успешных запросов
+    _successes(limiter, 3)
+    assert limiter.current_limit == 4
+    _successes(limiter, 1)
+    assert limiter.current_limit == 5
+    _successes(limiter, 5)
+    assert limiter.current_limit == 6
+
+
+def test_increase_clamped_to_max():
+    limiter = _limiter(initial=7, max_limit=8)
+    _successes(limiter, 100)
+    assert limiter.current_limit == 8
+
+
+def test_multiplicative_decrease_on_congestion():
+    limiter = _limiter(initial=8)
+    limiter.record(0.0, asyncio.TimeoutError())
+    assert limiter.current_limit == 4
+    limiter.record(0.0, ClientConnectionError())
+    assert limiter.current_limit == 2
+
+
+def test_decrease_clamped_to_min():
+    limiter = _limiter(initial=4, min_limit=2)
+    for _ in range(5):
+        limiter.record(0.0, asyncio.TimeoutError())
+    assert limiter.current_limit == 2
+
+
+def test_initial_clamped_to_bounds():
+    assert _limiter(initial=100, max_limit=8).current_limit == 8
+    assert _limiter(initial=0, min_limit=2).current_limit == 2
+
+
+def test_slow_window_decreases():
+    limiter = _limiter(initial=4, latency_target=0.5)
+    # Окно из limit успешных запросов с p95 выше цели уменьшает лимит на 10%
+    _successes(limiter, 4, latency=0.0)
+    assert limiter.current_limit == 5
+    _successes(limiter, 5, latency=2.0)
+    assert limiter.current_limit == 4
+
+
+def test_non_congestion_error_keeps_limit():
+    limiter = _limiter(initial=4)
+    limiter.record(0.0, ValueError("404"))
+    assert limiter.current_limit == 4
+    assert limiter.error_rate() == 0.0
+
+
+def test_error_rate_blocks_increase():
+    limiter = _limiter(initial=2, min_limit=2, error_rate_target=0.1)
+    limiter.record(0.0, asyncio.TimeoutError())
+    _successes(limiter, 2)
+    # Одна перегрузка на три запроса выше допустимой доли ошибок
+    assert limiter.current_limit == 2
+
+
+def test_slot_accounting():
+    async def scenario():
+        limiter = _limiter(initial=2, max_limit=2)
+        release = asyncio.Event()
+        entered = []
+
+        async def request(index: int):
+            async with limiter.slot():
+                entered.append(index)
+                await release.wait()
+
+        tasks = [asyncio.create_task(request(index)) for index in range(3)]
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 2
+        assert limiter.waiting == 1
+        assert entered == [0, 1]
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.in_flight == 0
+        assert limiter.waiting == 0
+        assert entered == [0, 1, 2]
+        assert limiter.sample_count == 3
+
+    asyncio.run(scenario())
+
+
+def test_slot_records_congestion_and_releases():
+    async def scenario():
+        limiter = _limiter(initial=4)
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter.slot():
+                raise asyncio.TimeoutError()
+        assert limiter.in_flight == 0
+        assert limiter.current_limit == 2
+        assert limiter.sample_count == 1
+
+    asyncio.run(scenario())
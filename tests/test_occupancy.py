@@ -0,0 +1,115 @@
+import os
+import sys
+from datetime import time, timedelta
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from occupancy import DAY_END, DAY_START, OccupancyIndex  # noqa: E402
+from parser_types import DayName, Lesson, ScheduleType, WeekNumber  # noqa: E402
+
+ODD, EVEN = WeekNumber.ODD, WeekNumber.EVEN
+MONDAY, SATURDAY = DayName.MONDAY, DayName.SATURDAY
+
+
+def _minutes(hour: int, minute: int = 0) -> int:
+    return hour * 60 + minute
+
+
+def _lesson(
+    begin: time, week: WeekNumber = ODD, day: DayName = MONDAY, minutes: int = 90
+) -> Lesson:
+    return Lesson(
+        schedule_type=ScheduleType.REGULAR,
+        time_begin=begin,
+        lesson_name="Математика",
+        week_number=week,
+        day_name=day,
+        duration=timedelta(minutes=minutes),
+    )
+
+
+def _whole_day(week: WeekNumber, day: DayName) -> Lesson:
+    return _lesson(time(8, 0), week, day, minutes=DAY_END - DAY_START)
+
+
+def test_touching_lessons():
+    index = OccupancyIndex()
+    # 8:00-9:30 и 9:30-11:00 сливаются в один интервал
+    index.set_room("Л-1", [_lesson(time(8, 0)), _lesson(time(9, 30))])
+    index.set_room("Л-2", [])
+
+    assert index.rooms["Л-1"][(ODD, MONDAY)] == ([_minutes(8)], [_minutes(11)])
+    # Промежуток, который заканчивается в начале занятия или начинается в его
+    # конце, свободен
+    assert index.free_rooms(ODD, MONDAY, _minutes(7), _minutes(8)) == ["Л-1", "Л-2"]
+    assert index.free_rooms(ODD, MONDAY, _minutes(11), _minutes(12)) == ["Л-1", "Л-2"]
+    assert index.free_rooms(ODD, MONDAY, _minutes(10, 59), _minutes(12)) == ["Л-2"]
+    assert index.is_free("Л-1", ODD, MONDAY, _minutes(11), _minutes(12))
+    assert not index.is_free("Л-1", ODD, MONDAY, _minutes(7), _minutes(8, 1))
+
+
+def test_first_gap_touching_and_exact():
+    intervals = ([_minutes(8), _minutes(11)], [_minutes(9, 30), _minutes(12, 30)])
+    # Промежуток 9:30-11:00 ровно в одну пару
+    assert OccupancyIndex._first_gap(intervals, _minutes(8), 90) == (
+        _minutes(9, 30),
+        _minutes(11),
+    )
+    # Курсор на конце интервала: интервал уже закончился
+    assert OccupancyIndex._first_gap(intervals, _minutes(12, 30), 90) == (
+        _minutes(12, 30),
+        DAY_END,
+    )
+    assert OccupancyIndex._first_gap(intervals, _minutes(8), 91) == (
+        _minutes(12, 30),
+        DAY_END,
+    )
+    assert OccupancyIndex._first_gap(None, DAY_END - 90, 90) == (DAY_END - 90, DAY_END)
+    assert OccupancyIndex._first_gap(None, DAY_END - 89, 90) is None
+
+
+def test_next_free_wraps_to_next_week():
+    index = OccupancyIndex()
+    index.set_room("Л-1", [_whole_day(EVEN, SATURDAY)])
+
+    # Суббота второй недели занята, следующий день цикла — понедельник первой
+    assert index.next_free("Л-1", EVEN, SATURDAY, DAY_START) == (
+        ODD,
+        MONDAY,
+        DAY_START,
+        DAY_END,
+    )
+
+
+def test_next_free_wraps_to_same_day_of_next_cycle():
+    index = OccupancyIndex()
+    # Свободно только утро понедельника первой недели, и поиск начат после него
+    lessons = [
+        _whole_day(week, day)
+        for week in WeekNumber
+        for day in DayName
+        if (week, day) != (ODD, MONDAY)
+    ]
+    lessons.append(_lesson(time(9, 30), ODD, MONDAY, minutes=DAY_END - _minutes(9, 30)))
+    index.set_room("Л-1", lessons)
+
+    assert index.next_free("Л-1", ODD, MONDAY, _minutes(10)) == (
+        ODD,
+        MONDAY,
+        DAY_START,
+        _minutes(9, 30),
+    )
+    assert index.next_free("Л-1", ODD, MONDAY, _minutes(10), duration=91) is None
+
+
+def test_missing_room():
+    index = OccupancyIndex()
+    index.set_room("Л-1", [_lesson(time(8, 0))])
+
+    assert index.next_free("Л-404", ODD, MONDAY, DAY_START) is None
+    assert index.is_free("Л-404", ODD, MONDAY, DAY_START, DAY_END)
+    assert "Л-404" not in index.free_rooms(ODD, MONDAY, DAY_START, DAY_END)
+    assert index.free_rooms(ODD, MONDAY, DAY_START, DAY_END, building="К") == []
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+# Модулям app нужны адреса MongoDB и RabbitMQ в Settings
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("RABBITMQ_URI", "amqp://localhost")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from aiohttp import ClientResponseError, ClientSession, ClientTimeout  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+from config import settings  # noqa: E402
+from limiter import AdaptiveLimiter  # noqa: E402
+from parser import Parser  # noqa: E402
+from parser_types import Entity, EntityType  # noqa: E402
+from retrier import HEDGE_MIN_SAMPLES, Retrier, RetryBudget  # noqa: E402
+from standin import Standin  # noqa: E402
+
+ENTITY = Entity(EntityType.GROUP, 1)
+
+
+class FakeResponse:
+    def __init__(self, status: int = 200, html: str = "<html></html>"):
+        self.status = status
+        self.html = html
+
+    async def text(self) -> str:
+        return self.html
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ClientResponseError(None, (), status=self.status)
+
+
+class FakeSession:
+    """Отвечает по очереди заданными (задержка, статус); последний ответ
+    повторяется. Считает запросы, отмены и незавершенные запросы."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+        self.active = 0
+        self.cancelled = 0
+
+    @asynccontextmanager
+    async def get(self, url: str):
+        delay, status = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        self.active += 1
+        try:
+            await asyncio.sleep(delay)
+            yield FakeResponse(status)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+def _limiter(limit: int = 4) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        initial=limit,
+        min_limit=limit,
+        max_limit=limit,
+        latency_target=10.0,
+        error_rate_target=1.0,
+    )
+
+
+def _fetch(session, limiter=None, **options):
+    retrier = Retrier(
+        retries=options.get("retries", 3),
+        base_delay=0.0,
+        budget=options.get("budget", RetryBudget(ratio=1.0)),
+        limiter=limiter,
+        hedging=options.get("hedging", False),
+    )
+    fetch = retrier.call(lambda: Parser._fetch_timetable(ENTITY, session, limiter))
+    return retrier, fetch
+
+
+def test_retries_congestion_until_success():
+    session = FakeSession((0, 503), (0, 503), (0, 200))
+    retrier, fetch = _fetch(session)
+    assert asyncio.run(fetch) == "<html></html>"
+    assert session.calls == 3
+    assert retrier.retried == 2
+
+
+def test_gives_up_after_retries():
+    session = FakeSession((0, 503))
+    retrier, fetch = _fetch(session, retries=2)
+    with pytest.raises(ClientResponseError):
+        asyncio.run(fetch)
+    assert session.calls == 3
+
+
+def test_not_congestion_is_not_retried():
+    session = FakeSession((0, 404))
+    retrier, fetch = _fetch(session)
+    with pytest.raises(ClientResponseError):
+        asyncio.run(fetch)
+    assert session.calls == 1
+    assert retrier.retried == 0
+
+
+def test_budget_limits_retries():
+    # Пустой бюджет без пополнения: после одного повтора ошибка пробрасывается
+    budget = RetryBudget(ratio=0.0, min_tokens=1)
+    session = FakeSession((0, 503))
+    retrier, fetch = _fetch(session, retries=5, budget=budget)
+    with pytest.raises(ClientResponseError):
+        asyncio.run(fetch)
+    assert session.calls == 2
+    assert retrier.retried == 1
+    assert budget.tokens == 0
+
+
+def test_deadline_aborts_slow_request(monkeypatch):
+    async def scenario():
+        server = TestServer(Standin(latency="fixed:0.5").app())
+        await server.start_server()
+        monkeypatch.setattr(settings, "TIMETABLE_BASE_URL", str(server.make_url("")))
+        try:
+            async with ClientSession(timeout=ClientTimeout(total=0.1)) as session:
+                retrier, fetch = _fetch(session, retries=1)
+                start_time = time.perf_counter()
+                with pytest.raises(asyncio.TimeoutError):
+                    await fetch
+                # Две попытки по 0.1 с, а не ответ сервера через 0.5 с
+                assert time.perf_counter() - start_time < 0.45
+                assert retrier.retried == 1
+        finally:
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def _warm(limiter: AdaptiveLimiter, latency: float = 0.01):
+    for _ in range(HEDGE_MIN_SAMPLES):
+        limiter.record(latency)
+
+
+def test_hedge_takes_slot_and_cancels_primary():
+    async def scenario():
+        limiter = _limiter(limit=4)
+        _warm(limiter)
+        session = FakeSession((10, 200), (0, 200))
+        original_get = session.get
+        limiter_in_flight = []
+
+        @asynccontextmanager
+        async def get(url: str):
+            # Дубликат запрашивается, пока первый запрос держит свой слот
+            limiter_in_flight.append(limiter.in_flight)
+            async with original_get(url) as response:
+                yield response
+
+        session.get = get
+        retrier, fetch = _fetch(session, limiter, hedging=True)
+        assert await fetch == "<html></html>"
+        assert retrier.hedged == 1
+        assert limiter_in_flight == [1, 2]
+        # Отмененный первый запрос дожидается до возврата и освобождает слот
+        assert session.cancelled == 1
+        assert session.active == 0
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_without_free_slot():
+    async def scenario():
+        limiter = _limiter(limit=1)
+        _warm(limiter)
+        session = FakeSession((0.1, 200), (0, 200))
+        retrier, fetch = _fetch(session, limiter, hedging=True)
+        assert await fetch == "<html></html>"
+        assert retrier.hedged == 0
+        assert session.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_without_budget():
+    async def scenario():
+        limiter = _limiter(limit=4)
+        _warm(limiter)
+        budget = RetryBudget(ratio=0.0, min_tokens=0)
+        session = FakeSession((0.1, 200), (0, 200))
+        retrier, fetch = _fetch(session, limiter, hedging=True, budget=budget)
+        assert await fetch == "<html></html>"
+        assert retrier.hedged == 0
+        assert session.calls == 1
+
+    asyncio.run(scenario())